@@ -0,0 +1,155 @@
+import sys
+import os
+import time
+import tempfile
+import shutil
+import numpy as np
+import tifffile
+from scNodes.core.datatypes import ParticleData, Dataset, BulkLoader
+import scNodes.core.settings as settings
+
+# Timing of operations that scale with the size of the data. Run as:
+#   python -m scNodes.core.benchmark particles [n_particles ...]
+# e.g. 'python -m scNodes.core.benchmark particles 1000000 10000000 50000000'. Note that 50M localizations require ~5 GB of memory.
+#   python -m scNodes.core.benchmark frames [n_frames] [frame_size]
+# e.g. 'python -m scNodes.core.benchmark frames 10000 2048'. Note that the test stack is written to the temp directory (~84 GB for these values).
+#   python -m scNodes.core.benchmark loading [n_frames] [frame_size]
+# e.g. 'python -m scNodes.core.benchmark loading 2000 512', for a zlib-compressed stack and a folder of single-frame files.
+
+DEFAULT_SIZES = [1000000, 10000000, 50000000]
+PARTICLES_PER_FRAME = 5000
+
+
+def synthetic_particle_data(n_particles, uncertainty_estimator=0, img_size=512, seed=0):
+    """
+    :param n_particles: number of localizations to generate.
+    :param uncertainty_estimator: 0 (Thompson) or 1 (Mortensen), see ParticleData.bake.
+    :return: unbaked ParticleData object, filled in chunks of PARTICLES_PER_FRAME localizations in the same way as the PSF fitting node fills it.
+    """
+    rng = np.random.default_rng(seed)
+    pdata = ParticleData(pixel_size=100)
+    pdata.uncertainty_estimator = uncertainty_estimator
+    for i, start in enumerate(range(0, n_particles, PARTICLES_PER_FRAME)):
+        n = min(PARTICLES_PER_FRAME, n_particles - start)
+        particles = dict()
+        particles["frame"] = np.full(n, i, dtype=np.int32)
+        particles["x [nm]"] = rng.uniform(0, img_size, n).astype(np.float32)
+        particles["y [nm]"] = rng.uniform(0, img_size, n).astype(np.float32)
+        particles["sigma [nm]"] = rng.normal(1.5, 0.2, n).astype(np.float32)
+        particles["intensity [counts]"] = rng.uniform(500, 5000, n).astype(np.float32)
+        particles["offset [counts]"] = rng.uniform(90, 110, n).astype(np.float32)
+        particles["bkgstd [counts]"] = rng.uniform(5, 15, n).astype(np.float32)
+        particles["chi_square"] = rng.uniform(0, 1000, n).astype(np.float32)
+        pdata += particles
+    return pdata
+
+
+def benchmark_particle_data(sizes=None):
+    """
+    Time ParticleData.bake() and ParticleData.apply_filter() for synthetic datasets of the given sizes.
+    :param sizes: list of numbers of localizations; defaults to DEFAULT_SIZES.
+    :return: list of dicts with the timings (in seconds) for every size.
+    """
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    results = list()
+    for n in sizes:
+        pdata = synthetic_particle_data(n)
+        t = time.time()
+        pdata.bake()
+        t_bake = time.time() - t
+        t = time.time()
+        pdata.apply_filter("intensity [counts]", 1000.0, 4000.0)
+        pdata.apply_filter("sigma [nm]", 100.0, 200.0, logic_not=True)
+        t_filter = (time.time() - t) / 2
+        results.append({"n_particles": n, "bake": t_bake, "apply_filter": t_filter})
+        print(f"{n:>12d} particles: bake {t_bake:.3f} s, apply_filter {t_filter:.3f} s")
+        del pdata
+    return results
+
+
+def benchmark_frame_pipeline(n_frames=10000, frame_size=2048, precisions=(np.float64, np.float32)):
+    """
+    Write a uint16 test stack, then load every frame (as Frame.load() does for the nodes) once for every working precision
+    and report the throughput and the memory used by the loaded pixel data.
+    :param n_frames: number of frames in the test stack.
+    :param frame_size: width and height of the frames.
+    :param precisions: list of dtypes to use as settings.working_precision.
+    :return: list of dicts with, for every precision, the load time per frame (s), the throughput (frames/s and MB/s of raw data), and the size in bytes of one loaded frame.
+    """
+    path = os.path.join(tempfile.gettempdir(), f"scNodes_benchmark_{n_frames}x{frame_size}.tif")
+    rng = np.random.default_rng(0)
+    frame = rng.integers(100, 1000, (frame_size, frame_size), dtype=np.uint16)
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        for _ in range(n_frames):
+            tif.write(frame, contiguous=True)
+
+    original_precision = settings.working_precision
+    results = list()
+    try:
+        for precision in precisions:
+            settings.working_precision = precision
+            dataset = Dataset(path)
+            t = time.time()
+            for i in range(dataset.n_frames):
+                f = dataset.frames[i]
+                f.clean()
+                pxd = f.load()
+                f.clean()
+            t_frame = (time.time() - t) / n_frames
+            results.append({"precision": np.dtype(precision).name, "load": t_frame, "frames_per_s": 1 / t_frame, "MB_per_s": frame.nbytes / t_frame / 1e6, "bytes_per_frame": pxd.nbytes})
+            print(f"{np.dtype(precision).name:>8}: {1 / t_frame:.1f} frames/s, {frame.nbytes / t_frame / 1e6:.1f} MB/s, {pxd.nbytes / 1e6:.1f} MB per loaded frame ({pxd.nbytes * n_frames / 1e9:.1f} GB for the full stack)")
+            dataset.frames[0].source.close()
+    finally:
+        settings.working_precision = original_precision
+        os.remove(path)
+    return results
+
+
+def benchmark_bulk_loading(n_frames=2000, frame_size=512, n_workers=(1, None)):
+    """
+    Write a zlib-compressed uint16 test stack and a folder with the same frames as single-frame files, then load all
+    frames into the dataset's cache with a BulkLoader (as the LoadDataNode does when not loading on the fly) for every
+    number of worker threads.
+    :param n_frames: number of frames.
+    :param frame_size: width and height of the frames.
+    :param n_workers: list of numbers of worker threads; None for the number of CPUs.
+    :return: list of dicts with, for both datasets and every number of workers, the throughput in frames/s and MB/s.
+    """
+    directory = tempfile.mkdtemp(prefix="scNodes_benchmark_")
+    stack_path = os.path.join(directory, "stack.tif")
+    folder = os.path.join(directory, "folder")
+    os.mkdir(folder)
+    rng = np.random.default_rng(0)
+    with tifffile.TiffWriter(stack_path) as tif:
+        for i in range(n_frames):
+            frame = rng.poisson(100, (frame_size, frame_size)).astype(np.uint16)
+            tif.write(frame, compression='zlib')
+            tifffile.imwrite(os.path.join(folder, f"frame_{i}.tif"), frame)
+
+    results = list()
+    try:
+        for name, path in [("zlib stack", stack_path), ("folder", os.path.join(folder, "frame_0.tif"))]:
+            for n in n_workers:
+                dataset = Dataset(path)
+                dataset.set_cache_size(np.iinfo(np.int64).max)
+                loader = BulkLoader(dataset, n_workers=n)
+                loader.start()
+                loader.thread.join()
+                frames_per_s, mb_per_s = loader.get_throughput()
+                results.append({"dataset": name, "n_workers": loader.n_workers, "frames_per_s": frames_per_s, "MB_per_s": mb_per_s})
+                print(f"{name:>10}, {loader.n_workers:>3d} workers: {frames_per_s:.1f} frames/s, {mb_per_s:.1f} MB/s")
+                if dataset.source is not None:
+                    dataset.source.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "frames":
+        benchmark_frame_pipeline(*[int(float(s)) for s in sys.argv[2:4]])
+    elif len(sys.argv) > 1 and sys.argv[1] == "loading":
+        benchmark_bulk_loading(*[int(float(s)) for s in sys.argv[2:4]])
+    else:
+        args = sys.argv[2:] if len(sys.argv) > 1 and sys.argv[1] == "particles" else sys.argv[1:]
+        benchmark_particle_data([int(float(s)) for s in args] if len(args) > 0 else None)
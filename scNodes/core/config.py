@@ -88,6 +88,7 @@ ce_tool_menu_names = {'Transform': True, 'Visuals': True, 'Export': True, 'Measu
 node_editor_relink = False
 correlation_editor_relink = False
 pickle_temp = dict()
+execution_plans = dict()  # thread id: the ExecutionPlan (see core/node.py) that is being evaluated in that thread, if any.
 
 editors = ["Node Editor", "Correlation Editor"]##, "Segmentation Editor"]
 se_enabled = True
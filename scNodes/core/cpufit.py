@@ -0,0 +1,248 @@
+import numpy as np
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scNodes.core import config as cfg
+
+# CPU implementation of the subset of the pyGpufit API that is used by particlefitting.py: batched, constrained
+# Levenberg-Marquardt fitting of (elliptical) 2D Gaussians with either a least squares or a maximum likelihood estimator.
+# The ID / type / state constants below are equal to those in pygpufit.gpufit, so that fits, constraint arrays, and
+# outputs can be used interchangeably between the GPU and the CPU implementation.
+# Original GPU implementation: Przybylski et al. (2017) Gpufit: An open-source toolkit for GPU-accelerated curve fitting.
+# Sci. Rep. 7:15722. doi: 10.1038/s41598-017-15313-9
+
+
+class ModelID:
+    GAUSS_2D = 1
+    GAUSS_2D_ELLIPTIC = 2
+
+
+class EstimatorID:
+    LSE = 0
+    MLE = 1
+
+
+class ConstraintType:
+    FREE = 0
+    LOWER = 1
+    UPPER = 2
+    LOWER_UPPER = 3
+
+
+class State:
+    CONVERGED = 0
+    MAX_ITERATION = 1
+    SINGULAR_HESSIAN = 2
+    NEG_CURVATURE_MLE = 3
+
+
+MIN_ROIS_PER_THREAD = 256  # fits are not split over more threads than needed to give every thread at least this many ROIs.
+LAMBDA_INITIAL = 1e-3
+LAMBDA_MAX = 1e10
+_pools = dict()  # number of threads: ThreadPoolExecutor; see get_pool.
+_pools_lock = threading.Lock()
+
+
+def gauss_2d(p, x, y, jacobian=True):
+    """
+    :param p: (n, 5) array of parameters: amplitude, x, y, sigma, offset
+    :param x: (n_points,) array with the x coordinate of every point in a ROI
+    :param y: (n_points,) array with the y coordinate of every point in a ROI
+    :param jacobian: if False, the jacobian is not computed and None is returned in its place.
+    :return: tuple (model, jacobian), with model of shape (n, n_points) and jacobian of shape (n, n_points, 5)
+    """
+    dx = x[None, :] - p[:, 1:2]
+    dy = y[None, :] - p[:, 2:3]
+    s2 = p[:, 3:4] ** 2
+    r2 = dx ** 2 + dy ** 2
+    e = np.exp(-r2 / (2 * s2))
+    ae = p[:, 0:1] * e
+    if not jacobian:
+        return ae + p[:, 4:5], None
+    jac = np.empty(e.shape + (5,))
+    jac[..., 0] = e
+    jac[..., 1] = ae * dx / s2
+    jac[..., 2] = ae * dy / s2
+    jac[..., 3] = ae * r2 / (s2 * p[:, 3:4])
+    jac[..., 4] = 1.0
+    return ae + p[:, 4:5], jac
+
+
+def gauss_2d_elliptic(p, x, y, jacobian=True):
+    """
+    :param p: (n, 6) array of parameters: amplitude, x, y, sigma x, sigma y, offset
+    :param x: (n_points,) array with the x coordinate of every point in a ROI
+    :param y: (n_points,) array with the y coordinate of every point in a ROI
+    :param jacobian: if False, the jacobian is not computed and None is returned in its place.
+    :return: tuple (model, jacobian), with model of shape (n, n_points) and jacobian of shape (n, n_points, 6)
+    """
+    dx = x[None, :] - p[:, 1:2]
+    dy = y[None, :] - p[:, 2:3]
+    sx2 = p[:, 3:4] ** 2
+    sy2 = p[:, 4:5] ** 2
+    e = np.exp(-(dx ** 2 / (2 * sx2) + dy ** 2 / (2 * sy2)))
+    ae = p[:, 0:1] * e
+    if not jacobian:
+        return ae + p[:, 5:6], None
+    jac = np.empty(e.shape + (6,))
+    jac[..., 0] = e
+    jac[..., 1] = ae * dx / sx2
+    jac[..., 2] = ae * dy / sy2
+    jac[..., 3] = ae * dx ** 2 / (sx2 * p[:, 3:4])
+    jac[..., 4] = ae * dy ** 2 / (sy2 * p[:, 4:5])
+    jac[..., 5] = 1.0
+    return ae + p[:, 5:6], jac
+
+
+MODELS = dict()
+MODELS[ModelID.GAUSS_2D] = (gauss_2d, 5)
+MODELS[ModelID.GAUSS_2D_ELLIPTIC] = (gauss_2d_elliptic, 6)
+
+
+def roi_coordinates(n_points):
+    """gpufit convention: in a square ROI flattened to n_points values, point index i maps to x = i % size, y = i // size."""
+    size = int(np.sqrt(n_points))
+    return np.tile(np.arange(size, dtype=np.float64), size), np.repeat(np.arange(size, dtype=np.float64), size)
+
+
+def evaluate_model(model_id, parameters, n_points):
+    """:return: (n, n_points) array with the model values in every ROI for the (n, n_params) array of parameters."""
+    x, y = roi_coordinates(n_points)
+    return MODELS[model_id][0](np.asarray(parameters, dtype=np.float64), x, y, jacobian=False)[0]
+
+
+def chi_square(data, model, estimator_id):
+    if estimator_id == EstimatorID.LSE:
+        return np.sum((data - model) ** 2, axis=1)
+    model = np.maximum(model, np.finfo(np.float32).tiny)
+    positive = data > 0
+    log_term = np.where(positive, data * np.log(np.where(positive, data, 1.0) / model), 0.0)
+    return 2 * np.sum(model - data + log_term, axis=1)
+
+
+def gradient_and_hessian(data, model, jac, estimator_id):
+    """Returns the (negative half) gradient of the chi square and the approximate Hessian, shapes (n, p) and (n, p, p)."""
+    if estimator_id == EstimatorID.LSE:
+        grad = np.einsum('ij,ijk->ik', data - model, jac)
+        hess = np.einsum('ijk,ijl->ikl', jac, jac)
+    else:
+        model = np.maximum(model, np.finfo(np.float32).tiny)
+        grad = np.einsum('ij,ijk->ik', data / model - 1.0, jac)
+        hess = np.einsum('ij,ijk,ijl->ikl', data / model ** 2, jac, jac)
+    return grad, hess
+
+
+def apply_constraints(p, lower, upper, lower_mask, upper_mask):
+    p = np.where(lower_mask & (p < lower), lower, p)
+    p = np.where(upper_mask & (p > upper), upper, p)
+    return p
+
+
+def fit_chunk(data, params, model_id, estimator_id, lower, upper, lower_mask, upper_mask, tolerance, max_number_iterations):
+    """Levenberg-Marquardt fit of all ROIs in 'data' at once; every iteration operates on the subset of fits that are still running."""
+    model_fn, n_params = MODELS[model_id]
+    n_fits, n_points = data.shape
+    x, y = roi_coordinates(n_points)
+
+    states = np.full(n_fits, State.MAX_ITERATION, dtype=np.int32)
+    n_iterations = np.zeros(n_fits, dtype=np.int32)
+    params = apply_constraints(params, lower, upper, lower_mask, upper_mask)
+    model, jac = model_fn(params, x, y)
+    chi2 = chi_square(data, model, estimator_id)
+    lam = np.full(n_fits, LAMBDA_INITIAL)
+    active = np.arange(n_fits)
+    for _ in range(max_number_iterations):
+        if active.size == 0:
+            break
+        d = data[active]
+        grad, hess = gradient_and_hessian(d, model[active], jac[active], estimator_id)
+        diagonal = np.diagonal(hess, axis1=1, axis2=2)
+        if estimator_id == EstimatorID.MLE:
+            negative_curvature = np.any(diagonal < 0, axis=1)
+            states[active[negative_curvature]] = State.NEG_CURVATURE_MLE
+        else:
+            negative_curvature = np.zeros(active.size, dtype=bool)
+        a = hess + lam[active, None, None] * np.eye(n_params)[None, :, :] * diagonal[:, None, :]
+        finite = np.isfinite(a).all(axis=(1, 2))
+        a[~finite] = np.eye(n_params)
+        sign, logdet = np.linalg.slogdet(a)
+        singular = ~finite | (sign == 0) | (logdet < -69.0)
+        states[active[singular & ~negative_curvature]] = State.SINGULAR_HESSIAN
+        ok = ~(singular | negative_curvature)
+
+        idx = active[ok]
+        delta = np.linalg.solve(a[ok], grad[ok][:, :, None])[:, :, 0]
+        new_params = apply_constraints(params[idx] + delta, lower[idx], upper[idx], lower_mask, upper_mask)
+        new_model, new_jac = model_fn(new_params, x, y)
+        new_chi2 = chi_square(data[idx], new_model, estimator_id)
+        n_iterations[idx] += 1
+
+        improved = new_chi2 < chi2[idx]
+        converged = np.abs(new_chi2 - chi2[idx]) < tolerance * np.maximum(1.0, new_chi2)
+        accepted = idx[improved]
+        params[accepted] = new_params[improved]
+        model[accepted] = new_model[improved]
+        jac[accepted] = new_jac[improved]
+        chi2[accepted] = new_chi2[improved]
+        lam[accepted] *= 0.1
+        lam[idx[~improved]] *= 10.0
+        converged |= lam[idx] > LAMBDA_MAX
+        states[idx[converged]] = State.CONVERGED
+        active = idx[~converged]
+    return params, states, chi2, n_iterations
+
+
+def fit_constrained(data, weights, model_id, initial_parameters, constraints=None, constraint_types=None, tolerance=None, max_number_iterations=None, parameters_to_fit=None, estimator_id=None, user_info=None, n_threads=None):
+    """
+    Drop-in replacement for pygpufit.gpufit.fit_constrained, for the models in MODELS. The ROIs are split into chunks that are
+    fitted in parallel by a thread pool; within a chunk, all fits are processed as one vectorized array operation.
+    'weights', 'parameters_to_fit' and 'user_info' are accepted for compatibility with the gpufit signature but not used.
+    :return: tuple (parameters, states, chi_squares, number_iterations, execution_time), as in gpufit.
+    """
+    time_start = time.time()
+    if model_id not in MODELS:
+        raise Exception(f"cpufit: model with id {model_id} is not implemented.")
+    tolerance = 1e-4 if tolerance is None else tolerance
+    max_number_iterations = 25 if max_number_iterations is None else max_number_iterations
+    estimator_id = EstimatorID.LSE if estimator_id is None else estimator_id
+    n_params = MODELS[model_id][1]
+    data = np.asarray(data, dtype=np.float64)
+    params = np.array(initial_parameters, dtype=np.float64)
+    n_fits = data.shape[0]
+
+    if constraints is None:
+        constraints = np.zeros((n_fits, 2 * n_params))
+    if constraint_types is None:
+        constraint_types = np.full(n_params, ConstraintType.FREE)
+    constraints = np.asarray(constraints, dtype=np.float64)
+    constraint_types = np.asarray(constraint_types)
+    lower = constraints[:, 0::2]
+    upper = constraints[:, 1::2]
+    lower_mask = np.isin(constraint_types, [ConstraintType.LOWER, ConstraintType.LOWER_UPPER])[None, :]
+    upper_mask = np.isin(constraint_types, [ConstraintType.UPPER, ConstraintType.LOWER_UPPER])[None, :]
+
+    n_threads = cfg.n_cpus if n_threads is None else n_threads
+    n_chunks = int(max(1, min(n_threads, n_fits // MIN_ROIS_PER_THREAD)))
+    bounds = np.linspace(0, n_fits, n_chunks + 1).astype(int)
+    args = [(data[a:b], params[a:b], model_id, estimator_id, lower[a:b], upper[a:b], lower_mask, upper_mask, tolerance, max_number_iterations) for a, b in zip(bounds[:-1], bounds[1:])]
+    if n_chunks == 1:
+        results = [fit_chunk(*args[0])]
+    else:
+        results = list(get_pool(n_threads).map(lambda a: fit_chunk(*a), args))
+
+    parameters = np.concatenate([r[0] for r in results]).astype(np.float32)
+    states = np.concatenate([r[1] for r in results])
+    chi_squares = np.concatenate([r[2] for r in results]).astype(np.float32)
+    number_iterations = np.concatenate([r[3] for r in results])
+    return parameters, states, chi_squares, number_iterations, time.time() - time_start
+
+
+def get_pool(n_threads):
+    """
+    :return: the shared thread pool with n_threads workers. Pools are never shut down, as fits that run on other threads
+    (e.g. on job engine workers, see node.py) may be using them; one pool is kept for every number of threads requested.
+    """
+    with _pools_lock:
+        if n_threads not in _pools:
+            _pools[n_threads] = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix=f"cpufit{n_threads}")
+        return _pools[n_threads]
@@ -1,4 +1,4 @@
-from itertools import count
+from itertools import count, islice
 import numpy as np
 import re
 import glob
@@ -7,24 +7,1133 @@ from skimage import transform
 import pandas as pd
 import copy
 import tifffile
+import threading
+import time
+from collections import OrderedDict, deque
+import scNodes.core.settings as settings
+import os
+import struct
+import contextlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import zarr
+except ImportError:
+    zarr = None  # zarr is optional; without it, Zarr datasets can not be opened or written (see ZarrSource, ZarrWriter).
+import weakref
+
+PAGE_INDEX_EXTENSION = ".scnidx"
+PAGE_INDEX_MIN_PAGES = 256  # a page index is only saved to a sidecar file for .tif files with at least this many pages.
+RAW_EXTENSIONS = [".dat", ".raw"]
+RAW_FORMAT_KEYS = ["width", "height", "dtype", "offset", "stride", "n_frames"]
+ZARR_METADATA_FILES = [".zarray", ".zgroup", "zarr.json"]
+
+
+def get_page_index(path):
+    """
+    Get the index of the pages (IFDs) in a .tif file: either from the sidecar file (see get_page_index_path) that was
+    saved when the file was first opened, if the file's size and modification time still match, or by parsing the file.
+    :param path: path to a .tif file.
+    :return: dict with 'ifd_offsets' (file offset of every page's IFD), 'data_offsets' (file offset of every page's pixel
+    data if it is stored uncompressed and contiguously with the same shape and dtype as the first page, else -1), 'shape'
+    and 'dtype' (of the first page), 'imagej_images' (number of images according to the ImageJ metadata, or 1), 'file_size'
+    and 'file_mtime'.
+    """
+    stat = os.stat(path)
+    sidecar_path = get_page_index_path(path)
+    if os.path.isfile(sidecar_path):
+        try:
+            with np.load(sidecar_path) as sidecar:
+                if int(sidecar["file_size"]) == stat.st_size and int(sidecar["file_mtime"]) == stat.st_mtime_ns and "imagej_images" in sidecar.files:
+                    index = {key: sidecar[key] for key in sidecar.files}
+                    index["shape"] = tuple(index["shape"])
+                    index["dtype"] = str(index["dtype"])
+                    index["imagej_images"] = int(index["imagej_images"])
+                    return index
+        except Exception:
+            pass
+    index = build_page_index(path)
+    index["file_size"] = stat.st_size
+    index["file_mtime"] = stat.st_mtime_ns
+    if len(index["ifd_offsets"]) >= PAGE_INDEX_MIN_PAGES:
+        try:
+            with open(sidecar_path, 'wb') as sidecar:
+                np.savez(sidecar, **index)
+        except OSError:
+            pass  # e.g. a read-only directory; the index is then rebuilt every time the file is opened.
+    return index
+
+
+def get_page_index_path(path):
+    """
+    :return: path of the page index sidecar file of a .tif file: e.g. 'stack.tif.scnidx' for 'stack.tif'. The full file
+    name is kept so that e.g. 'stack.tif' and 'stack.tiff' have separate sidecars; as these match the '*.tif*' pattern
+    that folder datasets use, list_tif_files excludes them.
+    """
+    return path + PAGE_INDEX_EXTENSION
+
+
+def build_page_index(path):
+    """See get_page_index."""
+    with tifffile.TiffFile(path) as tif:
+        first = tif.pages.first
+        tif.pages.useframes = True  # only read the IFD offsets and data offsets of every page, not all tags.
+        tif.pages.cache = False
+        n_pages = len(tif.pages)
+        ifd_offsets = np.zeros(n_pages, dtype=np.int64)
+        data_offsets = np.full(n_pages, -1, dtype=np.int64)
+        memmappable = first.is_memmappable and len(first.shape) == 2
+        for i in range(n_pages):
+            page = tif.pages[i]
+            ifd_offsets[i] = page.offset
+            if memmappable and page.is_contiguous and page.shape == first.shape and page.dtype == first.dtype:
+                data_offsets[i] = page.dataoffsets[0]
+        imagej_images = tif.imagej_metadata.get("images", 1) if tif.is_imagej else 1
+        return {"ifd_offsets": ifd_offsets, "data_offsets": data_offsets, "shape": first.shape, "dtype": np.dtype(tif.byteorder + first.dtype.str[1:]).str, "imagej_images": imagej_images}
+
+
+def read_page_roi(fh, page, roi=None, lock=None):
+    """
+    Read a rectangular region of a .tif page, decoding only the strips or tiles that overlap with it.
+    :param fh: the tifffile FileHandle of the file that contains the page.
+    :param page: tifffile TiffPage.
+    :param roi: [x_min, y_min, x_max, y_max], the region page_data[y_min:y_max, x_min:x_max], or None for the whole page.
+    :param lock: None, or a lock that is held while reading from fh. The strips or tiles are decoded after the lock is
+    released, so that multiple threads that share the file handle can decode in parallel.
+    :return: 2D array with the pixel data in the region, in the file's dtype.
+    """
+    height, width = page.shape[:2]
+    roi = [0, 0, width, height] if roi is None else roi
+    x0, x1 = min(max(roi[0], 0), width), min(max(roi[2], 0), width)
+    y0, y1 = min(max(roi[1], 0), height), min(max(roi[3], 0), height)
+    with lock if lock is not None else contextlib.nullcontext():
+        if len(page.shape) != 2 or page.shaped[0] != 1 or page.shaped[1] != 1 or x1 <= x0 or y1 <= y0:
+            return page.asarray()[y0:y1, x0:x1]
+        if page.is_tiled:
+            segment_height, segment_width = page.tilelength, page.tilewidth
+        else:
+            segment_height, segment_width = min(page.rowsperstrip, height), width
+        n_across = -(-width // segment_width)
+        rows = range(y0 // segment_height, -(-y1 // segment_height))
+        cols = range(x0 // segment_width, -(-x1 // segment_width))
+        segments = list()
+        for i in [row * n_across + col for row in rows for col in cols]:
+            fh.seek(page.dataoffsets[i])
+            segments.append((i, fh.read(page.databytecounts[i])))
+    roi_data = np.empty((y1 - y0, x1 - x0), dtype=page.dtype)
+    for i, segment_bytes in segments:
+        segment, (_, _, y, x, _), _ = page.decode(segment_bytes, i, jpegtables=page.jpegtables)
+        segment = segment[0, :, :, 0]
+        ys, ye = max(y, y0), min(y + segment.shape[0], y1)
+        xs, xe = max(x, x0), min(x + segment.shape[1], x1)
+        roi_data[ys - y0:ye - y0, xs - x0:xe - x0] = segment[ys - y:ye - y, xs - x:xe - x]
+    return roi_data
+
+
+class TiffSource:
+    """
+    Persistent, shared read access to the frames in a multi-page .tif file. The file is opened once: if the image data are
+    stored contiguously and uncompressed, the whole stack is memory-mapped and a frame is served as a (zero-copy) view
+    into the map; otherwise, pages are decoded from a single TiffFile handle that is kept open.
+    TiffSource objects are shared between Frames, and between copies of a Frame, rather than copied (see __deepcopy__).
+    """
+    def __init__(self, path, pool=None):
+        """
+        :param path: path to a .tif file.
+        :param pool: None, or a SourcePool. Without a pool, the file is opened immediately and kept open. With a pool, only
+        the page index is read (see get_page_index); the file is opened when it is first read, and the pool limits the
+        number of files that are open at the same time.
+        """
+        self.path = path
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.tif = None
+        self.memmap = None
+        self.index = None
+        self.n_frames = 0
+        if pool is None:
+            self.open()
+        else:
+            self.index = get_page_index(self.path)
+            self.n_frames = max(len(self.index["ifd_offsets"]), self.index["imagej_images"])
+
+    def open(self):
+        self.tif = tifffile.TiffFile(self.path)
+        if self.index is None:
+            self.index = get_page_index(self.path)
+        self.n_frames = len(self.index["ifd_offsets"])
+        if self.index["imagej_images"] > self.n_frames:
+            # ImageJ hyperstacks larger than 4 GB contain a single IFD for all frames; tifffile resolves these as a series.
+            try:
+                memmap = tifffile.memmap(self.path, mode='c').view(np.ndarray)  # copy-on-write: frames can be edited in place without affecting the file.
+                self.memmap = memmap.reshape((-1,) + memmap.shape[-2:]) if memmap.ndim > 2 else memmap[np.newaxis, :, :]
+                self.n_frames = self.memmap.shape[0]
+            except Exception:
+                self.memmap = None
+        elif np.all(self.index["data_offsets"] >= 0):
+            # every page's data is stored uncompressed: map the whole file, and serve frames as views at the data offsets.
+            self.memmap = np.memmap(self.path, dtype=np.uint8, mode='c')
+
+    @property
+    def is_memmapped(self):
+        return self.memmap is not None
+
+    @property
+    def shape(self):
+        return tuple(self.index["shape"])
+
+    def read(self, index):
+        """
+        :param index: index of the frame in the stack.
+        :return: 2D array with the frame's pixel data, in the file's dtype. For memory-mapped files this is a (copy-on-write) view into the file.
+        """
+        if self.pool is not None:
+            self.pool.touch(self)
+        elif self.tif is None:
+            self.open()
+        memmap = self.memmap  # local reference, as the source may be closed by the pool while reading.
+        if memmap is not None:
+            if memmap.ndim == 3:
+                return memmap[index]
+            return np.ndarray(self.index["shape"], dtype=self.index["dtype"], buffer=memmap, offset=int(self.index["data_offsets"][index]))
+        return self.read_page(index, None)
+
+    def read_roi(self, index, roi):
+        """
+        :param index: index of the frame in the stack.
+        :param roi: [x_min, y_min, x_max, y_max], the region data[y_min:y_max, x_min:x_max] of the frame.
+        :return: 2D array with the pixel data in the region, in the file's dtype. For memory-mapped files this is a view
+        into the file, so that only the part of the file that contains the region is read; otherwise, only the strips or
+        tiles that overlap with the region are decoded (see read_page_roi).
+        """
+        if self.pool is not None:
+            self.pool.touch(self)
+        elif self.tif is None:
+            self.open()
+        if self.memmap is not None:
+            return self.read(index)[roi[1]:roi[3], roi[0]:roi[2]]
+        return self.read_page(index, roi)
+
+    def read_page(self, index, roi):
+        """
+        Decode (the region roi of) a page. The file is only accessed while holding the lock, while decoding happens
+        outside of it, so that frames of compressed files can be decoded in parallel (see BulkLoader).
+        """
+        with self.lock:
+            if self.tif is None:
+                self.open()
+            fh = self.tif.filehandle
+            fh.seek(int(self.index["ifd_offsets"][index]))
+            page = tifffile.TiffPage(self.tif, index=index)
+        return read_page_roi(fh, page, roi, self.lock)
+
+    def refresh(self):
+        """
+        Add the pages that were written to the file since it was opened, e.g. while the acquisition software is still writing
+        the stack. The IFD chain is followed from the last known page onwards, and a page is only added once its image data
+        is completely written.
+        :return: the number of frames that were added.
+        """
+        if self.tif is None:
+            self.open()
+        if self.memmap is not None and self.memmap.ndim == 3:
+            return 0  # ImageJ hyperstacks > 4 GB contain a single IFD for all frames, so new frames can not be found from the IFDs.
+        with self.lock:
+            self.tif.close()
+            self.tif = tifffile.TiffFile(self.path)  # reopened, so that the file handle's size is up to date.
+            fh = self.tif.filehandle
+            tiff = self.tif.tiff
+            file_size = os.path.getsize(self.path)
+            memmappable = self.index["data_offsets"][0] >= 0
+            ifd_offsets = list()
+            data_offsets = list()
+            offset = int(self.index["ifd_offsets"][-1])
+            while True:
+                try:
+                    fh.seek(offset)
+                    n_tags = struct.unpack(tiff.tagnoformat, fh.read(tiff.tagnosize))[0]
+                    fh.seek(offset + tiff.tagnosize + n_tags * tiff.tagsize)
+                    next_offset = struct.unpack(tiff.offsetformat, fh.read(tiff.offsetsize))[0]
+                    if next_offset == 0 or next_offset >= file_size:
+                        break
+                    fh.seek(next_offset)
+                    page = tifffile.TiffPage(self.tif, index=self.n_frames + len(ifd_offsets))
+                except (struct.error, OSError, ValueError, tifffile.TiffFileError):
+                    break  # the next IFD is not (completely) written yet.
+                if len(page.dataoffsets) == 0 or any(o + n > file_size for o, n in zip(page.dataoffsets, page.databytecounts)):
+                    break
+                ifd_offsets.append(next_offset)
+                data_offsets.append(page.dataoffsets[0] if memmappable and page.is_contiguous and page.shape == tuple(self.index["shape"]) and page.dtype == np.dtype(self.index["dtype"]) else -1)
+                offset = next_offset
+            if len(ifd_offsets) == 0:
+                return 0
+            self.index = dict(self.index)
+            self.index["ifd_offsets"] = np.concatenate([self.index["ifd_offsets"], np.asarray(ifd_offsets, dtype=np.int64)])
+            self.index["data_offsets"] = np.concatenate([self.index["data_offsets"], np.asarray(data_offsets, dtype=np.int64)])
+            self.n_frames += len(ifd_offsets)
+            if self.memmap is not None:
+                # map the file again to include the new pages; views into the previous map (e.g. in a FrameCache) remain valid.
+                self.memmap = np.memmap(self.path, dtype=np.uint8, mode='c') if np.all(self.index["data_offsets"] >= 0) else None
+            return len(ifd_offsets)
+
+    def close(self):
+        with self.lock:
+            if self.tif is not None:
+                self.tif.close()
+            self.tif = None
+            self.memmap = None
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {"path": self.path, "n_frames": self.n_frames, "pool": self.pool}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.n_frames = state["n_frames"]
+        self.pool = state.get("pool", None)
+        self.lock = threading.Lock()
+        self.tif = None
+        self.memmap = None
+        self.index = None
+
+
+def is_raw_file(path):
+    return os.path.splitext(path)[1].lower() in RAW_EXTENSIONS
+
+
+def get_raw_format(path, raw_format=None):
+    """
+    Get the description of the format of a raw binary file: from a sidecar file, path + '.json' or the path with its
+    extension replaced by '.json', if one exists; else raw_format is used.
+    :param path: path to a .dat or .raw file.
+    :param raw_format: None, or a dict with the format (see RawSource) to use if there is no sidecar file.
+    :return: dict with keyword arguments for RawSource (a subset of RAW_FORMAT_KEYS).
+    """
+    for sidecar_path in [path + ".json", os.path.splitext(path)[0] + ".json"]:
+        if os.path.isfile(sidecar_path):
+            with open(sidecar_path, 'r') as sidecar:
+                description = json.load(sidecar)
+            return {key: description[key] for key in RAW_FORMAT_KEYS if key in description}
+    if raw_format is None:
+        raise Exception(f"No description of the format of '{path}' found: specify the frame width, height, and dtype, or add a sidecar file '{os.path.basename(path)}.json' with these values.")
+    return raw_format
+
+
+class RawSource:
+    """
+    Read access to the frames in a raw binary file, as written by e.g. camera acquisition software: a header of 'offset'
+    bytes, followed by frames of height x width pixels of a single dtype, with the start of consecutive frames 'stride'
+    bytes apart (the stride exceeds the frame size when the camera writes metadata in between frames). The file is
+    memory-mapped, and frames are served as zero-copy (copy-on-write) views into the map. Offers the same interface as
+    TiffSource.
+    """
+    def __init__(self, path, width, height, dtype=np.uint16, offset=0, stride=None, n_frames=None):
+        """
+        :param n_frames: number of frames; if None, as many frames as fit in the file.
+        """
+        self.path = path
+        self.width = int(width)
+        self.height = int(height)
+        self.dtype = np.dtype(dtype)
+        self.offset = int(offset)
+        self.frame_bytes = self.width * self.height * self.dtype.itemsize
+        self.stride = self.frame_bytes if not stride else int(stride)
+        self.max_frames = n_frames
+        self.pool = None
+        self.memmap = None
+        self.n_frames = 0
+        if self.width <= 0 or self.height <= 0 or self.stride < self.frame_bytes:
+            raise Exception(f"Invalid raw data format for '{path}': {width}x{height} pixels of {self.dtype}, with a frame stride of {self.stride} bytes.")
+        self.open()
+
+    def open(self):
+        available = os.path.getsize(self.path) - self.offset - self.frame_bytes
+        self.n_frames = 0 if available < 0 else available // self.stride + 1
+        if self.max_frames is not None:
+            self.n_frames = min(self.n_frames, int(self.max_frames))
+        if self.n_frames == 0:
+            raise Exception(f"'{self.path}' does not contain a complete frame of {self.width}x{self.height} pixels of {self.dtype} after the {self.offset} byte header.")
+        self.memmap = np.memmap(self.path, dtype=np.uint8, mode='c')
+
+    @property
+    def is_memmapped(self):
+        return True
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    def read(self, index):
+        """
+        :param index: index of the frame in the file.
+        :return: 2D (copy-on-write) view of the frame's pixel data in the file.
+        """
+        memmap = self.memmap
+        if memmap is None:
+            self.open()
+            memmap = self.memmap
+        return np.ndarray((self.height, self.width), dtype=self.dtype, buffer=memmap, offset=self.offset + int(index) * self.stride)
+
+    def read_roi(self, index, roi):
+        return self.read(index)[roi[1]:roi[3], roi[0]:roi[2]]
+
+    def refresh(self):
+        """
+        Add the frames that were written to the file since it was opened, for live acquisition (see Dataset.refresh).
+        :return: the number of frames that were added.
+        """
+        n_frames = self.n_frames
+        self.open()
+        return self.n_frames - n_frames
+
+    def close(self):
+        self.memmap = None
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        state = {key: getattr(self, key) for key in ["path", "width", "height", "offset", "stride", "frame_bytes", "max_frames", "n_frames"]}
+        state["dtype"] = self.dtype.str
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dtype = np.dtype(state["dtype"])
+        self.pool = None
+        self.memmap = None
+
+
+def is_zarr_path(path):
+    path = path.rstrip("/\\")
+    return path.endswith(".zarr") or (os.path.isdir(path) and any(os.path.isfile(os.path.join(path, f)) for f in ZARR_METADATA_FILES))
+
+
+def require_zarr():
+    if zarr is None:
+        raise Exception("Reading or writing Zarr data requires the 'zarr' package - install it with 'pip install zarr'.")
+
+
+class ZarrSource:
+    """
+    Read access to the frames in a Zarr array, or in an OME-Zarr image (the full resolution level of its first multiscale
+    image). All dimensions but the last two are frame dimensions, e.g. (t, c, z) for OME-Zarr, with frames ordered as in
+    the array. The array is opened lazily, and frames are read in chunk-aligned blocks: the chunks that contain a frame are
+    decoded for all frames that they hold along the last frame axis, and the most recent blocks are kept, so that frames
+    that share chunks are not decoded again. Offers the same interface as TiffSource.
+    """
+    N_BLOCKS = 4
+
+    def __init__(self, path):
+        require_zarr()
+        self.path = path.rstrip("/\\")
+        self.pool = None
+        self.lock = threading.Lock()
+        self.array = None
+        self.frame_dims = (1,)
+        self.frames_per_chunk = 1
+        self.n_frames = 0
+        self.blocks = OrderedDict()  # (outer frame index, start): block of frames
+        self.loading = dict()  # (outer frame index, start): threading.Event, for blocks that are being decoded
+        self.open()
+
+    def open(self):
+        require_zarr()
+        node = zarr.open(self.path, mode='r')
+        if not hasattr(node, "shape"):
+            multiscales = node.attrs.get("multiscales", None)
+            if not multiscales:
+                raise Exception(f"'{self.path}' is a Zarr group without OME-Zarr 'multiscales' metadata - select an array instead.")
+            node = node[multiscales[0]["datasets"][0]["path"]]
+        if node.ndim < 2:
+            raise Exception(f"The Zarr array at '{self.path}' has {node.ndim} dimension(s) - frames must be 2D.")
+        self.array = node
+        self.frame_dims = tuple(node.shape[:-2]) if node.ndim > 2 else (1,)
+        self.frames_per_chunk = node.chunks[-3] if node.ndim > 2 else 1
+        self.n_frames = int(np.prod(self.frame_dims))
+        self.blocks = OrderedDict()
+
+    @property
+    def is_memmapped(self):
+        return False
+
+    @property
+    def shape(self):
+        return tuple(self.array.shape[-2:])
+
+    def frame_position(self, index):
+        position = tuple(int(i) for i in np.unravel_index(int(index), self.frame_dims))
+        return position[:-1], position[-1]
+
+    def read(self, index):
+        """
+        :param index: index of the frame, in C order over the frame dimensions.
+        :return: 2D array with the frame's pixel data (a copy, so that cached frames do not keep whole blocks in memory).
+        """
+        if self.array is None:
+            self.open()
+        if self.array.ndim == 2:
+            return self.array[...]
+        outer, k = self.frame_position(index)
+        start = k - k % self.frames_per_chunk
+        return self.get_block(outer, start)[k - start].copy()
+
+    def get_block(self, outer, start):
+        key = (outer, start)
+        with self.lock:
+            block = self.blocks.get(key)
+            event = self.loading.get(key)
+            is_loader = block is None and event is None
+            if is_loader:
+                self.loading[key] = threading.Event()
+        if block is not None:
+            return block
+        if not is_loader:
+            event.wait()  # another thread is decoding the same block.
+            with self.lock:
+                block = self.blocks.get(key)
+            if block is not None:
+                return block
+        stop = min(start + self.frames_per_chunk, self.frame_dims[-1])
+        try:
+            block = self.array[outer + (slice(start, stop),)]
+            with self.lock:
+                self.blocks[key] = block
+                while len(self.blocks) > ZarrSource.N_BLOCKS:
+                    self.blocks.popitem(last=False)
+        finally:
+            if is_loader:
+                with self.lock:
+                    self.loading.pop(key).set()
+        return block
+
+    def read_roi(self, index, roi):
+        """
+        :return: the pixel data in the region roi ([x_min, y_min, x_max, y_max]) of the frame; only the chunks that overlap with the region are decoded.
+        """
+        if self.array is None:
+            self.open()
+        region = (slice(roi[1], roi[3]), slice(roi[0], roi[2]))
+        if self.array.ndim == 2:
+            return self.array[region]
+        outer, k = self.frame_position(index)
+        return self.array[outer + (k,) + region]
+
+    def refresh(self):
+        """
+        :return: the number of frames that were added to the array (e.g. by a ZarrWriter that resizes it) since it was opened.
+        """
+        n_frames = self.n_frames
+        self.open()
+        return max(0, self.n_frames - n_frames)
+
+    def close(self):
+        self.array = None
+        self.blocks = OrderedDict()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {"path": self.path, "n_frames": self.n_frames}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.n_frames = state["n_frames"]
+        self.pool = None
+        self.lock = threading.Lock()
+        self.array = None
+        self.blocks = OrderedDict()
+        self.loading = dict()
+
+
+class ZarrWriter:
+    """
+    Writes frames to a chunked, compressed Zarr array of shape (n_frames, height, width). Frames can be written in any
+    order; they are collected per chunk, and every complete chunk is compressed and written by a pool of worker threads
+    (the compressors release the GIL), so that compression runs in parallel with the processing of the next frames.
+    Copies of a ZarrWriter (e.g. in a joblib worker process that received a copy of a node) can not write.
+    """
+    CHUNK_BYTES = 16e6
+
+    def __init__(self, path, n_frames, frame_shape, dtype, frames_per_chunk=None, n_workers=None):
+        """
+        :param path: path of the .zarr array to write; an existing array at that path is overwritten.
+        :param n_frames: number of frames in the array.
+        :param frame_shape: (height, width) of the frames.
+        :param dtype: dtype of the array.
+        :param frames_per_chunk: number of frames per chunk; if None, chunks are about CHUNK_BYTES in size.
+        :param n_workers: number of worker threads; defaults to the number of CPUs.
+        """
+        require_zarr()
+        self.path = path
+        self.n_frames = n_frames
+        frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+        self.frames_per_chunk = frames_per_chunk if frames_per_chunk else int(max(1, min(n_frames, ZarrWriter.CHUNK_BYTES // frame_bytes)))
+        self.array = zarr.open(path, mode='w', shape=(n_frames,) + tuple(frame_shape), chunks=(self.frames_per_chunk,) + tuple(frame_shape), dtype=dtype)
+        self.pool = ThreadPoolExecutor(max_workers=os.cpu_count() if n_workers is None else n_workers, thread_name_prefix="ZarrWriter")
+        self.pending = dict()  # chunk index: dict with the frames (index: data) of that chunk that were not yet written
+        self.futures = list()
+
+    def write(self, index, data):
+        chunk = index // self.frames_per_chunk
+        frames = self.pending.setdefault(chunk, dict())
+        frames[index] = np.asarray(data, dtype=self.array.dtype)
+        start = chunk * self.frames_per_chunk
+        stop = min(start + self.frames_per_chunk, self.n_frames)
+        if len(frames) == stop - start:
+            del self.pending[chunk]
+            self.futures.append(self.pool.submit(self._write_block, start, [frames[i] for i in range(start, stop)]))
+        self.check_errors()
+
+    def _write_block(self, start, frames):
+        self.array[start:start + len(frames)] = np.stack(frames)
+
+    def _write_frames(self, frames):
+        for index in sorted(frames):
+            self.array[index] = frames[index]
+
+    def check_errors(self):
+        """Raises the exception of any failed write, and forgets about writes that are done."""
+        done = [f for f in self.futures if f.done()]
+        self.futures = [f for f in self.futures if not f.done()]
+        for f in done:
+            f.result()
+
+    def close(self):
+        """
+        Write the frames of incomplete chunks and wait until all writes are done.
+        """
+        # Every partial write reads, edits and rewrites the whole chunk, so the frames of a chunk are written by one job.
+        for frames in self.pending.values():
+            self.futures.append(self.pool.submit(self._write_frames, frames))
+        self.pending = dict()
+        try:
+            for f in self.futures:
+                f.result()
+        finally:
+            self.futures = list()
+            self.pool.shutdown()
+
+    def abort(self):
+        """
+        Stop writing after an error: the frames of incomplete chunks are discarded, writes that did not start yet are
+        cancelled, and the worker threads are shut down. Does not raise the errors of failed writes.
+        """
+        self.pending = dict()
+        for f in self.futures:
+            f.cancel()
+        self.futures = list()
+        self.pool.shutdown()
+
+    def __getstate__(self):
+        return {"path": self.path, "n_frames": self.n_frames}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.n_frames = state["n_frames"]
+        self.array = None
+        self.pool = None
+        self.pending = dict()
+        self.futures = list()
+
+
+class SourcePool:
+    """
+    Limits the number of TiffSources (i.e., files) that are open at the same time. A source that uses the pool is opened
+    when it is read from, and when more than max_open sources are open, the least recently read one is closed; it is
+    opened again when it is next read from.
+    """
+    def __init__(self, max_open=8):
+        self.max_open = max_open
+        self.sources = OrderedDict()  # id(source): source, least recently read first
+        self.lock = threading.Lock()
+
+    def touch(self, source):
+        with self.lock:
+            if source.tif is None:
+                source.open()
+            self.sources[id(source)] = source
+            self.sources.move_to_end(id(source))
+            while len(self.sources) > self.max_open:
+                self.sources.popitem(last=False)[1].close()
+
+    def close(self):
+        with self.lock:
+            for source in self.sources.values():
+                source.close()
+            self.sources = OrderedDict()
+
+    def __getstate__(self):
+        return {"max_open": self.max_open}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_open"])
+
+
+class FrameCache:
+    """
+    Least-recently-used cache of frame pixel data, bounded by a total size in bytes.
+    """
+    def __init__(self, max_bytes=0):
+        """
+        :param max_bytes: memory budget of the cache; when 0, nothing is cached.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the cached array for key, or None if the key is not in the cache.
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if data.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = data
+            self.n_bytes += data.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def set_budget(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.n_bytes > self.max_bytes and len(self.entries) > 0:
+                _, evicted = self.entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.n_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+
+class FramePrefetcher:
+    """
+    Reads frames of a Dataset ahead of time on a background thread. Whenever frames are requested in sequential order (in
+    either direction), the next 'depth' frames in that direction are read and kept ready, so that reading from disk
+    overlaps with the processing of the current frame. Also keeps track of the time that consumers spend waiting for data.
+    """
+    def __init__(self, dataset, depth=8):
+        self.dataset = dataset
+        self.depth = depth
+        self.ready = OrderedDict()  # frame id: data
+        self.pending = deque()  # indices of frames to read
+        self.in_flight = None  # id of the frame being read by the worker thread
+        self.condition = threading.Condition()
+        self.last_index = None
+        self.step = 0
+        self.thread = None
+        self.stop_request = False
+        self.n_requests = 0
+        self.n_prefetched = 0
+        self.wait_time = 0.0
+
+    def get(self, index):
+        """
+        :param index: index of the frame in dataset.frames.
+        :return: the frame's pixel data, as read by Frame.read().
+        """
+        time_start = time.time()
+        frame = self.dataset.frames[index]
+        with self.condition:
+            self.update_access_pattern(index)
+            while self.in_flight == frame.id:
+                self.condition.wait()
+            data = self.ready.pop(frame.id, None)
+        self.n_requests += 1
+        if data is None:
+            data = frame.read()
+        else:
+            self.n_prefetched += 1
+        self.wait_time += time.time() - time_start
+        return data
+
+    def update_access_pattern(self, index):
+        step = 0 if self.last_index is None else index - self.last_index
+        sequential = step in (1, -1) and step == self.step
+        self.step = step
+        self.last_index = index
+        self.pending.clear()
+        if not sequential:
+            return
+        for i in range(index + step, index + step * (self.depth + 1), step):
+            if 0 <= i < self.dataset.n_frames:
+                self.pending.append(i)
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_request = False
+            self.thread = threading.Thread(daemon=True, target=self._run, name="FramePrefetcher")
+            self.thread.start()
+        self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.stop_request:
+                    self.condition.wait()
+                if self.stop_request:
+                    return
+                index = self.pending.popleft()
+                if index >= self.dataset.n_frames:
+                    continue
+                frame = self.dataset.frames[index]
+                if frame.id in self.ready or frame.data is not None or frame.id in self.dataset.cache:
+                    continue
+                self.in_flight = frame.id
+            try:
+                data = frame.read()
+            except Exception:
+                data = None
+            with self.condition:
+                self.in_flight = None
+                if data is not None:
+                    self.ready[frame.id] = data
+                    while len(self.ready) > 2 * self.depth:
+                        self.ready.popitem(last=False)
+                self.condition.notify_all()
+
+    def get_mean_wait_time(self):
+        return self.wait_time / max(1, self.n_requests)
+
+    def reset_stats(self):
+        self.n_requests = 0
+        self.n_prefetched = 0
+        self.wait_time = 0.0
+
+    def stop(self):
+        with self.condition:
+            self.stop_request = True
+            self.pending.clear()
+            self.ready = OrderedDict()
+            self.condition.notify_all()
+
+    def __getstate__(self):
+        return {"dataset": self.dataset, "depth": self.depth}
+
+    def __setstate__(self, state):
+        self.__init__(state["dataset"], state["depth"])
+
+
+class BulkLoader:
+    """
+    Reads frames of a Dataset into the dataset's FrameCache with a pool of worker threads, on a background thread. Files
+    are read and frames are decoded (which, for compressed .tif files, releases the GIL) in parallel, so that a folder of
+    single-frame files or a compressed stack is loaded much faster than frame by frame. Memory-mapped frames are copied
+    into memory. Keeps track of progress and throughput.
+    """
+    def __init__(self, dataset, indices=None, n_workers=None):
+        """
+        :param dataset: Dataset to load frames of.
+        :param indices: indices of the frames to load; all frames if None.
+        :param n_workers: number of worker threads; defaults to the number of CPUs.
+        """
+        self.dataset = dataset
+        self.indices = list(range(dataset.n_frames)) if indices is None else list(indices)
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self.n_loaded = 0
+        self.n_bytes = 0
+        self.time_start = 0.0
+        self.time_stop = None
+        self.thread = None
+        self.stop_request = False
+        self.error = None
+
+    def start(self):
+        self.time_start = time.time()
+        self.thread = threading.Thread(daemon=True, target=self._run, name="BulkLoader")
+        self.thread.start()
+
+    def _run(self):
+        try:
+            with ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix="BulkLoader") as pool:
+                for frame_id, data in pool.map(self._read, self.indices):
+                    if self.stop_request:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        break
+                    if data is not None:
+                        self.dataset.cache.put(frame_id, data)
+                        self.n_bytes += data.nbytes
+                    self.n_loaded += 1
+        except Exception as e:
+            self.error = e
+        self.time_stop = time.time()
+
+    def _read(self, index):
+        if self.stop_request:
+            return None, None
+        frame = self.dataset.frames[index]
+        if frame.id in self.dataset.cache:
+            return frame.id, None
+        data = frame.read()
+        if not data.flags.owndata:
+            data = data.copy()  # e.g. a view into a memory-mapped file: copied, so that the data is actually read.
+        return frame.id, data
+
+    @property
+    def done(self):
+        return self.time_stop is not None
+
+    def get_progress(self):
+        return self.n_loaded / max(1, len(self.indices))
+
+    def get_throughput(self):
+        """
+        :return: tuple (frames/s, MB/s), for the frames loaded so far.
+        """
+        t = max(1e-9, (time.time() if self.time_stop is None else self.time_stop) - self.time_start)
+        return self.n_loaded / t, self.n_bytes / t / 1e6
+
+    def stop(self):
+        self.stop_request = True
+
+
+class FrameTable:
+    """
+    The frames of a Dataset, stored as a table of typed arrays (one row per frame: file, page in the file, frame number, and
+    frame id) rather than as one Frame object per frame. A Frame object is only created when a frame is requested, and is
+    kept for as long as it is referenced elsewhere; frames that are added as Frame objects (see append) are kept as they are.
+    Supports the list operations that are used on Dataset.frames: len, indexing, iteration, 'in', index, append, and del.
+    Per-frame state such as the translation, discard flag, maxima, and metrics is not stored: nodes set it on the copies of
+    the frames that they request from the dataset (see LoadDataNode.get_image_impl), never on the dataset's frames.
+    """
+    COLUMNS = {"path_id": np.int32, "page": np.int32, "framenr": np.int32, "frame_id": np.int64}  # page -1: the file holds a single image
+
+    def __init__(self):
+        self.paths = list()
+        self.path_ids = dict()  # path: index in self.paths
+        self.sources = list()  # TiffSource or None, for every path
+        self.n = 0
+        for key, dtype in FrameTable.COLUMNS.items():
+            setattr(self, key, np.zeros(0, dtype=dtype))
+        self.live_frames = weakref.WeakValueDictionary()  # frame id: Frame, for frames created on request that are still in use
+        self.owned_frames = dict()  # frame id: Frame, for frames that were added as Frame objects
+
+    def add_path(self, path, source=None):
+        """
+        :return: the path's index in self.paths (the path is added if not yet in the table).
+        """
+        if path not in self.path_ids:
+            self.path_ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.sources.append(source)
+        elif source is not None and self.sources[self.path_ids[path]] is None:
+            self.sources[self.path_ids[path]] = source
+        return self.path_ids[path]
+
+    def add_pages(self, path, n_pages, source=None, first_page=0, first_framenr=None):
+        """
+        Add rows for pages first_page to first_page + n_pages of a multi-page file, with consecutive frame numbers starting
+        at first_framenr, or equal to the page index if first_framenr is None.
+        """
+        pages = np.arange(first_page, first_page + n_pages, dtype=np.int32)
+        framenr = pages if first_framenr is None else np.arange(first_framenr, first_framenr + n_pages, dtype=np.int32)
+        self._append(self.add_path(path, source), pages, framenr, self._new_ids(n_pages))
+
+    def add_files(self, paths):
+        """
+        Add one row for every file in paths, for the first page of that file, with consecutive frame numbers.
+        """
+        path_id = np.asarray([self.add_path(path) for path in paths], dtype=np.int32)
+        framenr = np.arange(self.n, self.n + len(paths), dtype=np.int32)
+        self._append(path_id, 0, framenr, self._new_ids(len(paths)))
+
+    def append(self, frame):
+        """
+        Add a Frame object to the end of the table. The object itself is stored, so that its data and other state is kept.
+        """
+        page = -1 if frame.index is None else frame.index
+        self._append(self.add_path(frame.path, frame.source), page, frame.framenr, frame.id)
+        self.owned_frames[frame.id] = frame
+
+    def extend(self, other):
+        """
+        Append all rows of another FrameTable.
+        """
+        path_id = np.asarray([self.add_path(path, source) for path, source in zip(other.paths, other.sources)], dtype=np.int32)
+        self._append(path_id[other.path_id[:other.n]], other.page[:other.n], other.framenr[:other.n], other.frame_id[:other.n])
+        self.owned_frames.update(other.owned_frames)
+
+    def keep(self, mask):
+        """
+        :param mask: boolean array with one value per row; rows where mask is False are removed.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        removed_ids = self.frame_id[:self.n][~mask]
+        for key in FrameTable.COLUMNS:
+            setattr(self, key, getattr(self, key)[:self.n][mask])
+        self.n = int(np.sum(mask))
+        if len(self.owned_frames) > 0 and removed_ids.size > 0:
+            owned_ids = np.asarray(list(self.owned_frames.keys()), dtype=np.int64)
+            for frame_id in owned_ids[np.isin(owned_ids, removed_ids)]:
+                self.owned_frames.pop(int(frame_id))
+
+    def index(self, frame):
+        """
+        :return: index of the first row that holds the frame: matching frame id, or else the same path and frame number (as in Frame.__eq__).
+        """
+        if isinstance(frame, Frame):
+            rows = np.flatnonzero(self.frame_id[:self.n] == frame.id)
+            if rows.size == 0 and frame.path in self.path_ids:
+                rows = np.flatnonzero((self.path_id[:self.n] == self.path_ids[frame.path]) & (self.framenr[:self.n] == frame.framenr))
+            if rows.size > 0:
+                return int(rows[0])
+        raise ValueError(f"{frame} is not in the FrameTable")
+
+    def peek(self, index):
+        """
+        :return: the Frame object for the row at index if one exists, else None (no Frame is created).
+        """
+        frame_id = int(self.frame_id[self._row(index)])
+        frame = self.owned_frames.get(frame_id)
+        return frame if frame is not None else self.live_frames.get(frame_id)
+
+    def _row(self, index):
+        index = int(index)
+        if index < 0:
+            index += self.n
+        if not 0 <= index < self.n:
+            raise IndexError("FrameTable index out of range")
+        return index
+
+    def _new_ids(self, n):
+        return np.fromiter(islice(Frame.id_gen, n), dtype=np.int64, count=n)
+
+    def _append(self, path_id, page, framenr, frame_id):
+        n_new = np.size(frame_id)
+        capacity = self.frame_id.shape[0]
+        if self.n + n_new > capacity:
+            capacity = max(self.n + n_new, 2 * capacity)
+            for key, dtype in FrameTable.COLUMNS.items():
+                column = np.zeros(capacity, dtype=dtype)
+                column[:self.n] = getattr(self, key)[:self.n]
+                setattr(self, key, column)
+        rows = slice(self.n, self.n + n_new)
+        self.path_id[rows] = path_id
+        self.page[rows] = page
+        self.framenr[rows] = framenr
+        self.frame_id[rows] = frame_id
+        self.n += n_new
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n))]
+        row = self._row(index)
+        frame = self.peek(row)
+        if frame is None:
+            path_id = self.path_id[row]
+            page = int(self.page[row])
+            frame = Frame(self.paths[path_id], None if page < 0 else page, framenr=int(self.framenr[row]), source=self.sources[path_id])
+            frame.id = int(self.frame_id[row])
+            self.live_frames[frame.id] = frame
+        return frame
+
+    def __delitem__(self, index):
+        mask = np.ones(self.n, dtype=bool)
+        mask[self._row(index)] = False
+        self.keep(mask)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def __contains__(self, frame):
+        try:
+            self.index(frame)
+            return True
+        except ValueError:
+            return False
+
+    def __getstate__(self):
+        state = {key: getattr(self, key)[:self.n].copy() for key in FrameTable.COLUMNS}
+        state.update({"paths": self.paths, "sources": self.sources, "owned_frames": self.owned_frames})
+        return state
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.paths = state["paths"]
+        self.path_ids = {path: i for i, path in enumerate(self.paths)}
+        self.sources = state["sources"]
+        self.owned_frames = state["owned_frames"]
+        for key in FrameTable.COLUMNS:
+            setattr(self, key, state[key])
+        self.n = self.frame_id.shape[0]
+
+
+def list_tif_files(directory):
+    """
+    :return: list of the .tif files in a directory, sorted by the numbers in their names. Page index sidecar files (see
+    get_page_index_path) are excluded.
+    """
+    files = [file for file in glob.glob(directory + "*.tif*") if not file.endswith(PAGE_INDEX_EXTENSION)]
+    return sorted(files, key=numerical_sort)
+
+
+def numerical_sort(value):
+    numbers = re.compile(r'(\d+)')
+    parts = numbers.split(value)
+    parts[1::2] = map(int, parts[1::2])
+    return parts
 
 
 class Dataset:
     idgen = count(1)
 
-    def __init__(self, path=None, pixel_size=100):
+    def __init__(self, path=None, pixel_size=100, raw_format=None):
         """
-        :param path: None or string, path to either i) a multi-page .tif file with ordering XYF, F the number of frames, or ii) a single-page .tif file, in which case a Dataset is generated comprising all the .tif files in that folder. If 'None', a Dataset() object is generated that has no frame data.
+        :param path: None or string, path to either i) a multi-page .tif file with ordering XYF, F the number of frames, or ii) a single-page .tif file, in which case a Dataset is generated comprising all the .tif files in that folder, or iii) a raw binary .dat or .raw file (see RawSource), or iv) a Zarr array or OME-Zarr image (see ZarrSource). If 'None', a Dataset() object is generated that has no frame data.
         :param pixel_size:
+        :param raw_format: None, or a dict with the format of raw binary files (see RawSource) that is used when the file has no sidecar description (see get_raw_format).
         """
         self.id = next(Dataset.idgen)
         self.path = path
-        self.frames = list()
+        self.frames = FrameTable()
         self.n_frames = 0
+        self.version = 0  # incremented whenever the list of frames changes, i.e. when the frame at an index may be a different one; see LoadDataNode.get_cache_state.
         self.current_frame = 0
         self.pixel_size = pixel_size
         self.initialized = False
         self.reconstruction_roi = [0, 0, 0, 0]
+        self.cache = FrameCache()
+        self.prefetcher = None
+        self.source = None  # TiffSource or RawSource, if the dataset is a multi-page .tif file or a raw binary file
+        self.raw_format = raw_format
+        self.pending_file_sizes = dict()  # see refresh()
+        self.source_pool = SourcePool()  # limits the number of open files for appended multi-page files, see append_dataset()
         if self.path is not None:
             self.directory = self.path[:self.path.rfind("/") + 1]
             self.load_data()
@@ -35,28 +1144,66 @@ class Dataset:
             self.img_width, self.img_height = (0, 0)
 
     def load_data(self):
-        self.frames = list()
-
-        def numerical_sort(value):
-            numbers = re.compile(r'(\d+)')
-            parts = numbers.split(value)
-            parts[1::2] = map(int, parts[1::2])
-            return parts
-
-        img = Image.open(self.path)
-        tif = tifffile.TiffFile(self.path)
-        n_frames = len(tif.pages)
-        if img.n_frames > 1:
-            for i in range(img.n_frames):
-                self.n_frames += 1
-                self.frames.append(Frame(self.path, i, framenr=i))
+        self.frames = FrameTable()
+        self.version += 1
+        if is_zarr_path(self.path):
+            self.source = ZarrSource(self.path)
+            self.frames.add_pages(self.path, self.source.n_frames, self.source)
+            self.n_frames = len(self.frames)
+            return
+        if is_raw_file(self.path):
+            self.source = RawSource(self.path, **get_raw_format(self.path, self.raw_format))
+            self.frames.add_pages(self.path, self.source.n_frames, self.source)
+            self.n_frames = len(self.frames)
+            return
+        source = TiffSource(self.path)
+        if source.n_frames > 1:
+            self.source = source
+            self.frames.add_pages(self.path, source.n_frames, source)
 
         # folder
         else:
-            files = sorted(glob.glob(self.directory + "*.tif*"), key=numerical_sort)
-            for file in files:
-                self.n_frames += 1
-                self.frames.append(Frame(file, 0, framenr=self.n_frames - 1))
+            source.close()
+            self.frames.add_files(list_tif_files(self.directory))
+        self.n_frames = len(self.frames)
+
+    def refresh(self):
+        """
+        Add the frames that were written to the dataset's source after it was loaded, for live acquisition: new pages in a
+        multi-page .tif file that is still being written, or new .tif files in the folder. A new file is only added once its
+        size has remained the same for two calls to refresh, i.e. once it is no longer being written.
+        A folder that contains only the dataset's file is checked for that file having become a multi-page stack.
+        :return: the number of frames that were added.
+        """
+        n_frames = self.n_frames
+        if self.source is None and self.frames.paths == [self.path]:
+            source = TiffSource(self.path)
+            if source.n_frames > 1:
+                self.source = source
+                self.frames = FrameTable()
+                self.frames.add_pages(self.path, source.n_frames, source)
+            else:
+                source.close()
+        if self.source is not None:
+            first_page = self.source.n_frames
+            n_new = self.source.refresh()
+            if n_new > 0:
+                self.frames.add_pages(self.path, n_new, self.source, first_page=first_page)
+        elif self.path is not None:
+            new_files = [file for file in list_tif_files(self.directory) if file not in self.frames.path_ids]
+            ready = list()
+            for file in new_files:
+                size = os.path.getsize(file)
+                ready.append(size > 0 and self.pending_file_sizes.get(file) == size)
+                self.pending_file_sizes[file] = size
+            n_ready = ready.index(False) if False in ready else len(ready)  # files are added in order, so later files wait for any that are still being written.
+            for file in new_files[:n_ready]:
+                self.pending_file_sizes.pop(file)
+            self.frames.add_files(new_files[:n_ready])
+        self.n_frames = len(self.frames)
+        if self.n_frames != n_frames:
+            self.version += 1  # also for appended frames, as indices past the end used to return the last frame.
+        return self.n_frames - n_frames
 
     def get_indexed_image(self, index):
         if index is None:
@@ -72,6 +1219,37 @@ class Dataset:
                 self.frames[-1].pixel_size = self.pixel_size
                 return self.frames[-1]
 
+    def get_frame_data(self, index):
+        """
+        :param index: index of the frame, as in get_indexed_image.
+        :return: the frame's raw pixel data (see Frame.read), from the dataset's frame cache if available. Otherwise, the
+        data is read from disk (or taken from the prefetcher, if enabled) and added to the cache, without storing it in the
+        Frame itself. The returned array must not be edited in place.
+        """
+        index = self.current_frame if index is None else min(max(index, 0), self.n_frames - 1)
+        frame = self.frames[index]
+        if frame.data is not None:
+            return frame.data
+        data = self.cache.get(frame.id)
+        if data is None:
+            data = self.prefetcher.get(index) if self.prefetcher is not None else frame.read()
+            self.cache.put(frame.id, data)
+        return data
+
+    def set_cache_size(self, max_bytes):
+        self.cache.set_budget(max_bytes)
+
+    def set_prefetching(self, enable, depth=8):
+        """
+        :param enable: if True, get_frame_data reads frames ahead on a background thread when they are accessed sequentially (see FramePrefetcher).
+        :param depth: number of frames to read ahead.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if enable:
+            self.prefetcher = FramePrefetcher(self, depth)
+
     def get_active_image(self):
         self.frames[self.current_frame].pixel_size = self.pixel_size
         return self.frames[self.current_frame]
@@ -83,29 +1261,27 @@ class Dataset:
         Note that when positive and negative tags contradict, preference is given to the positive filter. I.e., the frame is not discarded.
         :return: Nothing, dataset object itself is affected
         """
-        original_active_frame = self.frames[self.current_frame]
-        discard = [False] * len(self.frames)
+        original_active_frame = self.frames[self.current_frame] if self.n_frames > 0 else None
         neg_tags = negative_filter_string.split(';')
         pos_tags = positive_filter_string.split(';')
         while '' in neg_tags:
             neg_tags.remove('')
         while '' in pos_tags:
             pos_tags.remove('')
-        i = 0
-        for frame in self.frames:
+        # The filters depend on the path only, so they are evaluated once per file rather than once per frame.
+        discard_path = np.zeros(len(self.frames.paths), dtype=bool)
+        for i, path in enumerate(self.frames.paths):
             for tag in neg_tags:
-                if tag in frame.path:
-                    discard[i] = True
+                if tag in path:
+                    discard_path[i] = True
             for tag in pos_tags:
-                if tag in frame.path:
-                    discard[i] = False
+                if tag in path:
+                    discard_path[i] = False
                 else:
-                    discard[i] = True
-            i += 1
-        for i in range(len(self.frames) - 1, -1, -1):
-            if discard[i]:
-                self.frames.pop(i)
+                    discard_path[i] = True
+        self.frames.keep(~discard_path[self.frames.path_id[:self.frames.n]])
         self.n_frames = len(self.frames)
+        self.version += 1
         if original_active_frame in self.frames:
             self.current_frame = self.frames.index(original_active_frame)
 
@@ -119,10 +1295,31 @@ class Dataset:
             self.initialized = True
         self.frames.append(frame)
         self.n_frames += 1
+        self.version += 1
 
     def append_dataset(self, path):
+        """
+        Append the frames of another .tif file or raw binary file to the dataset, e.g. the next part of an acquisition that was split into
+        multiple files. Frames are numbered on from the last frame in the dataset. For a multi-page file, only the page
+        index is read here: the file is opened when its frames are first read, and the dataset's SourcePool limits the
+        number of parts that are open at the same time. A single-page file is treated as in Dataset(path), i.e. all of the
+        .tif files in its folder are appended.
+        :param path: path to a .tif, .dat, or .raw file.
+        """
+        if not self.initialized:
+            return
+        first_framenr = int(np.max(self.frames.framenr[:self.frames.n])) + 1 if self.n_frames > 0 else 0
+        source = RawSource(path, **get_raw_format(path, self.raw_format)) if is_raw_file(path) else TiffSource(path, pool=self.source_pool)
+        if source.n_frames > 1 or is_raw_file(path):
+            if source.shape != (self.img_width, self.img_height):
+                print("Original dataset and dataset to append are not the same size!")
+                return
+            self.frames.add_pages(path, source.n_frames, source, first_framenr=first_framenr)
+            self.n_frames = len(self.frames)
+            self.version += 1
+            return
         new_dataset = Dataset(path, self.pixel_size)
-        if not self.initialized or not new_dataset.initialized:
+        if not new_dataset.initialized:
             return
         if self.img_width != new_dataset.img_width:
             print("Original dataset and dataset to append are not the same size!")
@@ -130,15 +1327,16 @@ class Dataset:
         if self.img_height != new_dataset.img_height:
             print("Original dataset and dataset to append are not the same size!")
             return
-        for f in new_dataset.frames:
-            self.frames.append(f)
-            self.n_frames += 1
-
+        new_dataset.frames.framenr[:new_dataset.frames.n] += first_framenr
+        self.frames.extend(new_dataset.frames)
+        self.n_frames = len(self.frames)
+        self.version += 1
 
     def delete_by_index(self, idx):
         if 0 <= idx < len(self.frames):
             del self.frames[idx]
             self.n_frames = len(self.frames)
+            self.version += 1
 
     def __str__(self):
         return "Dataset object with source at: "+self.path+f"\nn_frames = {self.n_frames}"
@@ -146,10 +1344,18 @@ class Dataset:
 
 class Frame:
     id_gen = count(1)
+    data_share = None  # see view(); class-level default for Frames that were pickled before views existed.
 
-    def __init__(self, path, index=None, framenr=0):
+    def __init__(self, path, index=None, framenr=0, source=None):
+        """
+        :param path: path to the .tif file that contains the frame.
+        :param index: index of the frame (page) in the file, or None if the file contains a single frame only.
+        :param framenr: frame number, used as the 'frame' value of particles fitted in this frame.
+        :param source: None, or a TiffSource for the file at 'path', which is then used to read the frame's data.
+        """
         self.id = next(Frame.id_gen)
         self.index = index
+        self.source = source
         self.framenr = framenr
         self.path = path
         if "/" in self.path:
@@ -172,40 +1378,127 @@ class Frame:
         self._ce_lut = 0
         self._ce_clims = [0, 1]
         self.scalar_metrics = dict()
+        self.data_share = None
 
     def load(self):
+        """
+        :return: the frame's pixel data, converted to the working precision (settings.working_precision). The array is the
+        frame's own copy of the data, which can be edited in place: if the data is shared with other frames (see view), it
+        is copied first.
+        """
         if self.data is not None:
+            if self.data_share is not None:
+                if any(frame is not None and frame is not self and frame.data is self.data for frame in (ref() for ref in self.data_share)):
+                    self.data = self.data.copy()
+                self.data_share = None
             return self.data
         else:
-            if self.index is None:
-                self.data = tifffile.imread(self.path).astype(float)
-            else:
-                self.data = tifffile.imread(self.path, key=self.index).astype(float)
-            self.width = self.data.shape[0]
-            self.height = self.data.shape[1]
+            raw_data = self.raw_data if self.raw_data is not None else self.read()
+            self.set_data(np.array(raw_data, dtype=settings.working_precision))
+            self.raw_data = None
+            return self.data
+
+    def load_raw(self):
+        """
+        :return: the frame's pixel data without conversion to the working precision, i.e. typically in the dtype of the
+        file (e.g. uint16); if the frame's data was already loaded with load(), that array is returned instead. The array
+        may be shared with other frames (or be a view into the data file) and must not be edited in place.
+        """
+        if self.data is not None:
             return self.data
+        if self.raw_data is None:
+            self.raw_data = self.read()
+        return self.raw_data
+
+    def read(self):
+        """
+        :return: the frame's pixel data as read from disk, in the file's dtype; unlike load(), this does not set or use self.data.
+        """
+        if self.source is not None:
+            return self.source.read(self.index)
+        elif self.index is None:
+            return tifffile.imread(self.path)
+        else:
+            return tifffile.imread(self.path, key=self.index)
+
+    def read_roi(self, roi):
+        """
+        :param roi: [x_min, y_min, x_max, y_max], the region data[y_min:y_max, x_min:x_max] of the frame.
+        :return: the pixel data in the region as read from disk, in the file's dtype; see TiffSource.read_roi.
+        """
+        if self.source is not None:
+            return self.source.read_roi(self.index, roi)
+        with tifffile.TiffFile(self.path) as tif:
+            return read_page_roi(tif.filehandle, tif.pages[0 if self.index is None else self.index], roi)
+
+    def set_data(self, data):
+        self.data = data
+        self.width = self.data.shape[0]
+        self.height = self.data.shape[1]
 
     def clean(self):
         self.translation = [0.0, 0.0]
         self.discard = False
         self.data = None
+        self.raw_data = None
         self.maxima = list()
 
     def clone(self):
-        return copy.deepcopy(self)
+        return self.view()
+
+    def view(self):
+        """
+        :return: a copy of the frame that shares the frame's pixel data rather than copying it (copy-on-write): whenever a
+        frame whose data is shared is loaded with load(), it first makes its own copy of the data, unless no other frame
+        holds that data anymore. Arrays in the metadata (maxima, particles) are shared too; lists and dicts are copied.
+        raw_data is never edited in place, and is always shared.
+        Pixel data must therefore only be edited via load() or write_roi(), or be replaced by assigning to frame.data.
+        """
+        view = copy.copy(self)
+        view.translation = list(self.translation)
+        view.scalar_metrics = dict(self.scalar_metrics)
+        view._ce_clims = list(self._ce_clims)
+        for attribute in ["maxima", "maxima_values", "particles"]:
+            value = getattr(self, attribute)
+            if isinstance(value, (list, dict)):
+                setattr(view, attribute, copy.copy(value))
+        if self.data is not None:
+            # All frames that share an array hold the same list of weak references to these frames.
+            if self.data_share is None:
+                self.data_share = [weakref.ref(self)]
+            self.data_share[:] = [ref for ref in self.data_share if ref() is not None] + [weakref.ref(view)]
+            view.data_share = self.data_share
+        return view
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["data_share"] = None  # copies that are made by pickling or deepcopy have their own data.
+        return state
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the frame's pixel data (data and raw_data), e.g. for use in a FrameCache."""
+        return sum(a.nbytes for a in (self.data, self.raw_data) if a is not None)
 
     def bake_transform(self, interpolation=1, edges='constant', preserve_range=False):
         tmat = transform.AffineTransform(np.matrix([[1.0, 0.0, self.translation[0]], [0.0, 1.0, self.translation[1]], [0.0, 0.0, 1.0]]))
         self.data = transform.warp(self.data, tmat, order=interpolation, mode=edges, preserve_range=preserve_range)
 
     def load_roi(self, roi=None):
+        """
+        :param roi: None, or [x_min, y_min, x_max, y_max], the region data[y_min:y_max, x_min:x_max] of the frame.
+        :return: the pixel data in the region, in the working precision. If the frame's data is loaded, this is a view into
+        it; otherwise, only the region is read from disk (see read_roi) and converted, and the frame's data is not loaded.
+        """
         if roi is None:
             return self.load()
-        else:
-            return self.load()[roi[1]:roi[3], roi[0]:roi[2]]
+        elif self.data is not None:
+            return self.data[roi[1]:roi[3], roi[0]:roi[2]]
+        raw_data = self.raw_data[roi[1]:roi[3], roi[0]:roi[2]] if self.raw_data is not None else self.read_roi(roi)
+        return np.array(raw_data, dtype=settings.working_precision)
 
     def write_roi(self, roi, data):
-        self.data[roi[1]:roi[3], roi[0]:roi[2]] = data
+        self.load()[roi[1]:roi[3], roi[0]:roi[2]] = data
 
     def __str__(self):
         sstr = "Frame: ..." + self.title + "\n" \
@@ -220,12 +1513,125 @@ class Frame:
             return self.path == other.path and self.framenr == other.framenr
         return False
 
+class ColumnBuffer:
+    """
+    Growable, typed 1D array, used to collect particle parameters during fitting. Values are copied into preallocated chunks,
+    so appending never reallocates or copies previously added values, and the column is only joined into one contiguous
+    array once, by to_array().
+    """
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.chunks = list()
+        self.chunk_fill = 0
+        self.length = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype).ravel()
+        i = 0
+        while i < values.size:
+            if len(self.chunks) == 0 or self.chunk_fill == self.chunks[-1].size:
+                self.chunks.append(np.empty(max(ColumnBuffer.CHUNK_SIZE, values.size - i), dtype=self.dtype))
+                self.chunk_fill = 0
+            n = min(values.size - i, self.chunks[-1].size - self.chunk_fill)
+            self.chunks[-1][self.chunk_fill:self.chunk_fill + n] = values[i:i + n]
+            self.chunk_fill += n
+            i += n
+        self.length += values.size
+
+    def to_array(self):
+        if len(self.chunks) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(self.chunks[:-1] + [self.chunks[-1][:self.chunk_fill]])
+
+    def __len__(self):
+        return self.length
+
+
+class SpatialIndex:
+    """
+    Uniform grid index over a set of 2D coordinates. The points are sorted by the grid cell that they are in, so that all
+    points in a row of adjacent cells form one contiguous range in the sorted order; a box query thus only gathers one
+    slice of candidates per grid row, after which the candidates are tested exactly.
+    """
+    PARTICLES_PER_CELL = 8
+
+    def __init__(self, x, y, cell_size=None):
+        """
+        :param x: 1D array of x coordinates.
+        :param y: 1D array of y coordinates, same size as x.
+        :param cell_size: size of the (square) grid cells, in the same unit as x and y. If None, the cell size is chosen such that on average PARTICLES_PER_CELL points are in a cell.
+        """
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.n = self.x.size
+        if self.n == 0:
+            self.x_min, self.y_min, self.x_max, self.y_max = 0.0, 0.0, 0.0, 0.0
+        else:
+            self.x_min, self.x_max = float(np.min(self.x)), float(np.max(self.x))
+            self.y_min, self.y_max = float(np.min(self.y)), float(np.max(self.y))
+        if cell_size is None:
+            area = max(self.x_max - self.x_min, 1.0) * max(self.y_max - self.y_min, 1.0)
+            cell_size = np.sqrt(area * SpatialIndex.PARTICLES_PER_CELL / max(self.n, 1))
+        self.cell_size = max(float(cell_size), 1e-6)
+        self.n_cols = int((self.x_max - self.x_min) // self.cell_size) + 1
+        self.n_rows = int((self.y_max - self.y_min) // self.cell_size) + 1
+
+        cell = self.cell_of(self.y, self.y_min, self.n_rows) * self.n_cols + self.cell_of(self.x, self.x_min, self.n_cols)
+        self.order = np.argsort(cell, kind='stable')
+        self.cell_start = np.zeros(self.n_rows * self.n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.n_rows * self.n_cols), out=self.cell_start[1:])
+        self.sorted_x = self.x[self.order]
+        self.sorted_y = self.y[self.order]
+
+    def cell_of(self, v, v_min, n_cells):
+        return np.clip(((v - v_min) // self.cell_size).astype(np.int64), 0, n_cells - 1)
+
+    def query_box(self, x_min, y_min, x_max, y_max):
+        """
+        :return: array with the indices of the points for which x_min <= x <= x_max and y_min <= y <= y_max.
+        """
+        if self.n == 0 or x_max < self.x_min or x_min > self.x_max or y_max < self.y_min or y_min > self.y_max:
+            return np.zeros(0, dtype=np.int64)
+        c0, c1 = self.cell_of(np.asarray([x_min, x_max]), self.x_min, self.n_cols)
+        r0, r1 = self.cell_of(np.asarray([y_min, y_max]), self.y_min, self.n_rows)
+        slices = [np.arange(self.cell_start[r * self.n_cols + c0], self.cell_start[r * self.n_cols + c1 + 1]) for r in range(r0, r1 + 1)]
+        candidates = np.concatenate(slices)
+        cx = self.sorted_x[candidates]
+        cy = self.sorted_y[candidates]
+        inside = (x_min <= cx) & (cx <= x_max) & (y_min <= cy) & (cy <= y_max)
+        return self.order[candidates[inside]]
+
+    def query_radius(self, x, y, radius):
+        """
+        :return: array with the indices of the points within a distance 'radius' of (x, y).
+        """
+        candidates = self.query_box(x - radius, y - radius, x + radius, y + radius)
+        d2 = (self.x[candidates] - x)**2 + (self.y[candidates] - y)**2
+        return candidates[d2 <= radius**2]
+
+    def count_box(self, x_min, y_min, x_max, y_max):
+        return self.query_box(x_min, y_min, x_max, y_max).size
+
+
 class ParticleData:
+    version_gen = count(1)
     HISTOGRAM_BINS = 50
+    COLUMN_DTYPES = {"frame": np.int32}  # dtype of the ColumnBuffer used for a parameter while collecting particles; np.float32 if not listed.
 
     def __init__(self, pixel_size=100):
         self.pixel_size = pixel_size
         self.parameters = dict()
+        self.buffers = dict()  # particles added with __add__ are collected in ColumnBuffers, and moved into self.parameters by bake()
+        self.version = next(ParticleData.version_gen)  # changes whenever particles are added or the parameter values are changed by bake(); used by nodes that cache results computed from the particle data.
+        self.spatial_index = None  # SpatialIndex over the drift-corrected particle coordinates, see get_spatial_index()
+        self.spatial_index_key = None
+        self.zero_shift = None
+        self.frame_order = None  # permutation that sorts the particles by frame number, see build_frame_index()
+        self.frame_offsets = None
+        self.frame_min = 0
+        self.frame_index_version = None
         self.n_particles = 0
         self.histogram_counts = dict()
         self.histogram_bins = dict()
@@ -243,17 +1649,20 @@ class ParticleData:
         self.uncertainty_estimator = 0
 
     def __add__(self, other):
+        """
+        :param other: dict of particle parameters, with for every key a list or array of values (e.g. as output by particlefitting.frame_to_particles)
+        """
         if not other:
             return self
         for key in other:
-            if key in self.parameters:
-                self.parameters[key] += other[key]
-            else:
-                self.parameters[key] = other[key]
+            if key not in self.buffers:
+                self.buffers[key] = ColumnBuffer(ParticleData.COLUMN_DTYPES.get(key, np.float32))
+            self.buffers[key].append(other[key])
+        self.version = next(ParticleData.version_gen)
         self.baked = False
         self.baked_by_renderer = False
         self.empty = False
-        self.n_particles = len(next(iter(self.parameters.values())))
+        self.n_particles = len(self.buffers["x [nm]"] if "x [nm]" in self.buffers else next(iter(self.buffers.values())))
         return self
 
     def __str__(self):
@@ -262,11 +1671,11 @@ class ParticleData:
 
     def clean(self):
         if 'visible' in self.parameters:
-            self.parameters["visible"] = np.ones_like(self.parameters["visible"])
+            self.parameters["visible"].fill(1)
         if "dx [nm]" in self.parameters:
-            self.parameters["dx [nm]"] = np.zeros_like(self.parameters["dx [nm]"])
+            self.parameters["dx [nm]"] = self.get_zero_shift()
         if "dy [nm]" in self.parameters:
-            self.parameters["dy [nm]"] = np.zeros_like(self.parameters["dy [nm]"])
+            self.parameters["dy [nm]"] = self.get_zero_shift()
         self.baked_by_renderer = False
 
     def bake(self):
@@ -275,8 +1684,10 @@ class ParticleData:
         self.baked = True
         self.baked_by_renderer = False
 
-        for key in self.parameters:
-            self.parameters[key] = np.array([v for a in self.parameters[key] for v in (a if isinstance(a, list) else [a])])
+        for key in self.buffers:
+            self.parameters[key] = self.buffers[key].to_array()
+        self.buffers = dict()
+        self.version = next(ParticleData.version_gen)
 
         self.n_particles = len(self.parameters["x [nm]"])
         print("n_particles:", self.n_particles)
@@ -295,29 +1706,16 @@ class ParticleData:
             background = self.parameters["offset [photons]"]
 
         sigma = self.parameters["sigma [nm]"]
-        discard_mask = np.zeros_like(self.parameters["x [nm]"])
         uncertainty = np.zeros_like(self.parameters["x [nm]"])
-
-        for i in range(self.n_particles):
-            if intensity[i] == 0.0:
-                discard_mask[i] = 1
-                continue
+        with np.errstate(divide='ignore', invalid='ignore'):
             if self.uncertainty_estimator == 0:
-                uncertainty[i] = np.sqrt(((sigma[i]*self.pixel_size)**2 + k1) / intensity[i] + k2 * (sigma[i]*self.pixel_size)**4 * bkgstd[i]**2 / intensity[i]**2)
+                sigma_nm = sigma * self.pixel_size
+                uncertainty = np.sqrt((sigma_nm**2 + k1) / intensity + k2 * sigma_nm**4 * bkgstd**2 / intensity**2)
             elif self.uncertainty_estimator == 1:
-                N = intensity[i]
-                sa2 = (sigma[i]**2 + 1 / 12) * self.pixel_size**2
-                tau = (2 * np.pi * (sigma[i]**2 + 1/12) * background[i]) / N
-                variance = sa2 * (1 + 4*tau + np.sqrt((2 * tau)/(1 + 4*tau))) / N
-                uncertainty[i] = np.sqrt(variance)
-
-        discard_mask += self.parameters["x [nm]"] < self.x_min
-        discard_mask += self.parameters["x [nm]"] > self.x_max
-        discard_mask += self.parameters["y [nm]"] < self.y_min
-        discard_mask += self.parameters["y [nm]"] > self.y_max
-
-        discard_indices = discard_mask.nonzero()
-        self.parameters['uncertainty [nm]'] = np.asarray(uncertainty)
+                sa2 = (sigma**2 + 1 / 12) * self.pixel_size**2
+                tau = (2 * np.pi * (sigma**2 + 1 / 12) * background) / intensity
+                uncertainty = np.sqrt(sa2 * (1 + 4 * tau + np.sqrt((2 * tau) / (1 + 4 * tau))) / intensity)
+        self.parameters['uncertainty [nm]'] = uncertainty.astype(np.float32)
 
         self.parameters['x [nm]'] *= self.pixel_size
         self.parameters['y [nm]'] *= self.pixel_size
@@ -325,8 +1723,16 @@ class ParticleData:
         if 'sigma2 [nm]' in self.parameters.keys():
             self.parameters['sigma2 [nm]'] *= self.pixel_size
 
-        for key in self.parameters:
-            np.delete(self.parameters[key], discard_indices)
+        # particles with zero intensity (or for which the uncertainty is otherwise undefined) are removed.
+        discard_mask = (intensity == 0.0) | ~np.isfinite(uncertainty)
+        if np.any(discard_mask):
+            keep = ~discard_mask
+            for key in self.parameters:
+                self.parameters[key] = self.parameters[key][keep]
+            if not np.any(keep):
+                self.n_particles = 0
+                self.empty = True
+                return
 
         self.parameters['visible'] = np.ones_like(self.parameters['x [nm]'])
         self.parameters['colour_idx'] = np.ones_like(self.parameters['x [nm]'])
@@ -342,20 +1748,105 @@ class ParticleData:
         self.x_max = np.max(self.parameters['x [nm]'])
         self.y_max = np.max(self.parameters['y [nm]'])
         self.n_particles = len(self.parameters["x [nm]"])
-        self.parameters['dx [nm]'] = np.zeros_like(self.parameters['x [nm]'])
-        self.parameters['dy [nm]'] = np.zeros_like(self.parameters['y [nm]'])
+        self.parameters['dx [nm]'] = self.get_zero_shift()
+        self.parameters['dy [nm]'] = self.get_zero_shift()
+        self.build_frame_index()
+
+    def build_frame_index(self):
+        """
+        Sort the particles by frame number and store the permutation (self.frame_order) and, for every frame number from
+        frame_min up to and including the maximum frame number, the offset of that frame's first particle in the sorted
+        order (self.frame_offsets). The particles in frame f are then self.frame_order[offsets[f - frame_min]:offsets[f - frame_min + 1]].
+        """
+        self.frame_index_version = self.version
+        if "frame" not in self.parameters or len(self.parameters["frame"]) == 0:
+            self.frame_order = np.zeros(0, dtype=np.int64)
+            self.frame_offsets = np.zeros(1, dtype=np.int64)
+            self.frame_min = 0
+            return
+        frames = self.parameters["frame"].astype(np.int64)
+        self.frame_order = np.argsort(frames, kind='stable')
+        self.frame_min = int(frames[self.frame_order[0]])
+        frame_max = int(frames[self.frame_order[-1]])
+        self.frame_offsets = np.searchsorted(frames[self.frame_order], np.arange(self.frame_min, frame_max + 2))
+
+    def get_frame_index(self):
+        if self.frame_index_version != self.version:
+            self.build_frame_index()
+        return self.frame_order, self.frame_offsets, self.frame_min
+
+    def get_frame_range(self, start, stop):
+        """
+        :return: array with the indices of all particles for which start <= frame < stop.
+        """
+        order, offsets, frame_min = self.get_frame_index()
+        n = offsets.size - 1
+        a = int(np.clip(start - frame_min, 0, n))
+        b = int(np.clip(stop - frame_min, 0, n))
+        if b <= a:
+            return order[0:0]
+        return order[offsets[a]:offsets[b]]
+
+    def get_frame_counts(self):
+        """
+        :return: tuple (frames, counts): every frame number between the lowest and the highest frame number, and the number of particles in each of those frames.
+        """
+        order, offsets, frame_min = self.get_frame_index()
+        return np.arange(frame_min, frame_min + offsets.size - 1), np.diff(offsets)
 
     def apply_filter(self, parameter_key, min_val, max_val, logic_not=False):
         if parameter_key not in self.parameters:
             return
+        self.parameters['visible'][~self.get_filter_mask(parameter_key, min_val, max_val, logic_not)] = 0
+
+    def get_filter_mask(self, parameter_key, min_val, max_val, logic_not=False):
+        """
+        :return: boolean array, True for particles for which min_val < parameter < max_val (or the opposite, if logic_not is True). None if the parameter is not available.
+        """
+        if parameter_key not in self.parameters:
+            return None
         vals = self.parameters[parameter_key]
-        visible = np.zeros_like(self.parameters['visible'])
-        for i in range(self.n_particles):
-            if min_val < vals[i] < max_val:
-                visible[i] = 1
+        mask = (min_val < vals) & (vals < max_val)
         if logic_not:
-            visible = 1 - visible
-        self.parameters['visible'][visible == 0] = 0
+            np.logical_not(mask, out=mask)
+        return mask
+
+    def get_zero_shift(self):
+        """
+        :return: array of zeros, used as the (dx, dy) drift when the particle data is cleaned. The same array is returned
+        every time, so that the spatial index is not rebuilt after every clean(). It must not be edited in place.
+        """
+        if self.zero_shift is None or self.zero_shift.shape != self.parameters["x [nm]"].shape:
+            self.zero_shift = np.zeros_like(self.parameters["x [nm]"])
+        return self.zero_shift
+
+    def get_spatial_index(self):
+        """
+        :return: SpatialIndex over the particle coordinates x + dx, y + dy (in nm). The index is built on first use and rebuilt only when the particles or their drift correction have changed since.
+        """
+        x, y = self.parameters["x [nm]"], self.parameters["y [nm]"]
+        dx, dy = self.parameters.get("dx [nm]"), self.parameters.get("dy [nm]")
+        key = (self.version, id(x), id(y), id(dx), id(dy))
+        if self.spatial_index is None or key != self.spatial_index_key:
+            self.spatial_index = SpatialIndex(x if dx is None else x + dx, y if dy is None else y + dy)
+            self.spatial_index_key = key
+        return self.spatial_index
+
+    def query_box(self, x_min, y_min, x_max, y_max):
+        """
+        :return: indices of the particles with drift-corrected coordinates within the box (in nm).
+        """
+        if self.empty or not self.baked:
+            return np.zeros(0, dtype=np.int64)
+        return self.get_spatial_index().query_box(x_min, y_min, x_max, y_max)
+
+    def query_radius(self, x, y, radius):
+        """
+        :return: indices of the particles with drift-corrected coordinates within a distance 'radius' (in nm) of (x, y).
+        """
+        if self.empty or not self.baked:
+            return np.zeros(0, dtype=np.int64)
+        return self.get_spatial_index().query_radius(x, y, radius)
 
     def set_reconstruction_roi(self, roi):
         """
@@ -393,6 +1884,7 @@ class ParticleData:
             particle_data_obj.histogram_counts[key] = np.delete(particle_data_obj.histogram_counts[key], 0)
             particle_data_obj.histogram_bins[key] = (particle_data_obj.histogram_bins[key][1], particle_data_obj.histogram_bins[key][-1])
         particle_data_obj.baked = True
+        particle_data_obj.build_frame_index()
         return particle_data_obj
 
     def save_as_csv(self, path):
@@ -4,6 +4,9 @@ import time
 import datetime
 from scNodes.core.datatypes import *
 import threading
+import queue
+import pickle
+import hashlib
 import matplotlib.pyplot as plt
 from scNodes.core import settings
 from joblib import Parallel, delayed
@@ -11,6 +14,15 @@ from joblib.externals.loky import set_loky_pickler
 set_loky_pickler("dill")
 
 
+def copy_output(output):
+    """
+    :return: a copy of a node's output, for handing the same output to several consumers: a copy-on-write view for Frames (see Frame.view), a deep copy otherwise.
+    """
+    if isinstance(output, Frame):
+        return output.view()
+    return copy.deepcopy(output)
+
+
 class Node:
     title = "NullNode"
     group = "Ungrouped"
@@ -50,6 +62,10 @@ class Node:
 
     DISABLE_FRAME_INFO_WINDOW = False
 
+    BUFFER_LOCK = threading.RLock()  # guards the last_index_requested / last_frame_returned pairs, which are shared by the GUI thread and the job engine's workers.
+    job = None  # the node's BackgroundProcess on the job engine, if any; see start_job.
+    image_viewer_thread_id = None
+
     def __init__(self):
         self.id = int(datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')+"000") + next(Node.id_generator)
         self.position = [0, 0]
@@ -85,6 +101,18 @@ class Node:
         self.OVERRIDE_AUTOCONTRAST = False
         self.OVERRIDE_AUTOCONTRAST_LIMS = (0, 65535)
         self.FLAG_CHANGE_UPON_ROI_CHANGE = True
+        self.NODE_OUTPUT_IS_CACHEABLE = True  # set to False for nodes whose output depends on more than their params, roi, inputs, and get_cache_state(); disables caching of the output of the node and of all nodes downstream of it.
+        self.NODE_IS_THREAD_SAFE = True  # set to False for nodes whose get_image_impl must run on the GUI thread (e.g. because it uses OpenGL) or keeps state between calls; jobs of the node and of all nodes downstream of it then run on the GUI thread, see start_job.
+
+    @property
+    def FRAME_REQUESTED_BY_IMAGE_VIEWER(self):
+        # The flag is only seen by the thread that set it (the GUI thread), so that frames that a job requests from the
+        # same node in the meantime are the node's regular output.
+        return self.image_viewer_thread_id == threading.get_ident()
+
+    @FRAME_REQUESTED_BY_IMAGE_VIEWER.setter
+    def FRAME_REQUESTED_BY_IMAGE_VIEWER(self, value):
+        self.image_viewer_thread_id = threading.get_ident() if value else None
 
     def __eq__(self, other):
         if isinstance(other, Node):
@@ -228,6 +256,9 @@ class Node:
             imgui.separator()
             imgui.text(f"Time processing: {self.profiler_time:.2f}")
             imgui.text(f"Frames requested: {self.profiler_count}")
+            if self.id in result_cache.node_stats:
+                hits, misses = result_cache.node_stats[self.id]
+                imgui.text(f"Cache hits: {hits}, misses: {misses}")
         imgui.pop_style_color(25)
         imgui.pop_style_var(5)
         imgui.pop_id()
@@ -302,6 +333,7 @@ class Node:
 
     def delete(self):
         try:
+            self.stop_job()
             if cfg.focused_node == self:
                 cfg.set_active_node(None, True)
             if cfg.active_node == self:
@@ -423,15 +455,32 @@ class Node:
             start_time = time.time()
             self.profiler_count += 1
         try:
-            if self.buffer_last_output:
-                if idx is self.last_index_requested:
-                    retval = copy.deepcopy(self.last_frame_returned)
-                else:
-                    self.last_frame_returned = self.get_image_impl(idx)
-                    self.last_index_requested = idx
-                    retval = copy.deepcopy(self.last_frame_returned)
+            plan = cfg.execution_plans.get(threading.get_ident())
+            in_plan = plan is not None
+            cache_key = None
+            if idx is not None and result_cache.max_bytes > 0 and not (in_plan and self.id in plan.shared_node_ids):
+                config_key = self.get_cache_key()
+                cache_key = None if config_key is None else (config_key, idx, self.FRAME_REQUESTED_BY_IMAGE_VIEWER)
+            cached_frame = result_cache.get_result(self, cache_key) if cache_key is not None else None
+            if cached_frame is not None:
+                retval = cached_frame.view()
+            elif in_plan and self.id in plan.shared_node_ids:
+                retval = plan.get_image(self, idx)
+            elif self.buffer_last_output:
+                with Node.BUFFER_LOCK:
+                    if idx is self.last_index_requested:
+                        retval = copy_output(self.last_frame_returned)
+                    else:
+                        self.last_frame_returned = self.get_image_impl(idx)
+                        self.last_index_requested = idx
+                        retval = copy_output(self.last_frame_returned)
             else:
                 retval = self.get_image_impl(idx)
+            # Results are not stored while a plan is evaluated: ranges of frames are processed once, and storing every
+            # frame would only cost copies and evict the frames that the image viewer requested.
+            if cached_frame is None and cache_key is not None and not in_plan and not self.NODE_IS_DATA_SOURCE and isinstance(retval, Frame):
+                result_cache.put(cache_key, retval)
+                retval = retval.view()
         except Exception as e:
             cfg.set_error(e, f"{self} error: "+str(e))
         if cfg.profiling:
@@ -441,6 +490,66 @@ class Node:
     def get_image_impl(self, idx):
         return None
 
+    def get_images(self, indices):
+        """
+        Batched variant of get_image, for processing a number of frames at once.
+        :param indices: list of frame indices.
+        :return: (N, H, W) array with the pixel data of the node's output (as returned by Frame.load()) for every index,
+        or None if the output is not available. The array is the caller's own, and can be edited in place.
+        """
+        retval = None
+        if cfg.profiling:
+            start_time = time.time()
+            self.profiler_count += len(indices)
+        try:
+            retval = self.get_images_impl(list(indices))
+        except Exception as e:
+            cfg.set_error(e, f"{self} error: "+str(e))
+        if cfg.profiling:
+            self.profiler_time += (time.time() - start_time)
+        return retval
+
+    def get_images_impl(self, indices):
+        """
+        Override in nodes that can process a whole stack at once with array operations. By default, the frames are
+        requested one by one with get_image, so that nodes that only implement get_image_impl (e.g. custom nodes based on
+        custom_node_template.py) also support get_images.
+        """
+        frames = [self.get_image(idx) for idx in indices]
+        if any(frame is None for frame in frames):
+            return None
+        return np.stack([frame.load() for frame in frames])
+
+    def get_cache_state(self):
+        """
+        Override in nodes whose output depends on state other than self.params and self.roi (and the node's inputs).
+        :return: a picklable value that identifies that state; it is included in the node's cache key.
+        """
+        return None
+
+    def get_cache_key(self):
+        """
+        :return: a key (bytes) that identifies the configuration of this node and of all nodes upstream of it: a hash of
+        the node's params, roi, and cache state, and of the cache keys of its inputs - or None if the output of the node or
+        of any node upstream of it can not be cached. When any upstream parameter changes, the key changes with it, so that
+        results that were cached for the old configuration are no longer used.
+        """
+        if not self.NODE_OUTPUT_IS_CACHEABLE:
+            return None
+        input_keys = list()
+        for name, attribute in self.connectable_attributes.items():
+            if attribute.direction == ConnectableAttribute.INPUT:
+                for partner in attribute.linked_attributes:
+                    key = partner.parent.get_cache_key()
+                    if key is None:
+                        return None
+                    input_keys.append((name, key))
+        try:
+            state = pickle.dumps((type(self).__name__, self.id, self.params, self.use_roi, list(self.roi), self.get_cache_state(), input_keys))
+        except Exception:
+            return None
+        return hashlib.blake2b(state, digest_size=16).digest()
+
     def get_particle_data(self):
         return self.get_particle_data_impl()
 
@@ -453,6 +562,47 @@ class Node:
     def on_update(self):
         return None
 
+    def start_job(self, step, priority=None):
+        """
+        Run a long task of the node (e.g. fitting or baking all frames) on the job engine, outside of the GUI thread - or,
+        when the node or any node upstream of it is not thread safe (see NODE_IS_THREAD_SAFE), on the GUI thread, one step
+        per GUI frame. Any job of the node that is still running is stopped first.
+        :param step: function that is called as step(process) by the engine's workers, and that processes a part of the
+        task (e.g. a batch of frames) every time it is called. It should return True while there is work left, and can
+        report progress with process.set_progress.
+        :param priority: one of the BackgroundProcess.PRIORITY_ values; defaults to PRIORITY_NORMAL.
+        """
+        self.stop_job()
+        priority = BackgroundProcess.PRIORITY_NORMAL if priority is None else priority
+        self.job = BackgroundProcess(step, (), name=f"{self.title} {self.id}", priority=priority, repeat=True, gui_thread=not self.upstream_is_thread_safe())
+        self.job.submit()
+
+    def stop_job(self):
+        """
+        Stop the node's job, if any. Waits for the step that is running at the moment (if any) to finish, so that the job
+        no longer changes the node's state when this returns.
+        """
+        job = self.job
+        if job is not None:
+            job.stop()
+            job.join()
+            self.job = None
+
+    def upstream_is_thread_safe(self):
+        """
+        :return: True if this node and all nodes upstream of it can process frames outside of the GUI thread.
+        """
+        try:
+            return all(node.NODE_IS_THREAD_SAFE for node in ExecutionPlan(self).order)
+        except Exception:
+            return False
+
+    def job_running(self):
+        """
+        :return: True if the node has a job that is queued or running.
+        """
+        return self.job is not None and not self.job.done
+
     def on_gain_focus(self):
         self.NODE_GAINED_FOCUS = True
 
@@ -721,32 +871,332 @@ class ConnectableAttribute:
         return False
 
 
+class ExecutionPlan:
+    """
+    Evaluation plan for the node graph upstream of a node, for processing a range of frames. Nodes pull their input with
+    get_image(idx), so when the output of a node feeds several consumers (e.g. a RegisterNode that is the input of both
+    a ParticleDetectionNode and a ParticleFittingNode), the upstream chain would be evaluated once per consumer. While a
+    plan is being evaluated, the outputs of these shared nodes are computed once per frame index and handed to all of
+    their consumers: every consumer but the last receives a (copy-on-write) view, as consumers may modify the frames
+    they receive.
+    """
+    def __init__(self, node):
+        """
+        :param node: the node whose output is requested; the plan covers this node and all nodes upstream of it.
+        """
+        self.node = node
+        self.order = list()  # the nodes in topological order, sources first.
+        self.n_consumers = dict()  # node id: number of connections from the node's outputs to inputs of nodes in the plan.
+        self.shared_node_ids = set()
+        self.results = dict()  # (node id, frame index): [frame, number of times handed out]
+        self.compile()
+
+    @staticmethod
+    def get_input_nodes(node):
+        """:return: list with, for every connection to one of the node's inputs, the node on the other end."""
+        input_nodes = list()
+        for attribute in node.connectable_attributes.values():
+            if attribute.direction == ConnectableAttribute.INPUT:
+                input_nodes += [partner.parent for partner in attribute.linked_attributes]
+        return input_nodes
+
+    def compile(self):
+        nodes = {self.node.id: self.node}
+        inputs = dict()
+        stack = [self.node]
+        while stack:
+            node = stack.pop()
+            inputs[node.id] = ExecutionPlan.get_input_nodes(node)
+            for input_node in inputs[node.id]:
+                if input_node.id not in nodes:
+                    nodes[input_node.id] = input_node
+                    stack.append(input_node)
+        self.n_consumers = {node_id: 0 for node_id in nodes}
+        for node_id in nodes:
+            for input_node in inputs[node_id]:
+                self.n_consumers[input_node.id] += 1
+
+        # Kahn's algorithm, on the number of (unique) inputs of every node that are not yet ordered.
+        n_waiting = {node_id: len({n.id for n in inputs[node_id]}) for node_id in nodes}
+        consumers = {node_id: set() for node_id in nodes}
+        for node_id in nodes:
+            for input_node in inputs[node_id]:
+                consumers[input_node.id].add(node_id)
+        ready = [node_id for node_id in nodes if n_waiting[node_id] == 0]
+        self.order = list()
+        while ready:
+            node_id = ready.pop()
+            self.order.append(nodes[node_id])
+            for consumer_id in consumers[node_id]:
+                n_waiting[consumer_id] -= 1
+                if n_waiting[consumer_id] == 0:
+                    ready.append(consumer_id)
+        if len(self.order) != len(nodes):
+            raise Exception(f"The node setup upstream of {self.node.title} contains a cycle.")
+        # Data sources serve frames from their dataset's cache and are cheap to request repeatedly; they are not shared.
+        self.shared_node_ids = {node.id for node in self.order if self.n_consumers[node.id] > 1 and not node.NODE_IS_DATA_SOURCE}
+
+    def get_image(self, node, idx):
+        key = (node.id, idx)
+        entry = self.results.get(key)
+        if entry is None:
+            entry = [node.get_image_impl(idx), 0]
+            self.results[key] = entry
+        entry[1] += 1
+        if entry[1] >= self.n_consumers[node.id]:
+            del self.results[key]
+            return entry[0]
+        return copy_output(entry[0])
+
+    def evaluate(self, indices, function=None):
+        """
+        Evaluate the plan for a range of frames.
+        :param indices: iterable of frame indices.
+        :param function: function that is called with every frame index; defaults to the get_image method of the plan's node.
+        :return: generator that yields tuples (index, function(index)).
+        """
+        function = self.node.get_image if function is None else function
+        thread_id = threading.get_ident()
+        for idx in indices:
+            previous_plan = cfg.execution_plans.get(thread_id)
+            cfg.execution_plans[thread_id] = self
+            try:
+                retval = function(idx)
+            finally:
+                if previous_plan is None:
+                    del cfg.execution_plans[thread_id]
+                else:
+                    cfg.execution_plans[thread_id] = previous_plan
+                self.results = dict()
+            yield idx, retval
+
+    def __str__(self):
+        return "ExecutionPlan: " + " -> ".join(f"{node.title}{' (shared)' if node.id in self.shared_node_ids else ''}" for node in self.order)
+
+
+class ResultCache(FrameCache):
+    """
+    Least-recently-used cache of the Frames output by nodes, shared by all nodes and bounded by the total size of their
+    pixel data. Keys are tuples (node cache key, frame index, requested by image viewer) - see Node.get_cache_key; since
+    changing any upstream parameter changes a node's key, outdated results are never used and are simply evicted.
+    Hits and misses are also counted per node.
+    """
+    def __init__(self, max_bytes=0):
+        super().__init__(max_bytes)
+        self.node_stats = dict()  # node id: [hits, misses]
+
+    def get_result(self, node, key):
+        frame = self.get(key)
+        stats = self.node_stats.setdefault(node.id, [0, 0])
+        stats[0 if frame is not None else 1] += 1
+        return frame
+
+    def clear(self):
+        super().clear()
+        self.node_stats = dict()
+
+
+result_cache = ResultCache(settings.result_cache_size)
+
+
 class BackgroundProcess:
+    """
+    A function that runs outside of the GUI thread. The function is called as function(*args, process), and can report
+    its progress with process.set_progress and check process.stop_request to see whether it should stop early.
+    Processes either run in a thread of their own (start), or are submitted to the job engine (see JobEngine), which runs
+    them on a pool of worker threads in order of priority - or on the GUI thread, for processes with gui_thread=True.
+    """
     idgen = count(0)
 
-    def __init__(self, function, args, name=None):
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    def __init__(self, function, args, name=None, priority=PRIORITY_NORMAL, repeat=False, gui_thread=False):
+        """
+        :param priority: one of the BackgroundProcess.PRIORITY_ values; for processes that are submitted to the job engine.
+        :param repeat: if True, the function is a single step of a longer job: it is called again and again until it returns False or the process is stopped. Between steps, a job engine worker may run other jobs of the same or higher priority.
+        :param gui_thread: if True, the job engine runs the process on the GUI thread, one step per GUI frame (see JobEngine.run_gui_steps); for processes that use OpenGL or nodes that are not thread safe.
+        """
         self.uid = next(BackgroundProcess.idgen)
         self.function = function
         self.args = args
         self.name = name
+        self.priority = priority
+        self.repeat = repeat
+        self.gui_thread = gui_thread
+        self.parked = False
         self.thread = None
         self.progress = 0.0
+        self.done = False
+        self.error = None
         self.stop_request = threading.Event()
+        self.lock = threading.RLock()  # held while the function is running, see join.
 
     def start(self):
         _name = f"BackgroundProcess {self.uid} - "+(self.name if self.name is not None else "")
         self.thread = threading.Thread(daemon=True, target=self._run, name=_name)
         self.thread.start()
 
+    def submit(self):
+        job_engine.submit(self)
+
     def _run(self):
-        self.function(*self.args, self)
+        while self.step():
+            pass
+
+    def step(self):
+        """
+        Call the function once.
+        :return: True if the function should be called again, False if the process is done.
+        """
+        with self.lock:
+            if self.stop_request.is_set():
+                self.done = True
+                return False
+            try:
+                if self.function(*self.args, self) and self.repeat and not self.stop_request.is_set():
+                    return True
+            except Exception as e:
+                self.error = e
+                self.progress = 1.0
+                cfg.set_error(e, f"Error in background process {self.uid} ({self.name}): "+str(e))
+            self.done = True
+            return False
 
     def set_progress(self, progress):
         self.progress = progress
 
+    def park(self):
+        """
+        Call from the function of a repeating process that has to wait for new data (e.g. for frames of a live acquisition):
+        the process is then not called again until JobEngine.resume_parked is called.
+        """
+        self.parked = True
+
     def stop(self):
         self.stop_request.set()
         self.progress = 1.0
+        if self.parked:
+            self.done = True
+
+    def join(self):
+        """
+        Wait until the function is no longer running. Call after stop() to be sure that the process does not change any
+        state anymore - when the function is not running at the moment, this returns immediately.
+        """
+        with self.lock:
+            pass
+
+    def __getstate__(self):
+        # Processes can be referenced by nodes that are pickled for parallel processing (see Node.parallel_process).
+        state = self.__dict__.copy()
+        for name in ["thread", "stop_request", "lock"]:
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.thread = None
+        self.stop_request = threading.Event()
+        self.lock = threading.RLock()
 
     def __str__(self):
-        return f"BackgroundProcess {self.uid} with function {self.function} and args {self.args}"
\ No newline at end of file
+        return f"BackgroundProcess {self.uid} with function {self.function} and args {self.args}"
+
+
+class JobEngine:
+    """
+    Runs long jobs, such as PSF fitting or baking a stack, on a pool of worker threads, so that they progress
+    independently of the GUI render loop - the GUI only polls their progress. Jobs are BackgroundProcesses; a job with
+    repeat=True runs one step at a time and is then queued again, so that a pool of n workers interleaves any number of
+    jobs. Jobs with a higher priority (lower PRIORITY_ value) are run first, and jobs with equal priority take turns.
+    """
+    def __init__(self, n_workers=1):
+        """
+        :param n_workers: number of worker threads; they are started when the first job is submitted.
+        """
+        self.n_workers = n_workers
+        self.queue = queue.PriorityQueue()
+        self.order = count(0)
+        self.workers = list()
+        self.jobs = list()
+        self.gui_jobs = list()
+        self.parked = list()
+        self.n_resumes = 0
+        self.lock = threading.RLock()
+
+    def submit(self, process):
+        """
+        Queue a BackgroundProcess to be run by the engine's workers, or by run_gui_steps if process.gui_thread is True.
+        """
+        with self.lock:
+            self.jobs = [job for job in self.jobs if not job.done]
+            self.jobs.append(process)
+            if process.gui_thread:
+                self.gui_jobs.append(process)
+                return
+            while len(self.workers) < self.n_workers:
+                worker = threading.Thread(daemon=True, target=self._work, name=f"JobEngine worker {len(self.workers)}")
+                worker.start()
+                self.workers.append(worker)
+        self.queue.put((process.priority, next(self.order), process))
+
+    def _work(self):
+        while True:
+            _, _, process = self.queue.get()
+            process.thread = threading.current_thread()
+            n_resumes = self.n_resumes
+            if process.step():
+                with self.lock:
+                    if process.parked and n_resumes == self.n_resumes:
+                        self.parked.append(process)
+                        continue
+                    process.parked = False  # resume_parked was called while the step was running.
+                self.queue.put((process.priority, next(self.order), process))
+
+    def run_gui_steps(self):
+        """
+        Run one step of every job that has to run on the GUI thread; called once per GUI frame by the NodeEditor.
+        """
+        with self.lock:
+            jobs = list(self.gui_jobs)
+        for process in jobs:
+            if process.parked and not process.stop_request.is_set():
+                continue
+            process.thread = threading.current_thread()
+            n_resumes = self.n_resumes
+            more = process.step()
+            with self.lock:
+                if not more:
+                    self.gui_jobs.remove(process)
+                elif process.parked and n_resumes != self.n_resumes:
+                    process.parked = False
+
+    def resume_parked(self):
+        """
+        Queue the jobs that were parked (see BackgroundProcess.park) again, e.g. when new frames were acquired.
+        """
+        with self.lock:
+            self.n_resumes += 1
+            parked = [process for process in self.parked if not process.stop_request.is_set()]
+            self.parked = list()
+            for process in parked + self.gui_jobs:
+                process.parked = False
+        for process in parked:
+            self.queue.put((process.priority, next(self.order), process))
+
+    def get_jobs(self):
+        """
+        :return: list of the jobs that are queued or running.
+        """
+        with self.lock:
+            self.jobs = [job for job in self.jobs if not job.done]
+            return list(self.jobs)
+
+    def stop_all(self):
+        for job in self.get_jobs():
+            job.stop()
+
+
+job_engine = JobEngine(settings.job_engine_workers)
@@ -79,6 +79,7 @@ class NodeEditor:
             for node in cfg.nodes:
                 node.clear_flags()
                 node.on_update()
+            job_engine.run_gui_steps()
         else:
             pass
         if cfg.focused_node is not None:
@@ -269,6 +270,7 @@ class NodeEditor:
                     try:
                         filename = filedialog.askopenfilename(filetypes=[("scNodes setup", ".scn")])
                         if filename != '':
+                            job_engine.stop_all()
                             cfg.nodes = list()
                             NodeEditor.append_node_setup(filename)
                     except Exception as e:
@@ -290,6 +292,7 @@ class NodeEditor:
                 if len(NodeEditor.PREFAB_SETUPS) > 0 and imgui.begin_menu("Preconfigured setups"):
                     for key in NodeEditor.PREFAB_SETUPS:
                         if imgui.menu_item(key)[0]:
+                            job_engine.stop_all()
                             cfg.nodes = list()
                             NodeEditor.append_node_setup(NodeEditor.PREFAB_SETUPS[key])
                     imgui.end_menu()
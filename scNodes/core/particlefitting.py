@@ -1,212 +1,178 @@
 import numpy as np
-import pygpufit.gpufit as gf
+from scNodes.core import cpufit
 from scNodes.core.util import tic, toc
+try:
+    import pygpufit.gpufit as gf
+except ImportError:
+    gf = None  # pyGpufit requires CUDA; without it, only the CPU fitter (core/cpufit.py) is available.
 
 
-def frame_to_particles(frame, initial_sigma=2.0, method=0, crop_radius=4, constraints=(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1), uncertainty_estimator=0, camera_offset=0, detected_maxima_values=None):
+def get_fitter(use_gpu):
+    if not use_gpu:
+        return cpufit
+    if gf is None:
+        raise Exception("pyGpufit is not available on this system - select one of the CPU estimators instead.")
+    return gf
+
+
+def frame_to_particles(frame, initial_sigma=2.0, method=0, crop_radius=4, constraints=(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1), uncertainty_estimator=0, camera_offset=0, detected_maxima_values=None, use_gpu=True):
     """
     uncertainty_type: 0 for Thompson et al. 2002, 1 for Mortsensen et al. 2010
+    use_gpu: if True, fit with pyGpufit, else with the CPU implementation in core/cpufit.py
     """
-    def get_background_stdev(flat_roi, fitted_params):
-        gauss = np.empty_like(flat_roi)
-        k = int(np.sqrt(gauss.shape[0])) // 2
-        denom = 2 * fitted_params[3] ** 2
-        i = 0
-        for x in range(-k, k + 1):
-            for y in range(-k, k + 1):
-                gauss[i] = np.exp(-((fitted_params[2] - x) ** 2 + (fitted_params[1] - y) ** 2) / denom)
-                i += 1
-        gauss = gauss * fitted_params[0] / (np.pi * denom) + fitted_params[4]
-        # note on the above formula: fitted_params[0] is peak_intensity for GPUfit, but we've turned it in to integrated_itensity in the main function,
-        # before calling get_background_stdev. So the factor 1/ (np.pi * denom) is there to turn it back into peak intensity.
-        background = flat_roi - gauss
-        return np.std(background)
-
-    if len(frame.maxima) == 0:
-        return list()
-    pxd = frame.load()
-    width, height = pxd.shape
+    return frames_to_particles([frame], initial_sigma, method, crop_radius, constraints, uncertainty_estimator, camera_offset, [detected_maxima_values], use_gpu, elliptical=False)[0]
 
-    # Filter maxima and convert to floored int.
-    xy = list()
-    n_particles = 0
-    for i in range(frame.maxima.shape[0]):
-        if (0 + crop_radius) < frame.maxima[i, 0] < (width - crop_radius - 1) and (0 + crop_radius) < frame.maxima[i, 1] < (height - crop_radius - 1):
-            x, y = np.floor(frame.maxima[i, :]).astype(int)
-            xy.append([x, y])
-            n_particles += 1
 
-    # Prepare data for gpufit
-    data = np.empty((n_particles, (crop_radius * 2 + 1)**2), dtype=np.float32)
-    params = np.empty((n_particles, 5), dtype=np.float32)
-    original_image_intensity = np.zeros(n_particles, dtype=np.float32)
-    for i in range(n_particles):
-        x, y = xy[i]
-        data[i, :] = pxd[x - crop_radius:x + crop_radius + 1, y - crop_radius:y + crop_radius + 1].flatten() - camera_offset
-        initial_offset = data[i, :].min()
-        initial_intensity = pxd[x, y] - initial_offset
-        params[i, :] = [initial_intensity, crop_radius, crop_radius, initial_sigma, initial_offset]
-
-        original_image_intensity[i] = pxd[x, y]
-    estimator = gf.EstimatorID.LSE if method == 0 else gf.EstimatorID.MLE
-
-    # Set up constraints
-    constraint_type, constraint_values = parse_constraints(constraints, n_particles, crop_radius)
-    parameters, states, chi_squares, number_iterations, execution_time = gf.fit_constrained(data, None,
-                                                                                            gf.ModelID.GAUSS_2D, params,
-                                                                                            estimator_id=estimator,
-                                                                                            max_number_iterations=100,
-                                                                                            constraint_types=constraint_type,
-                                                                                            constraints=constraint_values)
-    xy = np.asarray(xy)
-    parameters[:, 0] *= 2 * np.pi * parameters[:, 3]**2  # scaling from (maximum value of gaussian) to (number of photons)
-    parameters[:, 1:3] -= crop_radius
-    if np.sum(states == 0) == 0:
-        return list()
-
-    if uncertainty_estimator == 0:
-        background_stdev = np.empty(n_particles)
-        for i in range(n_particles):
-            background_stdev[i] = get_background_stdev(data[i, :], parameters[i, :])
-
-    parameters[:, 1] += xy[:, 1]  # offsetting back into image coordinates (rather than crop coordinates)
-    parameters[:, 2] += xy[:, 0]  # offsetting back into image coordinates
-    converged = states == 0
-
-    frame_particle_data = dict()
-    accepted_particles = np.zeros_like(parameters[:, 3])
-    for i in range(parameters[:, 3].shape[0]):
-        accepted_particles[i] = converged[i] and parameters[i, 3] != constraint_values[0, 7]
-    n_particles = int(accepted_particles.sum(0))
-    accepted_particles = accepted_particles.nonzero()
-
-    if detected_maxima_values is not None:
-        frame_particle_data["detection intensity"] = detected_maxima_values[accepted_particles].squeeze().tolist()
-        frame_particle_data["original intensity"] = original_image_intensity[accepted_particles].squeeze().tolist()
-
-    frame_particle_data["frame"] = list(np.ones(n_particles, dtype=np.float32) * frame.framenr) if n_particles>0 else []
-    frame_particle_data["x [nm]"] = parameters[accepted_particles, 1].squeeze().tolist()
-    frame_particle_data["y [nm]"] = parameters[accepted_particles, 2].squeeze().tolist()
-    frame_particle_data["sigma [nm]"] = parameters[accepted_particles, 3].squeeze().tolist()
-    frame_particle_data["intensity [counts]"] = parameters[accepted_particles, 0].squeeze().tolist()
-    frame_particle_data["offset [counts]"] = parameters[accepted_particles, 4].squeeze().tolist()
-    if uncertainty_estimator == 0:
-        frame_particle_data["bkgstd [counts]"] = background_stdev[accepted_particles].squeeze().tolist()
-    frame_particle_data["chi_square"] = chi_squares[accepted_particles].squeeze().tolist()
-    if n_particles == 1:
-        for key in frame_particle_data:
-            frame_particle_data[key] = [frame_particle_data[key]] # very ugly solution to single-element lists causing downstream problems
-    return frame_particle_data
-
-def frame_to_particles_3d(frame, initial_sigma=2.0, method=0, crop_radius=4, constraints=(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1), uncertainty_estimator=0, camera_offset=0, detected_maxima_values=None):
+def frame_to_particles_3d(frame, initial_sigma=2.0, method=0, crop_radius=4, constraints=(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1), uncertainty_estimator=0, camera_offset=0, detected_maxima_values=None, use_gpu=True):
     """
     frame_to_particles_3d differs from frame_to_particles in the model that is used:
-    gf.ModelID.GAUSS_2D_ELLIPTIC vs. gf.ModelID.GAUSS_2D
+    ModelID.GAUSS_2D_ELLIPTIC vs. ModelID.GAUSS_2D
     the parameters for GAUSS_2D_ELLIPTIC are: [amplitude, x, y, sigma x, sigma y, offset]
     """
-    def get_background_stdev(flat_roi, fitted_params):
-        gauss = np.empty_like(flat_roi)
-        k = int(np.sqrt(gauss.shape[0])) // 2
-        denom_x = 2 * fitted_params[3] ** 2
-        denom_y = 2 * fitted_params[4] ** 2
-        fit_x = fitted_params[2]
-        fit_y = fitted_params[1]
-        i = 0
-        for x in range(-k, k + 1):
-            for y in range(-k, k + 1):
-                gauss[i] = np.exp(-((fit_x - x)**2 / denom_x + (fit_y - y)**2 / denom_y))
-                np.exp(-((fit_x - x)**2 / denom_x + (fit_y - y)**2 / denom_y))
-                i += 1
-        gauss = gauss * fitted_params[0] / (2 * np.pi * fitted_params[3] * fitted_params[4]) + fitted_params[5]
-        background = flat_roi - gauss
-        return np.std(background)
-
-    if len(frame.maxima) == 0:
-        return list()
-    pxd = frame.load()
-    width, height = pxd.shape
+    return frames_to_particles([frame], initial_sigma, method, crop_radius, constraints, uncertainty_estimator, camera_offset, [detected_maxima_values], use_gpu, elliptical=True)[0]
+
+
+def frames_to_particles(frames, initial_sigma=2.0, method=0, crop_radius=4, constraints=None, uncertainty_estimator=0, camera_offset=0, detected_maxima_values=None, use_gpu=True, elliptical=False):
+    """
+    Fit the particles in a list of frames with a single call to the fitter: the ROIs of all frames are gathered into one
+    batch, fitted, and the results are split up per frame again. Batching many frames reduces the per-call overhead of the
+    fitter, which otherwise dominates when frames contain only a few hundred particles.
+    :param frames: list of Frame objects, with their maxima set.
+    :param detected_maxima_values: None, or a list with the maxima_values (or None) for every frame.
+    :param elliptical: if True, fit the GAUSS_2D_ELLIPTIC model (see frame_to_particles_3d), else GAUSS_2D.
+    Other parameters: see frame_to_particles.
+    :return: list with, for every frame in frames, the dict of particle parameters (numpy arrays) for that frame - or an empty list if no particles were found. Frames without ROIs (no maxima, or all maxima within crop_radius of the edge) add no rows to the batch.
+    """
+    n_params = 6 if elliptical else 5
+    if constraints is None:
+        constraints = [-1] * 2 * n_params
+    if detected_maxima_values is None:
+        detected_maxima_values = [None] * len(frames)
 
-    # Filter maxima and convert to floored int.
+    # Gather the ROIs of all frames.
     xy = list()
-    n_particles = 0
-    for i in range(frame.maxima.shape[0]):
-        if (0 + crop_radius) < frame.maxima[i, 0] < (width - crop_radius - 1) and (0 + crop_radius) < frame.maxima[i, 1] < (height - crop_radius - 1):
-            x, y = np.floor(frame.maxima[i, :]).astype(int)
-            xy.append([x, y])
-            n_particles += 1
+    data = list()
+    original_image_intensity = list()
+    detection_intensity = list()
+    for frame, maxima_values in zip(frames, detected_maxima_values):
+        if len(frame.maxima) == 0:
+            xy.append(np.zeros((0, 2), dtype=int))
+            data.append(np.zeros((0, (crop_radius * 2 + 1)**2), dtype=np.float32))
+            original_image_intensity.append(np.zeros(0, dtype=np.float32))
+            detection_intensity.append(np.zeros(0, dtype=np.float32))
+            continue
+        pxd = frame.load()
+        _xy, _in_bounds, _data = extract_rois(pxd, frame.maxima, crop_radius, camera_offset)
+        xy.append(_xy)
+        data.append(_data)
+        original_image_intensity.append(pxd[_xy[:, 0], _xy[:, 1]].astype(np.float32))
+        detection_intensity.append(np.asarray(maxima_values)[_in_bounds] if maxima_values is not None else None)
+    n_rois_per_frame = np.asarray([_xy.shape[0] for _xy in xy], dtype=int)
+    n_particles = int(np.sum(n_rois_per_frame))
+    if n_particles == 0:
+        return [list() for _ in frames]
+    xy = np.concatenate(xy)
+    data = np.concatenate(data)
+    original_image_intensity = np.concatenate(original_image_intensity)
+    framenr = np.repeat(np.asarray([frame.framenr for frame in frames], dtype=np.int32), n_rois_per_frame)
 
     # Prepare data for gpufit
-    data = np.empty((n_particles, (crop_radius * 2 + 1)**2), dtype=np.float32)
-    params = np.empty((n_particles, 6), dtype=np.float32)
-    original_image_intensity = np.zeros(n_particles, dtype=np.float32)
-    for i in range(n_particles):
-        x, y = xy[i]
-        data[i, :] = pxd[x - crop_radius:x + crop_radius + 1, y - crop_radius:y + crop_radius + 1].flatten() - camera_offset
-        initial_offset = data[i, :].min()
-        initial_intensity = pxd[x, y] - initial_offset
-        params[i, :] = [initial_intensity, crop_radius, crop_radius, initial_sigma, initial_sigma, initial_offset]
-
-        original_image_intensity[i] = pxd[x, y]
-    estimator = gf.EstimatorID.LSE if method == 0 else gf.EstimatorID.MLE
+    initial_offset = data.min(axis=1)
+    params = np.empty((n_particles, n_params), dtype=np.float32)
+    params[:, 0] = original_image_intensity - initial_offset
+    params[:, 1:3] = crop_radius
+    params[:, 3:n_params - 1] = initial_sigma
+    params[:, n_params - 1] = initial_offset
+    fitter = get_fitter(use_gpu)
+    estimator = fitter.EstimatorID.LSE if method == 0 else fitter.EstimatorID.MLE
+    model_id = fitter.ModelID.GAUSS_2D_ELLIPTIC if elliptical else fitter.ModelID.GAUSS_2D
 
     # Set up constraints
-    constraint_type, constraint_values = parse_constraints_3d(constraints, n_particles, crop_radius)
-    parameters, states, chi_squares, number_iterations, execution_time = gf.fit_constrained(data, None,
-                                                                                            gf.ModelID.GAUSS_2D_ELLIPTIC, params,
+    if elliptical:
+        constraint_type, constraint_values = parse_constraints_3d(constraints, n_particles, crop_radius)
+    else:
+        constraint_type, constraint_values = parse_constraints(constraints, n_particles, crop_radius)
+    parameters, states, chi_squares, number_iterations, execution_time = fitter.fit_constrained(data, None,
+                                                                                            model_id, params,
                                                                                             estimator_id=estimator,
                                                                                             max_number_iterations=100,
                                                                                             constraint_types=constraint_type,
                                                                                             constraints=constraint_values)
-    xy = np.asarray(xy)
-    parameters[:, 0] *= 2 * np.pi * parameters[:, 3] * parameters[:, 4]  # scaling from (maximum value of gaussian) to integral over that function
-    parameters[:, 1:3] -= crop_radius
-    if np.sum(states == 0) == 0:
-        return list()
-
     if uncertainty_estimator == 0:
-        background_stdev = np.empty(n_particles)
-        for i in range(n_particles):
-            background_stdev[i] = get_background_stdev(data[i, :], parameters[i, :])
+        background_stdev = get_background_stdev(data, parameters, model_id)
 
+    if elliptical:
+        parameters[:, 0] *= 2 * np.pi * parameters[:, 3] * parameters[:, 4]  # scaling from (maximum value of gaussian) to integral over that function
+    else:
+        parameters[:, 0] *= 2 * np.pi * parameters[:, 3]**2  # scaling from (maximum value of gaussian) to (number of photons)
+    parameters[:, 1:3] -= crop_radius
     parameters[:, 1] += xy[:, 1]  # offsetting back into image coordinates (rather than crop coordinates)
     parameters[:, 2] += xy[:, 0]  # offsetting back into image coordinates
-    converged = states == 0
-
-    ## 230207
-    frame_particle_data = dict()
-    accepted_particles = np.zeros_like(parameters[:, 3])
-    for i in range(parameters[:, 3].shape[0]):
-        accepted_particles[i] = converged[i] and parameters[i, 3] != constraint_values[0, 7]
-    n_particles = int(accepted_particles.sum(0))
-
-    accepted_particles = accepted_particles.nonzero()
-
-    if detected_maxima_values is not None:
-        frame_particle_data["detection intensity"] = detected_maxima_values[accepted_particles].squeeze().tolist()
-        frame_particle_data["original intensity"] = original_image_intensity[accepted_particles].squeeze().tolist()
-
-    frame_particle_data["frame"] = list(np.ones(n_particles, dtype=np.float32) * frame.framenr)
-    frame_particle_data["x [nm]"] = parameters[accepted_particles, 1].squeeze().tolist()
-    frame_particle_data["y [nm]"] = parameters[accepted_particles, 2].squeeze().tolist()
-    frame_particle_data["sigma [nm]"] = parameters[accepted_particles, 3].squeeze().tolist()
-    frame_particle_data["intensity [counts]"] = parameters[accepted_particles, 0].squeeze().tolist()
-    frame_particle_data["offset [counts]"] = parameters[accepted_particles, 5].squeeze().tolist()
-    if uncertainty_estimator == 0:
-        frame_particle_data["bkgstd [counts]"] = background_stdev[accepted_particles].squeeze().tolist()
-    frame_particle_data["sigma2 [nm]"] = parameters[accepted_particles, 4].squeeze().tolist()
-    frame_particle_data["chi_square"] = chi_squares[accepted_particles].squeeze().tolist()
-    if n_particles == 1:
-        for key in frame_particle_data:
-            frame_particle_data[key] = list[2 * frame_particle_data[key]] # very ugly solution to single-element lists causing downstream problems
+    accepted = (states == 0) & (parameters[:, 3] != constraint_values[0, 7])
+
+    # Split the results back up per frame.
+    particles = list()
+    roi_offsets = np.concatenate([[0], np.cumsum(n_rois_per_frame)])
+    for i in range(len(frames)):
+        a, b = roi_offsets[i], roi_offsets[i + 1]
+        accepted_particles = np.flatnonzero(accepted[a:b]) + a
+        if accepted_particles.size == 0:
+            particles.append(list())
+            continue
+        frame_particle_data = dict()
+        if detection_intensity[i] is not None:
+            frame_particle_data["detection intensity"] = detection_intensity[i][accepted_particles - a]
+            frame_particle_data["original intensity"] = original_image_intensity[accepted_particles]
+        frame_particle_data["frame"] = framenr[accepted_particles]
+        frame_particle_data["x [nm]"] = parameters[accepted_particles, 1]
+        frame_particle_data["y [nm]"] = parameters[accepted_particles, 2]
+        frame_particle_data["sigma [nm]"] = parameters[accepted_particles, 3]
+        frame_particle_data["intensity [counts]"] = parameters[accepted_particles, 0]
+        frame_particle_data["offset [counts]"] = parameters[accepted_particles, n_params - 1]
+        if uncertainty_estimator == 0:
+            frame_particle_data["bkgstd [counts]"] = background_stdev[accepted_particles]
+        if elliptical:
+            frame_particle_data["sigma2 [nm]"] = parameters[accepted_particles, 4]
+        frame_particle_data["chi_square"] = chi_squares[accepted_particles]
+        particles.append(frame_particle_data)
+    return particles
+
+
+def extract_rois(pxd, maxima, crop_radius, camera_offset=0):
+    """
+    Gather the (2 * crop_radius + 1)^2 pixel crops around every maximum in one fancy-indexing operation.
+    :return: tuple (xy, in_bounds, data): (n, 2) int array of the (floored) coordinates of the maxima that are far enough from
+    the image edge to be cropped, boolean mask of length len(maxima) selecting those maxima, and the (n, n_points) float32
+    array of flattened crops (minus camera_offset), in the layout expected by gpufit.
+    """
+    width, height = pxd.shape
+    maxima = np.asarray(maxima).reshape(-1, 2)  # also for an empty list of maxima, which yields no ROIs.
+    in_bounds = (crop_radius < maxima[:, 0]) & (maxima[:, 0] < (width - crop_radius - 1)) & (crop_radius < maxima[:, 1]) & (maxima[:, 1] < (height - crop_radius - 1))
+    xy = np.floor(maxima[in_bounds]).astype(int)
+    offsets = np.arange(-crop_radius, crop_radius + 1)
+    rows = (xy[:, 0, None] + offsets)[:, :, None]
+    cols = (xy[:, 1, None] + offsets)[:, None, :]
+    data = pxd[rows, cols].reshape(xy.shape[0], (2 * crop_radius + 1)**2).astype(np.float32) - np.float32(camera_offset)  # explicit size, as -1 is ambiguous when no maxima are in bounds.
+    return xy, in_bounds, data
+
 
-    return frame_particle_data
+def get_background_stdev(data, parameters, model_id):
+    """
+    :param data: (n, n_points) array of the fitted ROIs
+    :param parameters: (n, n_params) array of parameters as returned by the fitter (i.e., peak amplitude and ROI coordinates)
+    :param model_id: cpufit.ModelID (equal to the gpufit.ModelID) of the fitted model
+    :return: (n,) array with the standard deviation of the fit residual in every ROI.
+    """
+    model = cpufit.evaluate_model(model_id, parameters, data.shape[1])
+    return np.std(data - model, axis=1)
 
 
+# cpufit.ConstraintType values are identical to those of gpufit.ConstraintType, so these are valid for either fitter.
 constraint_type_dict = dict()
-constraint_type_dict[(True, True)] = gf.ConstraintType.FREE
-constraint_type_dict[(False, True)] = gf.ConstraintType.LOWER
-constraint_type_dict[(True, False)] = gf.ConstraintType.UPPER
-constraint_type_dict[(False, False)] = gf.ConstraintType.LOWER_UPPER
+constraint_type_dict[(True, True)] = cpufit.ConstraintType.FREE
+constraint_type_dict[(False, True)] = cpufit.ConstraintType.LOWER
+constraint_type_dict[(True, False)] = cpufit.ConstraintType.UPPER
+constraint_type_dict[(False, False)] = cpufit.ConstraintType.LOWER_UPPER
 
 
 def parse_constraints(constraints, n_particles, crop_radius):
@@ -215,7 +181,7 @@ def parse_constraints(constraints, n_particles, crop_radius):
     c_type_sigma = constraint_type_dict[(constraints[6] == -1.0, constraints[7] == -1.0)]
     c_type_offset = constraint_type_dict[(constraints[8] == -1.0, constraints[9] == -1.0)]
 
-    constraint_types = np.asarray([c_type_intensity, gf.ConstraintType.LOWER_UPPER, gf.ConstraintType.LOWER_UPPER, c_type_sigma, c_type_offset], dtype=np.int32)
+    constraint_types = np.asarray([c_type_intensity, cpufit.ConstraintType.LOWER_UPPER, cpufit.ConstraintType.LOWER_UPPER, c_type_sigma, c_type_offset], dtype=np.int32)
     constraint_values = np.zeros((n_particles, 10), dtype=np.float32)
     constraint_values[:, :] = constraints
     constraint_values[:, 3] = crop_radius*2 + 1
@@ -230,7 +196,7 @@ def parse_constraints_3d(constraints, n_particles, crop_radius):
     c_type_sigma_y = constraint_type_dict[(constraints[8] == -1.0, constraints[9] == -1.0)]
     c_type_offset = constraint_type_dict[(constraints[10] == -1.0, constraints[11] == -1.0)]
 
-    constraint_types = np.asarray([c_type_intensity, gf.ConstraintType.LOWER_UPPER, gf.ConstraintType.LOWER_UPPER, c_type_sigma_x, c_type_sigma_y, c_type_offset], dtype=np.int32)
+    constraint_types = np.asarray([c_type_intensity, cpufit.ConstraintType.LOWER_UPPER, cpufit.ConstraintType.LOWER_UPPER, c_type_sigma_x, c_type_sigma_y, c_type_offset], dtype=np.int32)
     constraint_values = np.zeros((n_particles, 12), dtype=np.float32)
     constraint_values[:, :] = constraints
     constraint_values[:, 3] = crop_radius*2 + 1  # maximum for x
@@ -129,8 +129,17 @@ class Reconstructor:
         sr_image = np.zeros((H, W, 3), dtype=np.float32)
         tiles_x = int(np.ceil(W / w))
         tiles_y = int(np.ceil(H / h))
+        # tiles that contain no particles (taking into account the size of the rendered gaussians) are skipped.
+        max_uncertainty = fixed_uncertainty if fixed_uncertainty is not None else np.nanmax(self.particle_data.parameters['uncertainty [nm]'])
+        margin = 0.5 * Reconstructor.kernel_size * max_uncertainty / self.quad_uncertainty * self.pixel_size
         for i in range(tiles_x):
             for j in range(tiles_y):
+                tile_x_min = (i * w - self.camera_origin[0]) * self.pixel_size - margin
+                tile_y_min = (j * h - self.camera_origin[1]) * self.pixel_size - margin
+                tile_x_max = ((i + 1) * w - self.camera_origin[0]) * self.pixel_size + margin
+                tile_y_max = ((j + 1) * h - self.camera_origin[1]) * self.pixel_size + margin
+                if self.particle_data.query_box(tile_x_min, tile_y_min, tile_x_max, tile_y_max).size == 0:
+                    continue
                 tile = self.render_tile((i, j))
                 sr_image[j * h:min([(j + 1) * h, H]), i * w:min([(i + 1) * w, W]), :] = tile[:min([h, H - j * h]), :min([w, W - i * w]), :]
         self.shader.unbind()
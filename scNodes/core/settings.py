@@ -37,4 +37,7 @@ def_img_size = (2048, 2048)
 
 autocontrast_saturation = 0.03  # Autocontrast will set contrast lims such that this % of pixels is over/under saturated.
 autocontrast_subsample = 2  # Autocontrast works on sub-sampled images to avoid costly computations. When this value is e.g. 2, every 2nd pixel in X/Y is used.
-joblib_mmmode = 'c'
\ No newline at end of file
+joblib_mmmode = 'c'
+working_precision = np.float32  # dtype that frame pixel data is converted to by Frame.load(); set to np.float64 for double precision processing.
+result_cache_size = 1e9  # memory budget (bytes) of the cache of node outputs that is shared by all nodes; see ResultCache in node.py. 0 disables the cache.
+job_engine_workers = 2  # number of worker threads that run long jobs (fitting, baking, exporting) outside of the GUI thread; see JobEngine in node.py.
@@ -21,7 +21,10 @@ class BakeStackNode(Node):
                   "\n" \
                   "When the 'Parallel' option is selected, the node used joblib to process images in parallel on the\n" \
                   "CPU. Some functions are not compatible with joblib - for example the GPU-accelerated registration " \
-                  "or ORB registration can not be parallelized."
+                  "or ORB registration can not be parallelized.\n" \
+                  "\n" \
+                  "With the 'Bake to Zarr' option, the baked frames are stored as one chunked, compressed Zarr array\n" \
+                  "rather than as one .tif file per frame (requires the 'zarr' package)."
     title = "Bake stack"
     group = "Image processing"
     colour = (143 / 255, 143 / 255, 143 / 255, 1.0)
@@ -56,6 +59,9 @@ class BakeStackNode(Node):
         self.scalar_metrics = list()
         self.params["bake_coordinates"] = False
         self.params["load_baked_stack_into_ram"] = False
+        self.params["zarr"] = False
+        self.zarr_writer = None
+        self.bake_start = 0
         self.detection_roi = [0, 0, 1, 1]
 
     def render(self):
@@ -82,6 +88,9 @@ class BakeStackNode(Node):
                 self.connectable_attributes["coordinates_in"].disconnect_all()
 
             _c, self.params["parallel"] = imgui.checkbox("Parallel processing", self.params["parallel"])
+            _c, self.params["zarr"] = imgui.checkbox("Bake to Zarr", self.params["zarr"])
+            self.tooltip("Store the baked frames in a chunked, compressed Zarr array instead of one .tif file per\n"
+                         "frame. Chunks are compressed and written in parallel while the next frames are processed.")
             imgui.set_next_item_width(100)
             _c, self.params["range_option"] = imgui.combo("Range to bake", self.params["range_option"], BakeStackNode.RANGE_OPTIONS)
             if self.params["range_option"] == 1:
@@ -89,9 +98,13 @@ class BakeStackNode(Node):
                 _c, (self.params["custom_range_min"], self.params["custom_range_max"]) = imgui.input_int2('[start, top) index', self.params["custom_range_min"], self.params["custom_range_max"])
                 imgui.pop_item_width()
                 
-            clicked, self.baking = self.play_button()
-            if clicked and self.baking:
+            clicked, play = self.play_button()
+            if clicked and play:
+                self.baking = True
                 self.init_bake()
+            elif clicked:
+                self.baking = False
+                self.stop_job()
 
             if self.baking:
                 imgui.text("Baking process:")
@@ -123,6 +136,11 @@ class BakeStackNode(Node):
                     if '.' in fpath[-5:]:
                         fpath = fpath[:fpath.rfind(".")]
                 # now copy the files from the temp folder to the requested folder
+                if is_zarr_path(self.dataset.path):
+                    shutil.copytree(self.dataset.path, fpath + ".zarr", dirs_exist_ok=True)
+                    for metrics in glob.glob(self.temp_dir + "/*_metrics.json"):
+                        shutil.copy(metrics, fpath + ".zarr")
+                    return
                 if not os.path.isdir(fpath):
                     os.mkdir(fpath)
                 imglist = glob.glob(self.temp_dir +"/*.tif*")
@@ -146,6 +164,24 @@ class BakeStackNode(Node):
             return False
         return False
 
+    def get_image_data(self, idx=None):
+        """
+        Process a frame without saving it, for baking to Zarr: the frame is written by the ZarrWriter in the main process.
+        :return: tuple (pixel data, scalar metrics, coordinates or False).
+        """
+        datasource = self.connectable_attributes["dataset_in"].get_incoming_node()
+        frame = datasource.get_image(idx)
+        pxd = frame.load()
+        coordinates = False
+        if self.params["bake_coordinates"]:
+            coordsource = self.connectable_attributes["coordinates_in"].get_incoming_node()
+            coordinates = coordsource.get_coordinates(idx)
+            self.detection_roi = coordsource.get_roi()
+        return pxd, frame.scalar_metrics, coordinates
+
+    def get_cache_state(self):
+        return self.temp_dir, self.has_dataset, self.has_coordinates
+
     def get_roi(self):
         return self.detection_roi
 
@@ -153,12 +189,15 @@ class BakeStackNode(Node):
         print(f"BakeStacknode get_image_impl idx ={idx}")
         if self.has_dataset and idx in range(0, self.dataset.n_frames):
             print("Has dataset and index is within range. Returning baked frame.")
-            retimg = copy.deepcopy(self.dataset.get_indexed_image(idx))
+            retimg = self.dataset.get_indexed_image(idx).view()
             retimg.clean()
             if self.has_coordinates:
                 retimg.maxima = self.coordinates[idx]
             # load scalar metrics
-            metrics_path = retimg.path[:retimg.path.rfind(".tif")]+"_metrics.json"
+            if is_zarr_path(retimg.path):
+                metrics_path = self.temp_dir + "/0" + str(retimg.index) + "_metrics.json"
+            else:
+                metrics_path = retimg.path[:retimg.path.rfind(".tif")]+"_metrics.json"
             with open(metrics_path, 'r') as file:
                 retimg.scalar_metrics = json.load(file)
             return retimg
@@ -176,6 +215,8 @@ class BakeStackNode(Node):
             return self.coordinates[idx]
 
     def init_bake(self):
+        self.stop_job()
+        self.abort_zarr_writer()  # the writer of a bake that was stopped before it was done.
         del self.dataset
         self.dataset = None
         self.temp_dir = self.gen_temp_dir_name()
@@ -193,15 +234,54 @@ class BakeStackNode(Node):
         elif self.params["range_option"] == 1:
             self.frames_to_bake = list(range(self.params["custom_range_min"], self.params["custom_range_max"]))
         self.n_baked = 0
+        if self.params["zarr"] and len(self.frames_to_bake) > 0:
+            # Frame i of the Zarr array is frame frames_to_bake[0] + i of the input.
+            self.bake_start = self.frames_to_bake[0]
+            try:
+                sample = self.connectable_attributes["dataset_in"].get_incoming_node().get_image(self.bake_start).load()
+                self.zarr_writer = ZarrWriter(self.temp_dir + "/baked.zarr", len(self.frames_to_bake), sample.shape, sample.dtype)
+            except Exception as e:
+                self.baking = False
+                self.play = False
+                cfg.set_error(e, "Error baking stack: \n"+str(e))
         self.baked_at = datetime.datetime.now().strftime("%H:%M")
         self.n_to_bake = max([1, len(self.frames_to_bake)])
 
+    def abort_zarr_writer(self):
+        if self.zarr_writer is not None:
+            writer = self.zarr_writer
+            self.zarr_writer = None
+            writer.abort()
+
     def on_update(self):
+        if self.baking and not self.job_running():
+            self.start_job(self.bake_step)
+
+    def bake_step(self, process):
+        """
+        Bake the next batch of frames; called repeatedly by the job engine while baking (see Node.start_job).
+        :return: True while baking.
+        """
         if self.baking:
             if cfg.profiling:
                 time_start = time.time()
             try:
-                if self.params["parallel"]:
+                if self.zarr_writer is not None:
+                    indices = list()
+                    for i in range(min([cfg.batch_size if self.params["parallel"] else 1, len(self.frames_to_bake)])):
+                        indices.append(self.frames_to_bake.pop())
+                    if self.params["parallel"]:
+                        results = self.parallel_process(self.get_image_data, indices)
+                    else:
+                        results = [result for _, result in ExecutionPlan(self).evaluate(indices, self.get_image_data)]
+                    coordinates = list()
+                    for idx, (pxd, scalar_metrics, _coordinates) in zip(indices, results):
+                        self.zarr_writer.write(idx - self.bake_start, pxd)
+                        with open(self.temp_dir + "/0" + str(idx - self.bake_start) + "_metrics.json", 'w') as file:
+                            json.dump(scalar_metrics, file, indent=2)
+                        coordinates.append(_coordinates)
+                    self.n_baked += len(indices)
+                elif self.params["parallel"]:
                     indices = list()
                     for i in range(min([cfg.batch_size, len(self.frames_to_bake)])):
                         self.n_baked += 1
@@ -211,7 +291,7 @@ class BakeStackNode(Node):
                 else:
                     index = self.frames_to_bake[-1]
                     self.frames_to_bake.pop()
-                    coordinates = [self.get_image_and_save(index)]
+                    coordinates = [result for _, result in ExecutionPlan(self).evaluate([index], self.get_image_and_save)]
                     self.n_baked += 1
                 if self.params["bake_coordinates"]:
                     self.coordinates += coordinates  # coordinates is a list of lists. in the end, self.coordinates will be a list of length [amount of frames], with a sublist of xy coords for every img.
@@ -220,7 +300,13 @@ class BakeStackNode(Node):
                     self.profiler_count += len(indices)
                 if len(self.frames_to_bake) == 0:
                     # Load dataset from temp dir.
-                    self.dataset = Dataset(self.temp_dir + "/00.tif")
+                    if self.zarr_writer is not None:
+                        writer = self.zarr_writer
+                        self.zarr_writer = None
+                        writer.close()
+                        self.dataset = Dataset(writer.path)
+                    else:
+                        self.dataset = Dataset(self.temp_dir + "/00.tif")
                     if self.params["load_baked_stack_into_ram"]:
                         for frame in self.dataset.frames:
                             frame.load()
@@ -232,9 +318,12 @@ class BakeStackNode(Node):
                         self.coordinates.reverse()
                         self.has_coordinates = True
             except Exception as e:
+                self.abort_zarr_writer()
                 self.baking = False
                 self.play = False
                 cfg.set_error(e, "Error baking stack: \n"+str(e))
+            process.set_progress(self.n_baked / self.n_to_bake)
+        return self.baking
 
     def pre_pickle_impl(self):
         cfg.pickle_temp["dataset"] = self.dataset
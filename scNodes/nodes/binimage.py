@@ -49,20 +49,35 @@ class BinImageNode(Node):
         if data_source:
             image_in = data_source.get_image(idx)
             pxd = image_in.load()
-            width, height = pxd.shape
-            pxd = pxd[:self.params["factor"] * (width // self.params["factor"]), :self.params["factor"] * (height // self.params["factor"])]
-            if self.params["mode"] == 0:
-                pxd = pxd.reshape((width // self.params["factor"], self.params["factor"], height // self.params["factor"], self.params["factor"])).mean(3).mean(1)
-            elif self.params["mode"] == 1:
-                pxd = pxd.reshape((width // self.params["factor"], self.params["factor"], height // self.params["factor"], self.params["factor"]))
-                pxd = np.median(pxd, axis=(3, 1))
-            elif self.params["mode"] == 2:
-                pxd = pxd.reshape((width // self.params["factor"], self.params["factor"], height // self.params["factor"], self.params["factor"])).min(3).min(1)
-            elif self.params["mode"] == 3:
-                pxd = pxd.reshape((width // self.params["factor"], self.params["factor"], height // self.params["factor"], self.params["factor"])).max(3).max(1)
-            elif self.params["mode"] == 4:
-                pxd = pxd.reshape((width // self.params["factor"], self.params["factor"], height // self.params["factor"], self.params["factor"])).sum(3).sum(1)
             image_out = image_in.clone()
-            image_out.data = pxd
+            image_out.data = self.bin(pxd)
             return image_out
 
+    def get_images_impl(self, indices):
+        data_source = self.connectable_attributes["dataset_in"].get_incoming_node()
+        if data_source:
+            stack = data_source.get_images(indices)
+            if stack is not None:
+                return self.bin(stack)
+
+    def bin(self, pxd):
+        """
+        :param pxd: array with the pixel data of a frame, or a (N, W, H) stack of frames.
+        :return: the binned pixel data.
+        """
+        factor = self.params["factor"]
+        *n, width, height = pxd.shape
+        pxd = pxd[..., :factor * (width // factor), :factor * (height // factor)]
+        pxd = pxd.reshape(tuple(n) + (width // factor, factor, height // factor, factor))
+        if self.params["mode"] == 0:
+            pxd = pxd.mean(-1).mean(-2)
+        elif self.params["mode"] == 1:
+            pxd = np.median(pxd, axis=(-1, -3))
+        elif self.params["mode"] == 2:
+            pxd = pxd.min(-1).min(-2)
+        elif self.params["mode"] == 3:
+            pxd = pxd.max(-1).max(-2)
+        elif self.params["mode"] == 4:
+            pxd = pxd.sum(-1).sum(-2)
+        return pxd
+
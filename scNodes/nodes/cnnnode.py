@@ -20,6 +20,8 @@ class CNNNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output depends on the loaded model, which is not part of the params.
+        self.NODE_IS_THREAD_SAFE = False  # the model may be (re)compiled or trained while frames are requested.
         self.size = 210
 
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent=self)
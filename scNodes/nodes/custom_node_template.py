@@ -23,6 +23,7 @@ class CustomNode(Node):
     def __init__(self):
         super().__init__()  # In this line the init function of the Node parent class is called (can be found in node.py) - you can ignore it but it must be called.
         self.size = 300  # Set the horizontal size of the node.
+        self.NODE_IS_THREAD_SAFE = True  # Long jobs, such as PSF fitting, request frames from worker threads while the image viewer requests frames on the GUI thread. Set this flag to False if get_image_impl uses OpenGL or stores state between calls; jobs that depend on the node then run on the GUI thread.
 
         # defining in- and output attributes.
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent=self)  # In this example the node has two 'connectable attributes': a dataset input and output.
@@ -166,11 +166,7 @@ class DiagnosticPlotsNode(Node):
                 else:
                     plt.title(f'Scatter plot of particle {self.available_parameters[self.params["x_param"]]} vs {self.available_parameters[self.params["y_param"]]}')
             elif self.params["plot_type"] == 2:
-                f = particledata.parameters["frame"]
-                frames = np.array(range(int(np.amin(f)), int(np.amax(f))))
-                counts = np.zeros_like(frames)
-                for i, fi in enumerate(frames):
-                    counts[i] = np.sum(f == fi)
+                frames, counts = particledata.get_frame_counts()
                 plt.plot(frames, counts)
                 plt.plot(frames, np.cumsum(counts) / np.sum(counts) * np.amax(counts))
                 plt.xlabel("Frame")
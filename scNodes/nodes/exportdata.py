@@ -13,12 +13,15 @@ class ExportDataNode(Node):
                   "as either a tif(stack) or a .csv file in the case of Reconstructions. When the\n" \
                   "'Parallel' option is selected, frames are processed in parallel on the CPU using\n" \
                   "joblib. Not all functions are compatible with parallel processing; see also the \n" \
-                  "Bake Stack node description."
+                  "Bake Stack node description. Stacks are saved either as a folder of .tif files or as a chunked,\n" \
+                  "compressed Zarr array (<path>.zarr, requires the 'zarr' package)."
     title = "Export data"
     group = "Data IO"
     colour = (138 / 255, 8 / 255, 8 / 255, 1.0)
     sortid = 5
 
+    EXPORT_FORMATS = ["tif files", "Zarr"]
+
     def __init__(self):
         super().__init__()
         self.size = 210
@@ -36,6 +39,8 @@ class ExportDataNode(Node):
         self.batch_size = 1
 
         self.params["parallel"] = True
+        self.params["export_format"] = 0  # 0 for a folder of .tif files, 1 for a Zarr array; see EXPORT_FORMATS.
+        self.zarr_writer = None
         self.returns_image = False
         self.does_profiling_count = False
         self.FLAG_CHANGE_UPON_ROI_CHANGE = False
@@ -76,6 +81,10 @@ class ExportDataNode(Node):
                     self.params["path"] = filename
             if self.params["export_type"] == 0:
                 _c, self.params["parallel"] = imgui.checkbox("Parallel", self.params["parallel"])
+                imgui.set_next_item_width(100)
+                _c, self.params["export_format"] = imgui.combo("Format", self.params["export_format"], ExportDataNode.EXPORT_FORMATS)
+                self.tooltip("Save the stack as a folder with one .tif file per frame, or as a single Zarr array\n"
+                             "(<path>.zarr) in which chunks of frames are compressed and written in parallel.")
             content_width = imgui.get_window_width()
             save_button_width = 85
             save_button_height = 25
@@ -96,18 +105,34 @@ class ExportDataNode(Node):
             else:
                 if imgui.button("Cancel", save_button_width, save_button_height):
                     self.saving = False
+                    self.stop_job()
+                    self.close_zarr_writer()
             super().render_end()
 
     def get_img_and_save(self, idx):
-        img_pxd = self.get_image_impl(idx)
-        if self.use_roi:
-            img_pxd = img_pxd[self.roi[1]:self.roi[3], self.roi[0]:self.roi[2]]
+        img_pxd = self.get_image_impl(idx, roi=self.roi if self.use_roi else None)
         Image.fromarray(img_pxd).save(self.params["path"]+"/0"+str(idx)+".tif")
 
+    def get_roi_image(self, idx):
+        return self.get_image_impl(idx, roi=self.roi if self.use_roi else None)
+
+    def close_zarr_writer(self):
+        if self.zarr_writer is not None:
+            writer = self.zarr_writer
+            self.zarr_writer = None
+            writer.close()
+
+    def abort_zarr_writer(self):
+        if self.zarr_writer is not None:
+            writer = self.zarr_writer
+            self.zarr_writer = None
+            writer.abort()
+
     def do_save(self):
         if cfg.profiling:
             time_start = time.time()
         if self.params["export_type"] == 0:  # Save stack
+            self.stop_job()
             self.saving = True
             #if self.include_discarded_frames:
                 #n_active_frames = Node.get_source_load_data_node(self).dataset.n_frames
@@ -118,13 +143,18 @@ class ExportDataNode(Node):
                 self.frames_to_load.append(i)
             self.n_frames_to_save = len(self.frames_to_load)
             self.n_frames_saved = 0
-            if not os.path.isdir(self.params["path"]):
+            if self.params["export_format"] == 1:
+                try:
+                    sample = self.get_roi_image(self.frames_to_load[0])
+                    self.zarr_writer = ZarrWriter(self.params["path"] + ".zarr", self.n_frames_to_save, sample.shape, sample.dtype)
+                except Exception as e:
+                    self.saving = False
+                    cfg.set_error(e, "Error saving stack: \n"+str(e))
+            elif not os.path.isdir(self.params["path"]):
                 os.mkdir(self.params["path"])
         elif self.params["export_type"] == 1:  # Save image
             img = self.connectable_attributes["dataset_in"].get_incoming_node().get_image(idx=None)
-            img_pxd = img.load()
-            if self.use_roi:
-                img_pxd = img_pxd[self.roi[1]:self.roi[3], self.roi[0]:self.roi[2]]
+            img_pxd = img.load_roi(self.roi if self.use_roi else None)
             try:
                 util.save_tiff(img_pxd, self.params["path"] + ".tif", pixel_size_nm=img.pixel_size)
             except Exception as e:
@@ -139,9 +169,31 @@ class ExportDataNode(Node):
             self.profiler_time += time.time() - time_start
 
     def on_update(self):
+        if self.saving and not self.job_running():
+            # Exports run in the background, so other jobs (e.g. fitting) go first.
+            self.start_job(self.save_step, BackgroundProcess.PRIORITY_LOW)
+
+    def save_step(self, process):
+        """
+        Save the next batch of frames; called repeatedly by the job engine while saving (see Node.start_job).
+        :return: True while saving.
+        """
         if self.saving:
             try:
-                if self.params["parallel"]:
+                if self.zarr_writer is not None:
+                    # Frames are processed here (in parallel by joblib if selected), and compressed and written by the
+                    # ZarrWriter's worker threads.
+                    indices = list()
+                    for i in range(min([cfg.batch_size if self.params["parallel"] else self.batch_size, len(self.frames_to_load)])):
+                        indices.append(self.frames_to_load.pop())
+                    if self.params["parallel"]:
+                        images = self.parallel_process(self.get_roi_image, indices)
+                    else:
+                        images = [img_pxd for _, img_pxd in ExecutionPlan(self).evaluate(indices, self.get_roi_image)]
+                    for idx, img_pxd in zip(indices, images):
+                        self.zarr_writer.write(idx, img_pxd)
+                    self.n_frames_saved += len(indices)
+                elif self.params["parallel"]:
                     indices = list()
                     for i in range(min([cfg.batch_size, len(self.frames_to_load)])):
                         self.n_frames_saved += 1
@@ -149,22 +201,26 @@ class ExportDataNode(Node):
                         self.frames_to_load.pop()
                     self.parallel_process(self.get_img_and_save, indices)
                 else:
-                    for i in range(min([self.batch_size, len(self.frames_to_load)])):
+                    batch = self.frames_to_load[:-self.batch_size - 1:-1]
+                    for _ in ExecutionPlan(self).evaluate(batch, self.get_img_and_save):
                         self.n_frames_saved += 1
-                        self.get_img_and_save(self.frames_to_load[-1])
                         self.frames_to_load.pop()
 
                 if len(self.frames_to_load) == 0:
                     self.saving = False
+                    self.close_zarr_writer()
             except Exception as e:
                 self.saving = False
+                self.abort_zarr_writer()
                 cfg.set_error(e, "Error saving stack: \n"+str(e))
+            process.set_progress(self.n_frames_saved / self.n_frames_to_save)
+        return self.saving
 
-    def get_image_impl(self, idx=None):
+    def get_image_impl(self, idx=None, roi=None):
         data_source = self.connectable_attributes["dataset_in"].get_incoming_node()
         if data_source:
             incoming_img = data_source.get_image(idx)
             if incoming_img:
-                img_pxd = incoming_img.load()
+                img_pxd = incoming_img.load_roi(roi)
                 incoming_img.clean()
                 return img_pxd
\ No newline at end of file
@@ -18,6 +18,7 @@ class GetImageNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output is the image that is stored in the node.
         self.size = 200
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT,parent=self)
         self.connectable_attributes["image_out"] = ConnectableAttribute(ConnectableAttribute.TYPE_IMAGE, ConnectableAttribute.OUTPUT, parent=self)
@@ -61,24 +61,7 @@ class ImageCalculatorNode(Node):
             if source_a and source_b:
                 img_a = source_a.get_image(idx)
                 img_b = source_b.get_image(idx)
-                img_a_pxd = img_a.load()
-                img_b_pxd = img_b.load()
-
-                w = min([img_a_pxd.shape[0], img_b_pxd.shape[0]])
-                h = min([img_a_pxd.shape[1], img_b_pxd.shape[1]])
-
-                img_a_pxd = img_a_pxd[:w, :h]
-                img_b_pxd = img_b_pxd[:w, :h]
-
-                img_out = None
-                if self.params["operation"] == 0:
-                    img_out = img_a_pxd + img_b_pxd
-                elif self.params["operation"] == 1:
-                    img_out = img_a_pxd - img_b_pxd
-                elif self.params["operation"] == 2:
-                    img_out = img_a_pxd / img_b_pxd
-                elif self.params["operation"] == 3:
-                    img_out = img_a_pxd * img_b_pxd
+                img_out = self.calculate(img_a.load(), img_b.load())
                 if self.connectable_attributes["dataset_in"].current_type != ConnectableAttribute.TYPE_IMAGE:
                     img_a.data = img_out
                     return img_a
@@ -88,3 +71,39 @@ class ImageCalculatorNode(Node):
                     return virtual_frame
         except Exception as e:
             cfg.set_error(Exception(), "ImageCalculatorNode error:\n"+str(e))
+
+    def get_images_impl(self, indices):
+        source_a = self.connectable_attributes["dataset_in"].get_incoming_node()
+        source_b = self.connectable_attributes["input_b"].get_incoming_node()
+        if source_a and source_b:
+            stack_a = source_a.get_images(indices)
+            if self.connectable_attributes["input_b"].current_type == ConnectableAttribute.TYPE_IMAGE:
+                frame_b = source_b.get_image(indices[0])
+                stack_b = frame_b.load()[None, :, :] if frame_b is not None else None
+            else:
+                stack_b = source_b.get_images(indices)
+            if stack_a is not None and stack_b is not None:
+                return self.calculate(stack_a, stack_b)
+
+    def calculate(self, pxd_a, pxd_b):
+        """
+        :param pxd_a: pixel data of a frame, or a (N, W, H) stack of frames.
+        :param pxd_b: pixel data of a frame, or a stack of frames with length N or 1.
+        :return: the result of the node's operation, cropped to the overlap of the frames in A and B.
+        """
+        w = min([pxd_a.shape[-2], pxd_b.shape[-2]])
+        h = min([pxd_a.shape[-1], pxd_b.shape[-1]])
+
+        pxd_a = pxd_a[..., :w, :h]
+        pxd_b = pxd_b[..., :w, :h]
+
+        pxd_out = None
+        if self.params["operation"] == 0:
+            pxd_out = pxd_a + pxd_b
+        elif self.params["operation"] == 1:
+            pxd_out = pxd_a - pxd_b
+        elif self.params["operation"] == 2:
+            pxd_out = pxd_a / pxd_b
+        elif self.params["operation"] == 3:
+            pxd_out = pxd_a * pxd_b
+        return pxd_out
@@ -10,7 +10,10 @@ def create():
 class LoadDataNode(Node):
     description = "Import a tiffstack. Select either a: i) single .tif file that contains stack data (3D, e.g XYZ or XYT), or\n" \
                   "ii) a .tif file inside of a folder containing an image sequence. In this case all of the .tif images in the\n" \
-                  "folder will be loaded as one dataset."
+                  "folder will be loaded as one dataset, or iii) a raw binary .dat or .raw file, with the frame size and\n" \
+                  "data type specified in the node or in a sidecar file '<filename>.json', or iv) a Zarr array or OME-Zarr\n" \
+                  "image (a .zarr folder; drop it onto the node or select its .zarray, .zgroup, or zarr.json file).\n" \
+                  "Zarr support requires the 'zarr' package."
 
     title = "Import dataset"
     group = "Data IO"
@@ -18,7 +21,7 @@ class LoadDataNode(Node):
     colour = (84 / 255, 77 / 255, 222 / 255, 1.0)
 
     sortid = 0
-    IMPORT_BATCH_SIZE = 10
+    RAW_DTYPES = ["uint8", "uint16", "uint32", "int16", "int32", "float32", "float64"]
     
     def __init__(self):
         super().__init__()
@@ -32,13 +35,25 @@ class LoadDataNode(Node):
 
         # Set up node-specific vars
         self.dataset = Dataset()
+        self.dataset_generation = 0  # incremented whenever a file is (re)loaded; part of the cache key, with the dataset's version (see get_cache_state).
         self.params["path"] = ""
         self.params["pixel_size"] = 67.8
         self.pixel_size = self.params["pixel_size"]
         self.params["load_on_the_fly"] = True
-        self.done_loading = False
-        self.to_load_idx = 0
-        self.n_to_load = 1
+        self.params["frame_cache"] = False
+        self.params["frame_cache_gb"] = 4.0
+        self.params["prefetch"] = True
+        self.params["live"] = False
+        self.params["live_interval"] = 1.0
+        self.live_last_poll = 0.0
+        self.loader = None
+        self.n_queued = 0  # number of frames that were handed to a BulkLoader, when not loading on the fly.
+
+        self.params["raw_width"] = 2048
+        self.params["raw_height"] = 2048
+        self.params["raw_dtype"] = 1
+        self.params["raw_offset"] = 0
+        self.params["raw_stride"] = 0
 
         self.params["file_filter_positive_raw"] = ""
         self.params["file_filter_negative_raw"] = ""
@@ -58,9 +73,14 @@ class LoadDataNode(Node):
             if imgui.button("...", 26, 19):
                 selected_file = filedialog.askopenfilename()
                 if type(selected_file) is str:
-                    if get_filetype(selected_file) in ['.tiff', '.tif']:
+                    if os.path.basename(selected_file) in ZARR_METADATA_FILES + [".zattrs"]:  # a Zarr store is a directory; select it by one of its metadata files.
+                        self.params["path"] = os.path.dirname(selected_file)
+                        self.on_select_file()
+                    elif get_filetype(selected_file) in ['.tiff', '.tif'] + RAW_EXTENSIONS:
                         self.params["path"] = selected_file
                         self.on_select_file()
+            if is_raw_file(self.params["path"]):
+                self.render_raw_format()
             imgui.columns(2, border = False)
             imgui.text("frames:")
             imgui.text("image size:")
@@ -90,13 +110,72 @@ class LoadDataNode(Node):
 
             super().render_end()
 
+    def render_raw_format(self):
+        imgui.push_item_width(60)
+        _, self.params["raw_width"] = imgui.input_int("width", self.params["raw_width"], 0, 0)
+        imgui.same_line()
+        _, self.params["raw_height"] = imgui.input_int("height", self.params["raw_height"], 0, 0)
+        _, self.params["raw_dtype"] = imgui.combo("dtype", self.params["raw_dtype"], LoadDataNode.RAW_DTYPES)
+        _, self.params["raw_offset"] = imgui.input_int("header", self.params["raw_offset"], 0, 0)
+        Node.tooltip("Size of the file header, in bytes.")
+        imgui.same_line()
+        _, self.params["raw_stride"] = imgui.input_int("stride", self.params["raw_stride"], 0, 0)
+        Node.tooltip("Number of bytes from the start of one frame to the start of the next.\n"
+                     "Set to 0 if frames are stored back to back, without metadata in between.")
+        imgui.pop_item_width()
+        if imgui.button("Load raw data", 150, 19):
+            self.on_select_file()
+        Node.tooltip("The format specified here is only used when there is no sidecar file\n"
+                     "'<filename>.json' with the values for 'width', 'height', 'dtype' and,\n"
+                     "optionally, 'offset', 'stride', and 'n_frames'.")
+
+    def get_raw_format(self):
+        return {"width": self.params["raw_width"], "height": self.params["raw_height"], "dtype": LoadDataNode.RAW_DTYPES[self.params["raw_dtype"]], "offset": self.params["raw_offset"], "stride": self.params["raw_stride"]}
+
     def render_advanced(self):
-        _, self.params["load_on_the_fly"] = imgui.checkbox("Load on the fly", self.params["load_on_the_fly"])
-        if not self.params["load_on_the_fly"] and not self.done_loading:
-            self.progress_bar(min([self.to_load_idx / self.n_to_load]))
-            imgui.spacing()
-            imgui.spacing()
-            imgui.spacing()
+        _c, self.params["load_on_the_fly"] = imgui.checkbox("Load on the fly", self.params["load_on_the_fly"])
+        if self.params["load_on_the_fly"]:
+            _cc, self.params["frame_cache"] = imgui.checkbox("Cache up to", self.params["frame_cache"])
+            _c = _c or _cc
+            imgui.same_line()
+            imgui.push_item_width(40)
+            _cc, self.params["frame_cache_gb"] = imgui.input_float("GB##cache", self.params["frame_cache_gb"], 0.0, 0.0, format="%.1f")
+            imgui.pop_item_width()
+            self.params["frame_cache_gb"] = max([0.0, self.params["frame_cache_gb"]])
+            _c = _c or _cc
+            Node.tooltip("When loading on the fly, keep the most recently used frames in memory, up to the given\n"
+                         "total size. Frames that are used again are then not re-read from disk.")
+            if self.params["frame_cache"]:
+                imgui.text(f"cached: {self.dataset.cache.n_bytes / 1e9:.2f} GB, hit rate: {self.dataset.cache.hit_rate() * 100.0:.0f}%")
+            _cc, self.params["prefetch"] = imgui.checkbox("Read ahead", self.params["prefetch"])
+            _c = _c or _cc
+            Node.tooltip("When frames are requested in order (e.g. while fitting, exporting, or baking a stack),\n"
+                         "read the next frames from disk in the background while the current one is processed.")
+            if self.params["prefetch"] and self.dataset.prefetcher is not None:
+                prefetcher = self.dataset.prefetcher
+                imgui.text(f"I/O wait: {prefetcher.get_mean_wait_time() * 1000.0:.1f} ms/frame, read ahead: {prefetcher.n_prefetched / max(1, prefetcher.n_requests) * 100.0:.0f}%")
+        if _c:
+            self.update_cache_size()
+        _c, self.params["live"] = imgui.checkbox("Live acquisition", self.params["live"])
+        Node.tooltip("Watch the source for new frames while it is being acquired: pages that are added to the\n"
+                     "selected .tif stack, or new .tif files in the selected folder, are appended to the dataset.\n"
+                     "A PSF fitting node that is fitting all frames then continues with the new frames, until\n"
+                     "live acquisition is switched off.")
+        if self.params["live"]:
+            imgui.same_line()
+            imgui.push_item_width(30)
+            _c, self.params["live_interval"] = imgui.input_float("s##live", self.params["live_interval"], 0.0, 0.0, format="%.1f")
+            imgui.pop_item_width()
+            self.params["live_interval"] = max([0.1, self.params["live_interval"]])
+            Node.tooltip("Interval between checks for new frames.")
+        if not self.params["load_on_the_fly"] and self.loader is not None:
+            if not self.loader.done:
+                self.progress_bar(self.loader.get_progress())
+                imgui.spacing()
+                imgui.spacing()
+                imgui.spacing()
+            frames_per_s, mb_per_s = self.loader.get_throughput()
+            imgui.text(f"loading: {frames_per_s:.0f} frames/s, {mb_per_s:.0f} MB/s")
 
         imgui.text("Title must contain:")
         av_width = imgui.get_content_region_available_width()
@@ -129,54 +208,92 @@ class LoadDataNode(Node):
                 self.dataset.current_frame = self.dataset.frames.index(original_active_frame)
             self.any_change = True
 
+    def update_cache_size(self):
+        if self.params["load_on_the_fly"]:
+            use_cache = self.params["frame_cache"]
+            self.dataset.set_cache_size(int(self.params["frame_cache_gb"] * 1e9) if use_cache else 0)
+            if self.loader is not None:
+                self.loader.stop()
+                self.loader = None
+        else:
+            self.dataset.set_cache_size(np.iinfo(np.int64).max)  # all frames are loaded into the cache, see on_update.
+            self.n_queued = 0
+        use_prefetcher = self.params["load_on_the_fly"] and self.params["prefetch"]
+        if use_prefetcher != (self.dataset.prefetcher is not None):
+            self.dataset.set_prefetching(use_prefetcher)
+
+    def get_cache_state(self):
+        return self.dataset_generation, self.dataset.version
+
     def on_receive_drop(self, files):
         self.params["path"] = files[0]
         self.on_select_file()
 
     def on_select_file(self):
         try:
-            self.dataset = Dataset(self.params["path"], self.params["pixel_size"])
-            self.n_to_load = self.dataset.n_frames
-            self.done_loading = False
-            self.to_load_idx = 0
+            self.dataset.set_prefetching(False)
+            if self.loader is not None:
+                self.loader.stop()
+                self.loader = None
+            self.dataset = Dataset(self.params["path"], self.params["pixel_size"], raw_format=self.get_raw_format())
+            self.dataset_generation += 1
+            self.update_cache_size()
             self.any_change = True
             cfg.image_viewer.center_image_requested = True
             cfg.set_active_node(self)
         except Exception as e:
-            cfg.set_error(e, f"Error importing '{self.params['path']}' as tif stack. Are you sure the data is .tif and at most 3 dimensional (x, y, z/t)?")
+            cfg.set_error(e, f"Error importing '{self.params['path']}' as tif stack. Are you sure the data is .tif and at most 3 dimensional (x, y, z/t)? For raw data, check the specified format.")
 
     def get_image_impl(self, idx=None):
         if self.dataset.n_frames > 0:
-            retimg = copy.deepcopy(self.dataset.get_indexed_image(idx))
+            frame = self.dataset.get_indexed_image(idx)
+            retimg = frame.view()
             retimg.pixel_size = self.params["pixel_size"]
             retimg.clean()
+            if not self.params["load_on_the_fly"] or self.params["frame_cache"] or self.params["prefetch"]:
+                retimg.raw_data = self.dataset.get_frame_data(idx)  # converted to the working precision (as a copy) once the data is used, in Frame.load()
             return retimg
         else:
             return None
 
+    def get_images_impl(self, indices):
+        if self.dataset.n_frames == 0:
+            return None
+        stack = None
+        for i, idx in enumerate(indices):
+            raw_data = self.dataset.get_frame_data(idx)
+            if stack is None:
+                stack = np.empty((len(indices),) + raw_data.shape, dtype=settings.working_precision)
+            stack[i] = raw_data
+        return stack
+
     def on_update(self):
-        if not self.params["load_on_the_fly"] and not self.done_loading:
-            if cfg.profiling:
-                time_start = time.time()
-                self.profiler_count += 1
-            if self.to_load_idx < self.dataset.n_frames:
-                self.dataset.get_indexed_image(self.to_load_idx).load()
-                self.to_load_idx += 1
-                for i in range(LoadDataNode.IMPORT_BATCH_SIZE):
-                    if self.to_load_idx < self.dataset.n_frames:
-                        self.dataset.get_indexed_image(self.to_load_idx).load()
-                        self.to_load_idx += 1
-            else:
-                self.done_loading = True
-            if cfg.profiling:
-                self.profiler_time += time.time() - time_start
+        if self.params["live"] and self.dataset.initialized and time.time() - self.live_last_poll > self.params["live_interval"]:
+            self.live_last_poll = time.time()
+            try:
+                if self.dataset.refresh() > 0:
+                    job_engine.resume_parked()  # e.g. a PSF fitting job that is waiting for new frames.
+            except Exception as e:
+                self.params["live"] = False
+                cfg.set_error(e, f"Error while checking '{self.params['path']}' for new frames - live acquisition was switched off.")
+        if not self.params["load_on_the_fly"] and self.dataset.initialized:
+            if self.loader is not None and self.loader.error is not None:
+                cfg.set_error(self.loader.error, f"Error loading '{self.params['path']}' - see details below.")
+                self.loader.error = None
+            if self.n_queued < self.dataset.n_frames and (self.loader is None or self.loader.done):
+                self.loader = BulkLoader(self.dataset, range(self.n_queued, self.dataset.n_frames), n_workers=cfg.n_cpus)
+                self.n_queued = self.dataset.n_frames
+                self.loader.start()
 
     def pre_pickle_impl(self):
         cfg.pickle_temp["dataset"] = self.dataset
+        cfg.pickle_temp["loader"] = self.loader
         self.dataset = Dataset()
+        self.loader = None
 
     def post_pickle_impl(self):
         self.dataset = cfg.pickle_temp["dataset"]
+        self.loader = cfg.pickle_temp["loader"]
 
     def on_load(self):
         if self.params["path"] != "":
@@ -184,7 +301,12 @@ class LoadDataNode(Node):
 
     def extra_context_menu_options(self):
         if imgui.menu_item("Append dataset")[0]:
-            selected_file = filedialog.askopenfilename()
-            if type(selected_file) is str:
-                if get_filetype(selected_file) in ['.tiff', '.tif']:
-                    self.dataset.append_dataset(selected_file)
+            selected_files = filedialog.askopenfilenames()
+            if type(selected_files) is tuple:
+                try:
+                    for selected_file in sorted(selected_files, key=numerical_sort):
+                        if get_filetype(selected_file) in ['.tiff', '.tif'] + RAW_EXTENSIONS:
+                            self.dataset.append_dataset(selected_file)
+                    self.any_change = True
+                except Exception as e:
+                    cfg.set_error(e, "Error appending dataset - see details below.")
@@ -16,6 +16,7 @@ class LoadImageNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output is the image that was loaded by the node.
         self.size = 200
 
         # Set up connectable attributes
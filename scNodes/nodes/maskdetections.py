@@ -12,6 +12,7 @@ class MaskDetectionsNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output depends on the mask image.
         self.size = 250
 
         self.connectable_attributes["coordinates_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_COORDINATES, ConnectableAttribute.INPUT, parent=self)
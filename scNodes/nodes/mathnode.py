@@ -40,6 +40,13 @@ class MathNode(Node):
         self.params["replace_inf_by"] = 0
         self.params["replace_inf"] = False
 
+    def get_cache_key(self):
+        # Thresholding records the range of the image viewer's frame in params['last_image_min'/'last_image_max'], for the
+        # threshold slider; a cached frame would leave that range stale (and the key changes with it anyway).
+        if self.params["operation"] == 3:
+            return None
+        return super().get_cache_key()
+
     def render(self):
         if super().render_start():
             self.connectable_attributes["dataset_in"].render_start()
@@ -104,37 +111,50 @@ class MathNode(Node):
         if datasource:
             img_in = datasource.get_image(idx)
             pxd = img_in.load()
+            if self.params["operation"] == 3 and self.FRAME_REQUESTED_BY_IMAGE_VIEWER:
+                self.params["last_image_min"] = np.amin(pxd)
+                self.params["last_image_max"] = np.amax(pxd)
+            img_out = img_in.clone()
+            img_out.data = self.apply_operation(pxd)
+            return img_out
 
-            if self.params["operation"] == 0:
-                pxd = pxd ** self.params["power"]
-            elif self.params["operation"] == 1:
-                pxd = np.log(pxd)
-            elif self.params["operation"] == 2:
-                pxd = - pxd
-            elif self.params["operation"] == 3:
-                if self.FRAME_REQUESTED_BY_IMAGE_VIEWER:
-                    self.params["last_image_min"] = np.amin(pxd)
-                    self.params["last_image_max"] = np.amax(pxd)
-                if self.params["threshold_keep_high"]:
-                    if self.params["threshold_make_mask"]:
-                        pxd = pxd < self.params["threshold"]
-                    else:
-                        pxd[pxd < self.params["threshold"]] = self.params["threshold_fill_value"]
+    def get_images_impl(self, indices):
+        datasource = self.connectable_attributes["dataset_in"].get_incoming_node()
+        if datasource:
+            stack = datasource.get_images(indices)
+            if stack is not None:
+                return self.apply_operation(stack)
+
+    def apply_operation(self, pxd):
+        """
+        :param pxd: array with the pixel data of a frame, or a stack of frames; may be edited in place.
+        :return: the result of the node's operation.
+        """
+        if self.params["operation"] == 0:
+            pxd = pxd ** self.params["power"]
+        elif self.params["operation"] == 1:
+            pxd = np.log(pxd)
+        elif self.params["operation"] == 2:
+            pxd = - pxd
+        elif self.params["operation"] == 3:
+            if self.params["threshold_keep_high"]:
+                if self.params["threshold_make_mask"]:
+                    pxd = pxd < self.params["threshold"]
                 else:
-                    if self.params["threshold_make_mask"]:
-                        pxd = pxd >= self.params["threshold"]
-                    else:
-                        pxd[pxd >= self.params["threshold"]] = self.params["threshold_fill_value"]
-            elif self.params["operation"] == 4:
-                pxd += self.params["constant"]
-            elif self.params["operation"] == 5:
-                pxd *= self.params["factor"]
-            elif self.params["operation"] == 6:
-                pxd = np.abs(pxd)
-
-            # replace nan and inf
-            _inf_val = self.params["replace_inf_by"] if self.params["replace_inf"] else None
-            np.nan_to_num(pxd, copy=False, nan=self.params["replace_nan_by"], posinf = _inf_val, neginf = _inf_val)
-            img_out = img_in.clone()
-            img_out.data = pxd
-            return img_out
\ No newline at end of file
+                    pxd[pxd < self.params["threshold"]] = self.params["threshold_fill_value"]
+            else:
+                if self.params["threshold_make_mask"]:
+                    pxd = pxd >= self.params["threshold"]
+                else:
+                    pxd[pxd >= self.params["threshold"]] = self.params["threshold_fill_value"]
+        elif self.params["operation"] == 4:
+            pxd += self.params["constant"]
+        elif self.params["operation"] == 5:
+            pxd *= self.params["factor"]
+        elif self.params["operation"] == 6:
+            pxd = np.abs(pxd)
+
+        # replace nan and inf
+        _inf_val = self.params["replace_inf_by"] if self.params["replace_inf"] else None
+        np.nan_to_num(pxd, copy=False, nan=self.params["replace_nan_by"], posinf = _inf_val, neginf = _inf_val)
+        return pxd
\ No newline at end of file
@@ -78,4 +78,10 @@ class AddMetric(Node):
             frame.scalar_metrics[self.params["metric_name"]] = frame_metric_value
             return frame
 
+    def get_images_impl(self, indices):
+        # The metric is frame metadata; the pixel data is that of the input.
+        source = self.connectable_attributes["dataset_in"].get_incoming_node()
+        if source:
+            return source.get_images(indices)
+
 
@@ -22,6 +22,7 @@ class DiscardFramesNode(Node):
         super().__init__()
 
         self.buffer_last_output = True
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # get_image_impl also sets current_frame_metric_value, which is shown in the node, for the requested frame.
 
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent=self)
         self.connectable_attributes["dataset_out"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.OUTPUT, parent=self)
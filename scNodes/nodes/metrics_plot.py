@@ -16,6 +16,7 @@ class PlotMetricsNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # frames must pass through get_image_impl for their metrics to be plotted.
 
         self.buffer_last_output = True
 
@@ -15,6 +15,7 @@ class NoiseGenNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the noise is different for every request.
         self.size = 180
 
         # Set up connectable attributes
@@ -24,6 +24,7 @@ class ParticleDetectionNode(Node):
 
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent=self)
         self.connectable_attributes["localizations_out"] = ConnectableAttribute(ConnectableAttribute.TYPE_COORDINATES, ConnectableAttribute.OUTPUT, parent=self)
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # get_image_impl also sets threshold_value and active_roi (shown in the node, and used as the fitting node's detection ROI) for the requested frame.
 
 
         self.params["method"] = 0
@@ -103,9 +104,7 @@ class ParticleDetectionNode(Node):
         if source:
             # Find threshold value
             image_obj = source.get_image(idx)
-            image = image_obj.load()
-            if self.use_roi:
-                image = image[self.roi[1]:self.roi[3], self.roi[0]:self.roi[2]]
+            image = image_obj.load_roi(self.roi if self.use_roi else None)
             threshold = self.params["threshold"]
             if self.params["thresholding"] == 1:
                 threshold = self.params["sigmas"] * np.std(image)
@@ -24,6 +24,8 @@ class ParticleFilterNode(Node):
 
         self.available_parameters = ["No data available"]
         self.filters = list()
+        self.mask = None  # the combined mask of all filters, cached until the input data or any of the filters changes.
+        self.mask_key = None
 
         self.returns_image = False
         self.does_profiling_count = False
@@ -105,8 +107,9 @@ class ParticleFilterNode(Node):
         datasource = self.connectable_attributes["reconstruction_in"].get_incoming_node()
         if datasource:
             pdata = datasource.get_particle_data()
-            for pf in self.filters:
-                pf.apply(pdata)
+            mask = self.get_mask(pdata)
+            if mask is not None:
+                np.multiply(pdata.parameters['visible'], mask, out=pdata.parameters['visible'])
             if cfg.profiling:
                 self.profiler_time += time.time() - time_start
             return pdata
@@ -115,8 +118,38 @@ class ParticleFilterNode(Node):
                 self.profiler_time += time.time() - time_start
             return ParticleData()
     
+    def get_mask(self, pdata):
+        """
+        :return: boolean array that is True for the particles that pass every filter, or None if there is nothing to filter.
+        The mask is only recomputed when the particle data or the setting of any of the filters has changed since the last call,
+        and then only the masks of the filters that changed are recomputed.
+        """
+        if len(self.filters) == 0 or pdata.empty or 'visible' not in pdata.parameters:
+            return None
+        mask_key = (id(pdata), pdata.version, tuple(pf.get_mask_key(pdata) for pf in self.filters))
+        if mask_key != self.mask_key:
+            if cfg.profiling:
+                time_start = time.time()
+            mask = np.ones(pdata.n_particles, dtype=bool)
+            for pf in self.filters:
+                pf_mask = pf.get_mask(pdata)
+                if pf_mask is not None:
+                    np.logical_and(mask, pf_mask, out=mask)
+            self.mask = mask
+            self.mask_key = mask_key
+            if cfg.profiling:
+                self.profiler_time += time.time() - time_start
+        return self.mask
+
     def on_load(self):
         self.on_gain_focus()
+
+    def pre_pickle_impl(self):
+        self.mask = None
+        self.mask_key = None
+        for pf in self.filters:
+            pf.mask = None
+            pf.mask_key = None
     
     class Filter:
         def __init__(self, parent):
@@ -128,6 +161,8 @@ class ParticleFilterNode(Node):
             self.parameter = 0
             self.invert = False
             self.parent = parent
+            self.mask = None
+            self.mask_key = None
 
         def set_data(self, vals, bins, prm_key):
             self.vals = vals
@@ -149,6 +184,17 @@ class ParticleFilterNode(Node):
             imgui.separator()
             imgui.spacing()
 
+        def get_mask_key(self, particle_data_object):
+            """The filter's mask depends on the filter settings and on the values of the filtered parameter, which are identified by the array object and the particle data version."""
+            return self.parameter_key, id(particle_data_object.parameters.get(self.parameter_key)), particle_data_object.version, self.min, self.max, self.invert
+
+        def get_mask(self, particle_data_object):
+            mask_key = self.get_mask_key(particle_data_object)
+            if mask_key != self.mask_key:
+                self.mask = particle_data_object.get_filter_mask(self.parameter_key, self.min, self.max, logic_not=self.invert)
+                self.mask_key = mask_key
+            return self.mask
+
         def apply(self, particle_data_object):
             if cfg.profiling:
                 time_start = time.time()
@@ -10,7 +10,7 @@ def create():
 class ParticleFittingNode(Node):
     description = "Perform PSF fitting in the input frames at the location of the input coordinates. This node uses\n" \
                   "'pyGPUfit' for GPU-accelerated fitting. Unfortunately, pyGPUfit uses CUDA, which is not available\n" \
-                  "on many macOS devices.\n" \
+                  "on many macOS devices. On such systems, use one of the (multi-threaded) CPU estimators instead.\n" \
                   "\n" \
                   "The node outputs a 'Reconstruction', which is essentially just a list of particle positions,\n" \
                   "intensities, uncertainties, etc., and which, in scNodes, is a datatype that can be further\n" \
@@ -22,7 +22,10 @@ class ParticleFittingNode(Node):
     size = 300
     sortid = 1001
     RANGE_OPTIONS = ["All frames", "Current frame only", "Custom range", "Random subset"]
-    ESTIMATORS = ["Least squares (GPU)", "Maximum likelihood (GPU)", "No estimator (CPU)"]
+    ESTIMATORS = ["Least squares (GPU)", "Maximum likelihood (GPU)", "No estimator (CPU)", "Least squares (CPU)", "Maximum likelihood (CPU)"]
+    FITTING_ESTIMATORS = [0, 1, 3, 4]
+    GPU_ESTIMATORS = [0, 1]
+    MLE_ESTIMATORS = [1, 4]
     UNCERTAINTY_ESTIMATOR = ["Thompson", "Mortensen"]
     PSFS = ["Gaussian", "Elliptical Gaussian"]
 
@@ -49,8 +52,11 @@ class ParticleFittingNode(Node):
         self.n_fitted = 0
         self.n_frames_discarded = 0
         self.frames_to_fit = list()
+        self.n_frames_queued = 0
         self.particle_data = ParticleData()
         self.params["batch_size"] = 1
+        self.params["roi_batching"] = False
+        self.params["roi_batch_size"] = 50000
         self.time_start = 0
         self.time_stop = 0
 
@@ -85,7 +91,7 @@ class ParticleFittingNode(Node):
             imgui.set_next_item_width(148)
             if self.params["estimator"] != 2:
                 _c, self.params["psf"] = imgui.combo("PSF", self.params["psf"], ParticleFittingNode.PSFS)
-            if self.params["estimator"] in [0, 1]:
+            if self.params["estimator"] in ParticleFittingNode.GPU_ESTIMATORS:
                 imgui.same_line()
                 imgui.button("?", 19, 19)
                 self.tooltip("This node uses pyGpufit, a GPU fitting library by Przybylski et al. Original publication:\n"
@@ -93,7 +99,7 @@ class ParticleFittingNode(Node):
                              "Sci. Rep. 7:15722. doi: 10.1038/s41598-017-15313-9")
             self.any_change = _c or self.any_change
             imgui.push_item_width(80)
-            if self.params["estimator"] in [0, 1]:
+            if self.params["estimator"] in ParticleFittingNode.FITTING_ESTIMATORS:
                 _c, self.params["initial_sigma"] = imgui.input_float("Initial sigma (px)", self.params["initial_sigma"], 0, 0, "%.1f")
                 self.any_change = _c or self.any_change
                 _c, self.params["crop_radius"] = imgui.input_int("Fitting radius (px)", self.params["crop_radius"], 0, 0)
@@ -124,6 +130,7 @@ class ParticleFittingNode(Node):
                 self.init_fit()
             elif _play_btn_clicked and self.fitting:
                 self.fitting = False
+                self.stop_job()
                 self.particle_data.bake()
                 self.any_change = True
 
@@ -154,6 +161,7 @@ class ParticleFittingNode(Node):
                      "Mortensen is faster and better (at least for MLE); Thompson was previously used in scNodes (and ThunderSTORM) and is a legacy mode.\n")
         if _c:
             self.fitting = False  # stop fitting if uncertainty estimator is changed during fitting.
+            self.stop_job()
         self.mark_change(_c)
         imgui.set_next_item_width(50)
         _c, self.params["photons_per_count"] = imgui.input_float("photons per count", self.params["photons_per_count"], 0, 0, "%.2f")
@@ -163,6 +171,14 @@ class ParticleFittingNode(Node):
         imgui.set_next_item_width(50)
         _c, self.params["batch_size"] = imgui.input_int("batch size", self.params["batch_size"], 0, 0)
         self.params["batch_size"] = max([1, self.params["batch_size"]])
+        _c, self.params["roi_batching"] = imgui.checkbox("Batch ROIs across frames", self.params["roi_batching"])
+        self.tooltip("When enabled, the ROIs of many frames are collected and fitted together in one call to the\n"
+                     "fitter, which is much faster than fitting frame by frame when frames contain few particles.\n"
+                     "The 'batch size' setting is then ignored and 'ROIs per batch' is used instead.")
+        if self.params["roi_batching"]:
+            imgui.set_next_item_width(70)
+            _c, self.params["roi_batch_size"] = imgui.input_int("ROIs per batch", self.params["roi_batch_size"], 0, 0)
+            self.params["roi_batch_size"] = max([1, self.params["roi_batch_size"]])
         imgui.spacing()
         _c, self.params["custom_bounds"] = imgui.checkbox("Use custom parameter bounds", self.params["custom_bounds"])
         if _c and self.params["custom_bounds"]:
@@ -200,6 +216,7 @@ class ParticleFittingNode(Node):
 
     def init_fit(self):
         try:
+            self.stop_job()
             self.time_start = time.time()
             dataset_source = Node.get_source_load_data_node(self)
             self.particle_data = ParticleData(dataset_source.pixel_size)
@@ -219,6 +236,7 @@ class ParticleFittingNode(Node):
             elif self.params["range_option"] == 3:
                 self.frames_to_fit = np.random.choice(n_frames, size=min([n_frames, self.params["subset_size"]]), replace=False).tolist()
             self.n_to_fit = len(self.frames_to_fit)
+            self.n_frames_queued = n_frames
             self.n_fitted = 0
             self.n_frames_discarded = 0
         except Exception as e:
@@ -226,16 +244,30 @@ class ParticleFittingNode(Node):
             cfg.set_error(e, "Error in init_fit: "+str(e))
 
     def on_update(self):
+        if self.fitting and not self.job_running():
+            self.start_job(self.fit_step)
+
+    def fit_step(self, process):
+        """
+        Fit the next batch of frames; called repeatedly by the job engine while fitting (see Node.start_job).
+        :return: True while fitting.
+        """
         try:
             if self.fitting:
+                live = self.queue_live_frames()
                 if len(self.frames_to_fit) == 0:
+                    if live:
+                        process.park()  # not called again until the LoadDataNode finds new frames (see JobEngine.resume_parked).
+                        return True
                     self.fitting = False
                     self.play = False
                     self.particle_data.set_reconstruction_roi(np.asarray(self.detection_roi) * self.particle_data.pixel_size)
                     self.particle_data.bake()
+                elif self.params["roi_batching"] and self.params["estimator"] in ParticleFittingNode.FITTING_ESTIMATORS:
+                    self.fit_roi_batch()
                 else:
-                    for i in range(min([self.params["batch_size"], len(self.frames_to_fit)])):
-                        fitted_frame = self.get_image(self.frames_to_fit[-1])
+                    batch = self.frames_to_fit[:-self.params["batch_size"] - 1:-1]
+                    for _, fitted_frame in ExecutionPlan(self).evaluate(batch):
                         self.n_fitted += 1
                         if fitted_frame is not None:
                             particles = fitted_frame.particles
@@ -244,81 +276,141 @@ class ParticleFittingNode(Node):
                                 self.particle_data += particles
                         else:
                             break
+                process.set_progress(self.n_fitted / max(1, self.n_to_fit))
         except Exception as e:
             self.fitting = False
             self.play = False
             cfg.set_error(e, "Error while fitting with PSF fitting node: "+str(e))
+        return self.fitting
 
-    def get_image_impl(self, idx=None):
+    def queue_live_frames(self):
+        """
+        When fitting all frames of a dataset that is in live acquisition mode (see LoadDataNode), add the frames that were
+        acquired since fitting started to the queue.
+        :return: True if the source is live, in which case fitting continues when the queue is empty.
+        """
+        dataset_source = Node.get_source_load_data_node(self)
+        if self.params["range_option"] != 0 or dataset_source is None or not dataset_source.params.get("live", False):
+            return False
+        n_frames = dataset_source.dataset.n_frames
+        if n_frames > self.n_frames_queued:
+            self.frames_to_fit += list(range(n_frames - 1, self.n_frames_queued - 1, -1))  # frames are popped from the end, so the new frames are fitted next and in order.
+            self.n_to_fit += n_frames - self.n_frames_queued
+            self.n_frames_queued = n_frames
+        return True
+
+    def get_frame_with_maxima(self, idx):
+        """
+        :return: the input frame at index idx, with the maxima and maxima values from the coordinate source set; None if either input is not connected.
+        """
         data_source = self.connectable_attributes["dataset_in"].get_incoming_node()
         coord_source = self.connectable_attributes["localizations_in"].get_incoming_node()
-        if data_source and coord_source:
-            frame = data_source.get_image(idx)
-            if self.params["skip_discard"] and frame.discard:
-                frame.particles = None
-                self.n_frames_discarded += 1
-                return frame
-            detection_frame = coord_source.get_image(idx)
-            coordinates = detection_frame.maxima
-            detection_values = detection_frame.maxima_values
-            self.detection_roi = coord_source.get_roi()
-            frame.maxima = coordinates
-            frame.maxima_values = detection_values
-            particles = list()
-            if self.params["estimator"] in [0, 1]:
-                if self.params["psf"] == 0:
-                    particles = pfit.frame_to_particles(frame, self.params["initial_sigma"], self.params["estimator"], self.params["crop_radius"],
-                                                        constraints=[1.0,
-                                                                     self.params["intensity_max"], -1, -1, -1, -1,
-                                                                     self.params["sigma_min"],
-                                                                     self.params["sigma_max"],
-                                                                     1.0,
-                                                                     self.params["offset_max"]],
-                                                        uncertainty_estimator=self.params["uncertainty_estimator"],
-                                                        camera_offset=self.params["camera_offset"],
-                                                        detected_maxima_values=frame.maxima_values)
-                elif self.params["psf"] == 1:
-                    particles = pfit.frame_to_particles_3d(frame, self.params["initial_sigma"], self.params["estimator"], self.params["crop_radius"],
-                                                           constraints=[self.params["intensity_min"],
-                                                                        self.params["intensity_max"], -1, -1, -1, -1,
-                                                                        self.params["sigma_min"],
-                                                                        self.params["sigma_max"],
-                                                                        self.params["sigma_min"],
-                                                                        self.params["sigma_max"],
-                                                                        self.params["offset_min"],
-                                                                        self.params["offset_max"]],
-                                                           uncertainty_estimator=self.params["uncertainty_estimator"],
-                                                           camera_offset=self.params["camera_offset"],
-                                                           detected_maxima_values=frame.maxima_values)
-            elif self.params["estimator"] == 2:
-                x = np.empty(len(frame.maxima))
-                y = np.empty(len(frame.maxima))
-                intensity = np.empty(len(frame.maxima))
-                pxd = frame.load()
-                for i in range(len(frame.maxima)):
-                    intensity[i] = pxd[frame.maxima[i, 0], frame.maxima[i, 1]]
-                    x[i] = frame.maxima[i, 1]
-                    y[i] = frame.maxima[i, 0]
-                particles = dict()
-                particles["x [nm]"] = x
-                particles["y [nm]"] = y
-                particles["intensity [counts]"] = intensity
-            frame.particles = particles
-            new_maxima = list()
-            new_maxima_x = list()
-            new_maxima_y = list()
-            if "x [nm]" in frame.particles:
-                new_maxima_x = frame.particles["x [nm]"]
-            if "y [nm]" in frame.particles:
-                new_maxima_y = frame.particles["y [nm]"]
-            frame.maxima = list()
-            if not len(new_maxima_x) == 1:
-                for _x, _y in zip(new_maxima_x, new_maxima_y):
-                    new_maxima.append([_y, _x])
-                frame.maxima = new_maxima
-            else:
-                frame.maxima = [new_maxima_x[0], new_maxima_y[0]]
+        if not (data_source and coord_source):
+            return None
+        frame = data_source.get_image(idx)
+        if frame is None:
+            return None
+        if self.params["skip_discard"] and frame.discard:
+            self.n_frames_discarded += 1
+            return frame
+        detection_frame = coord_source.get_image(idx)
+        self.detection_roi = coord_source.get_roi()
+        frame.maxima = detection_frame.maxima
+        frame.maxima_values = detection_frame.maxima_values
+        return frame
+
+    def fit_frames(self, frames):
+        """
+        Fit the particles in all of the input frames in one call to the fitter.
+        :return: list with the particle data (dict, or empty list) for every frame.
+        """
+        method = 1 if self.params["estimator"] in ParticleFittingNode.MLE_ESTIMATORS else 0
+        use_gpu = self.params["estimator"] in ParticleFittingNode.GPU_ESTIMATORS
+        if self.params["psf"] == 0:
+            constraints = [1.0,
+                           self.params["intensity_max"], -1, -1, -1, -1,
+                           self.params["sigma_min"],
+                           self.params["sigma_max"],
+                           1.0,
+                           self.params["offset_max"]]
+        else:
+            constraints = [self.params["intensity_min"],
+                           self.params["intensity_max"], -1, -1, -1, -1,
+                           self.params["sigma_min"],
+                           self.params["sigma_max"],
+                           self.params["sigma_min"],
+                           self.params["sigma_max"],
+                           self.params["offset_min"],
+                           self.params["offset_max"]]
+        return pfit.frames_to_particles(frames, self.params["initial_sigma"], method, self.params["crop_radius"],
+                                        constraints=constraints,
+                                        uncertainty_estimator=self.params["uncertainty_estimator"],
+                                        camera_offset=self.params["camera_offset"],
+                                        detected_maxima_values=[frame.maxima_values for frame in frames],
+                                        use_gpu=use_gpu,
+                                        elliptical=self.params["psf"] == 1)
+
+    def fit_roi_batch(self):
+        """
+        Collect frames from self.frames_to_fit until their maxima add up to (at least) params['roi_batch_size'] ROIs, then fit
+        all of these ROIs in a single call to the fitter and add the resulting particles to self.particle_data.
+        """
+        frames = list()
+        n_rois = 0
+        for _, frame in ExecutionPlan(self).evaluate(self.frames_to_fit[::-1], self.get_frame_with_maxima):
+            if frame is None:
+                break
+            self.frames_to_fit.pop()
+            self.n_fitted += 1
+            if frame.discard:
+                continue
+            frames.append(frame)
+            n_rois += len(frame.maxima)
+            if n_rois >= self.params["roi_batch_size"]:
+                break
+        if len(frames) > 0:
+            for particles in self.fit_frames(frames):
+                self.particle_data += particles
+
+    def get_image_impl(self, idx=None):
+        frame = self.get_frame_with_maxima(idx)
+        if frame is None:
+            return None
+        if self.params["skip_discard"] and frame.discard:
+            frame.particles = None
             return frame
+        particles = list()
+        if self.params["estimator"] in ParticleFittingNode.FITTING_ESTIMATORS:
+            particles = self.fit_frames([frame])[0]
+        elif self.params["estimator"] == 2:
+            x = np.empty(len(frame.maxima))
+            y = np.empty(len(frame.maxima))
+            intensity = np.empty(len(frame.maxima))
+            pxd = frame.load()
+            for i in range(len(frame.maxima)):
+                intensity[i] = pxd[frame.maxima[i, 0], frame.maxima[i, 1]]
+                x[i] = frame.maxima[i, 1]
+                y[i] = frame.maxima[i, 0]
+            particles = dict()
+            particles["x [nm]"] = x
+            particles["y [nm]"] = y
+            particles["intensity [counts]"] = intensity
+        frame.particles = particles
+        new_maxima = list()
+        new_maxima_x = list()
+        new_maxima_y = list()
+        if "x [nm]" in frame.particles:
+            new_maxima_x = frame.particles["x [nm]"]
+        if "y [nm]" in frame.particles:
+            new_maxima_y = frame.particles["y [nm]"]
+        frame.maxima = list()
+        if not len(new_maxima_x) == 1:
+            for _x, _y in zip(new_maxima_x, new_maxima_y):
+                new_maxima.append([_y, _x])
+            frame.maxima = new_maxima
+        else:
+            frame.maxima = [new_maxima_x[0], new_maxima_y[0]]
+        return frame
 
     def get_particle_data_impl(self):
         self.particle_data.clean()
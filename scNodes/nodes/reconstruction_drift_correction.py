@@ -117,7 +117,7 @@ class RCCNode(Node):
                 self.frame_x_shift = drift[0]
                 self.frame_y_shift = drift[1]
                 frame_idx = pdata.parameters["frame"].astype(int) - 1
-                if self.params["relative_to_idx"] in frame_idx:
+                if pdata.get_frame_range(self.params["relative_to_idx"] + 1, self.params["relative_to_idx"] + 2).size > 0:
                     self.frame_x_shift -= self.frame_x_shift[self.params["relative_to_idx"]]
                     self.frame_y_shift -= self.frame_y_shift[self.params["relative_to_idx"]]
                 self.particle_dx = self.frame_x_shift[frame_idx]
@@ -186,7 +186,7 @@ def find_peak_in_xcorr(xcorr, fit_roi=5):
 def rcc(particle_data, segments=10, pixel_size=200.0):
     x = particle_data.parameters["x [nm]"]
     y = particle_data.parameters["y [nm]"]
-    f = particle_data.parameters["frame"]
+    frames, _ = particle_data.get_frame_counts()
 
     x_min = np.amin(x)
     x_max = np.amax(x)
@@ -196,7 +196,7 @@ def rcc(particle_data, segments=10, pixel_size=200.0):
     y_range = [y_min, y_max - (y_max - y_min) % pixel_size]
     n_bins_x = int((x_range[1] - x_range[0]) / pixel_size)
     n_bins_y = int((y_range[1] - y_range[0]) / pixel_size)
-    n_frames = int(np.amax(f))
+    n_frames = int(frames[-1])
 
     starting_indices = (np.linspace(0, 1, segments+1) * n_frames).astype(int)
     images = list()
@@ -204,9 +204,9 @@ def rcc(particle_data, segments=10, pixel_size=200.0):
         start = starting_indices[i]
         stop = starting_indices[i+1]
 
-        f_mask = (start <= f) * (f < stop)
-        _x = x[f_mask]
-        _y = y[f_mask]
+        particles = particle_data.get_frame_range(start, stop)
+        _x = x[particles]
+        _y = y[particles]
 
         # generate an image
         img, _, _, _ = plt.hist2d(_x, _y, bins=[n_bins_x, n_bins_y], range=[x_range, y_range])
@@ -295,7 +295,7 @@ def find_peak_in_xcorr(xcorr, fit_roi=5):
 def rcc(particle_data, segments=10, pixel_size=200.0):
     x = particle_data.parameters["x [nm]"]
     y = particle_data.parameters["y [nm]"]
-    f = particle_data.parameters["frame"]
+    frames, _ = particle_data.get_frame_counts()
 
     x_min = np.amin(x)
     x_max = np.amax(x)
@@ -305,7 +305,7 @@ def rcc(particle_data, segments=10, pixel_size=200.0):
     y_range = [y_min, y_max - (y_max - y_min) % pixel_size]
     n_bins_x = int((x_range[1] - x_range[0]) / pixel_size)
     n_bins_y = int((y_range[1] - y_range[0]) / pixel_size)
-    n_frames = int(np.amax(f))
+    n_frames = int(frames[-1])
 
     starting_indices = (np.linspace(0, 1, segments+1) * n_frames).astype(int)
     images = list()
@@ -313,9 +313,9 @@ def rcc(particle_data, segments=10, pixel_size=200.0):
         start = starting_indices[i]
         stop = starting_indices[i+1]
 
-        f_mask = (start <= f) * (f < stop)
-        _x = x[f_mask]
-        _y = y[f_mask]
+        particles = particle_data.get_frame_range(start, stop)
+        _x = x[particles]
+        _y = y[particles]
 
         # generate an image
         img, _, _, _ = plt.hist2d(_x, _y, bins=[n_bins_x, n_bins_y], range=[x_range, y_range])
@@ -23,6 +23,8 @@ class ReconstructionRendererNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output depends on the upstream particle data, which is not determined by upstream params.
+        self.NODE_IS_THREAD_SAFE = False  # the reconstruction is rendered with OpenGL.
 
         self.connectable_attributes["reconstruction_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_RECONSTRUCTION, ConnectableAttribute.INPUT, parent = self)
         self.connectable_attributes["image_out"] = ConnectableAttribute(ConnectableAttribute.TYPE_IMAGE, ConnectableAttribute.OUTPUT, parent = self)
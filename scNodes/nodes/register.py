@@ -25,6 +25,7 @@ class RegisterNode(Node):
     def __init__(self):
         super().__init__()
         self.size = 230
+        self.NODE_IS_THREAD_SAFE = False  # pyGPUreg uses the OpenGL context of the GUI thread, and the reference image is kept between calls.
 
         # Set up connectable attributes
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent = self)
@@ -36,6 +37,7 @@ class RegisterNode(Node):
         self.params["register_method"] = 2
         self.params["reference_method"] = 1
         self.reference_image = None
+        self.reference_roi = None
         self.params["frame"] = 0
         self.roi = [0, 0, 0, 0]
 
@@ -184,22 +186,22 @@ class RegisterNode(Node):
                         input_img.scalar_metrics["y drift (px)"] = input_img.translation[1]
                 return input_img
             if self.params["register_method"] in [0, 1]:
-                if self.reference_image is None:
-                    # Get reference frame according to specified pairing method
+                roi = list(self.roi) if self.use_roi else None
+                if self.reference_image is None or self.reference_roi != roi:
+                    # Get reference frame according to specified pairing method; only the ROI is read, if one is used.
+                    self.reference_roi = roi
                     if self.params["reference_method"] == 2:
-                        self.reference_image = data_source.get_image(idx - 1).load()
+                        self.reference_image = data_source.get_image(idx - 1).load_roi(roi)
                     elif self.params["reference_method"] == 0:
-                        self.reference_image = self.connectable_attributes["image_in"].get_incoming_node().get_image(idx=None).load()
+                        self.reference_image = self.connectable_attributes["image_in"].get_incoming_node().get_image(idx=None).load_roi(roi)
                     elif self.params["reference_method"] == 1:
-                        self.reference_image = data_source.get_image(self.params["frame"]).load()
+                        self.reference_image = data_source.get_image(self.params["frame"]).load_roi(roi)
 
                 # Perform registration according to specified registration method
                 if self.reference_image is not None:
                     template = self.reference_image
-                    image = input_img.load()
-                    if self.use_roi:
-                        template = template[self.roi[1]:self.roi[3], self.roi[0]:self.roi[2]]
-                        image = image[self.roi[1]:self.roi[3], self.roi[0]:self.roi[2]]
+                    input_img.load()  # loaded in full, as the whole image is transformed after registration.
+                    image = input_img.load_roi(roi)
                     if self.params["register_method"] == 0:
                         tmat = self.sr.register(template, image)
                         input_img.translation = [tmat[0][2], tmat[1][2]]
@@ -255,10 +257,11 @@ class RegisterNode(Node):
                     #pyGPUreg.set_template(reference_image)
 
                 # if the template is OK, the ROI is ok, so just grab the incoming image and register.
+                image = input_img.load()  # the full image is sampled after registration, so it is loaded first and load_roi returns a view.
                 sample_data = input_img.load_roi(self.roi)
                 shift = pyGPUreg.register(reference_image, sample_data, apply_shift=False)
                 shift = [float(shift[0]), float(shift[1])]
-                registered_img = pyGPUreg.sample_image_with_shift(input_img.load(), shift=[shift[1], shift[0]], edge_mode=self.params["edge_fill"])
+                registered_img = pyGPUreg.sample_image_with_shift(image, shift=[shift[1], shift[0]], edge_mode=self.params["edge_fill"])
                 input_img.data = registered_img
                 input_img.translation = [shift[1], shift[0]]
                 if self.params["add_drift_metrics"]:
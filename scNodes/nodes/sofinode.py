@@ -24,6 +24,7 @@ class SofiNode(Node):
 
     def __init__(self):
         super().__init__()
+        self.NODE_OUTPUT_IS_CACHEABLE = False  # the output depends on the SOFI image that was computed for the whole stack.
 
         # defining in- and output attributes.
         self.connectable_attributes["dataset_in"] = ConnectableAttribute(ConnectableAttribute.TYPE_DATASET, ConnectableAttribute.INPUT, parent=self)
@@ -127,6 +128,7 @@ class SofiNode(Node):
         # is to get the required data as a numpy array, and save it to disk. This is a bit inefficient.
 
         # If the current stack range settings are the same as before, skip grabbing the stack.
+        self.stop_job()
         self.pysd_current = False
 
         if not os.path.isdir(self.temp_dir):
@@ -148,21 +150,42 @@ class SofiNode(Node):
         self.n_frames_processed = 0
 
     def on_update(self):
-        if self.processing and not self.stack_prepared:
-            datasource = self.connectable_attributes["dataset_in"].get_incoming_node()
-            self.stack[self.frames_requested[0] - self.params["range_min"], :, :] = datasource.get_image(idx = self.frames_requested[0]).load()
-            self.frames_requested.pop()
-            self.n_frames_processed += 1
-            if not self.frames_requested:
-                self.stack_prepared = True
-                # save stack:
-                with tifffile.TiffWriter(self.temp_dir + "/sofistack.tif") as stack_out:
-                    for i in range(self.stack.shape[0]):
-                        stack_out.write(self.stack[i])
-                # then prep the reconstruction
-                self.pysd = pysofi.PysofiData(self.temp_dir, "sofistack.tif")
-                self.pysd_current = True
-                self.build_reconstruction()
+        if self.processing and not self.stack_prepared and not self.job_running():
+            # The reconstruction is what the user is waiting for, so gathering the stack goes before other jobs.
+            self.start_job(self.gather_step, BackgroundProcess.PRIORITY_HIGH)
+
+    def gather_step(self, process):
+        """
+        Copy the next batch of frames into the stack, and build the reconstruction when the stack is complete; called
+        repeatedly by the job engine (see Node.start_job).
+        :return: True while the stack is being gathered.
+        """
+        try:
+            if self.processing and not self.stack_prepared:
+                datasource = self.connectable_attributes["dataset_in"].get_incoming_node()
+                batch = self.frames_requested[:-cfg.batch_size - 1:-1]
+                frames = datasource.get_images(batch)
+                if frames is None:
+                    self.processing = False
+                    return False
+                self.stack[np.asarray(batch) - self.params["range_min"], :, :] = frames
+                del self.frames_requested[-len(batch):]
+                self.n_frames_processed += len(batch)
+                process.set_progress(self.n_frames_processed / self.n_frames_requested)
+                if not self.frames_requested:
+                    self.stack_prepared = True
+                    # save stack:
+                    with tifffile.TiffWriter(self.temp_dir + "/sofistack.tif") as stack_out:
+                        for i in range(self.stack.shape[0]):
+                            stack_out.write(self.stack[i])
+                    # then prep the reconstruction
+                    self.pysd = pysofi.PysofiData(self.temp_dir, "sofistack.tif")
+                    self.pysd_current = True
+                    self.build_reconstruction()
+        except Exception as e:
+            self.processing = False
+            cfg.set_error(e, "Error preparing the SOFI stack: "+str(e))
+        return self.processing and not self.stack_prepared
 
     def build_reconstruction(self):
         if self.params["output_option"] == 0:
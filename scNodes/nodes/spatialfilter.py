@@ -99,8 +99,8 @@ class SpatialFilterNode(Node):
         data_source = self.connectable_attributes["dataset_in"].get_incoming_node()
         if data_source:
             input_image = data_source.get_image(idx)
-            outframe = input_image.clone()
             pxd = input_image.load()
+            outframe = input_image.clone()
             if self.params["filter"] == 0:
                 chosen_wavelet = SpatialFilterNode.WAVELETS[SpatialFilterNode.WAVELET_NAMES[self.params["wavelet"]]]
                 w, h = pxd.shape
@@ -116,7 +116,25 @@ class SpatialFilterNode(Node):
                 pxd = gaussian_filter(pxd, self.params["dog_s1"]) - gaussian_filter(pxd, self.params["dog_s2"])
             elif self.params["filter"] == 4:
                 pxd = gaussian_filter(pxd, self.params["deriv_sigma"], order=self.params["deriv_order"])
-            outframe.data = pxd
+            outframe.data = pxd.astype(settings.working_precision, copy=False)
             return outframe
         else:
             return None
+
+    def get_images_impl(self, indices):
+        # The Gaussian filters are applied to the whole stack at once (with zero width along the frame axis); the wavelet
+        # and median filters are applied per frame.
+        if self.params["filter"] not in [1, 3, 4]:
+            return super().get_images_impl(indices)
+        data_source = self.connectable_attributes["dataset_in"].get_incoming_node()
+        if data_source:
+            stack = data_source.get_images(indices)
+            if stack is None:
+                return None
+            if self.params["filter"] == 1:
+                stack = gaussian_filter(stack, (0, self.params["sigma"], self.params["sigma"]))
+            elif self.params["filter"] == 3:
+                stack = gaussian_filter(stack, (0, self.params["dog_s1"], self.params["dog_s1"])) - gaussian_filter(stack, (0, self.params["dog_s2"], self.params["dog_s2"]))
+            elif self.params["filter"] == 4:
+                stack = gaussian_filter(stack, (0, self.params["deriv_sigma"], self.params["deriv_sigma"]), order=(0, self.params["deriv_order"], self.params["deriv_order"]))
+            return stack.astype(settings.working_precision, copy=False)
@@ -84,10 +84,7 @@ class TemporalFilterNode(Node):
             elif self.params["filter"] == 3:
                 pxd = data_source.get_image(idx).load() - data_source.get_image(self.params["group_size"] * (idx // self.params["group_size"]) + self.params["group_background_index"]).load()
             elif self.params["filter"] == 4:
-                pxd = np.zeros_like(data_source.get_image(idx).load())
-                for i in range(-self.params["window"], self.params["window"] + 1):
-                    pxd += data_source.get_image(idx + i).load()
-                pxd /= (2 * self.params["window"] + 1)
+                pxd = data_source.get_images(range(idx - self.params["window"], idx + self.params["window"] + 1)).mean(axis=0)
 
             if self.params["negative_handling"] == 0:
                 pxd = np.abs(pxd)